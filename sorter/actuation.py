@@ -0,0 +1,233 @@
+import atexit
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+
+from .device_client import device_client
+
+logger = logging.getLogger(__name__)
+
+
+class ActuationScheduler:
+    """
+    Owns the release -> sort -> delayed stop sequence sent to the ESP32.
+
+    Sort requests are queued and executed by a single background thread, so
+    web workers return as soon as a command is queued instead of blocking on
+    the device and the stopper delay. Sorts that arrive while the stopper is
+    still open reuse it: the release is skipped and the pending stop is
+    pushed back by another ``stop_delay`` seconds.
+    """
+
+    def __init__(self, stop_delay=2.0, timeout=2, max_queued=10, history_size=10):
+        """
+        Initialize the scheduler.
+
+        Args:
+            stop_delay (float): Seconds to keep the stopper open after a sort
+            timeout (float): Timeout for each HTTP request to the device
+            max_queued (int): Maximum number of sort sequences waiting to run
+            history_size (int): Number of finished commands kept for status
+        """
+        self.stop_delay = stop_delay
+        self.timeout = timeout
+
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ids = itertools.count(1)
+
+        self._queued = deque()
+        self._in_flight = None
+        self._history = deque(maxlen=history_size)
+        self._stop_due = None
+        self._stop_ip = None
+
+    def schedule_sort(self, ip_address, tomato_type, from_camera=True):
+        """
+        Queue a release -> sort -> delayed stop sequence.
+
+        Args:
+            ip_address (str): Address of the ESP32
+            tomato_type (str): 'ripe' or 'green'
+            from_camera (bool): Whether the sort comes from camera detection
+
+        Returns:
+            dict: The queued command, or None if the queue is full
+        """
+        job = {
+            'id': next(self._ids),
+            'type': tomato_type,
+            'from_camera': from_camera,
+            'ip_address': ip_address,
+            'state': 'queued',
+            'queued_at': time.time(),
+        }
+
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                logger.warning(f"Actuation queue full, dropping {tomato_type} sort")
+                return None
+            self._queued.append(job)
+            self._ensure_worker()
+            return self._public(job)
+
+    def status(self):
+        """Return a snapshot of queued, in-flight and recent commands."""
+        with self._lock:
+            stop_in = None
+            if self._stop_due is not None:
+                stop_in = max(0.0, round(self._stop_due - time.monotonic(), 2))
+            return {
+                'queued': [self._public(job) for job in self._queued],
+                'in_flight': self._public(self._in_flight) if self._in_flight else None,
+                'stopper_open': self._stop_due is not None,
+                'stop_in': stop_in,
+                'recent': [self._public(job) for job in self._history],
+            }
+
+    def shutdown(self, timeout=10.0):
+        """
+        Run the queued sorts and close the stopper now, e.g. at process exit.
+
+        The worker thread is a daemon, so without this a stop that is still
+        waiting out ``stop_delay`` would never be sent and the stopper would
+        stay open.
+
+        Args:
+            timeout (float): Longest time in seconds to wait for the worker
+        """
+        with self._lock:
+            thread = self._thread
+        if thread is None or not thread.is_alive():
+            return
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.error("Actuation queue still full at shutdown, closing the stopper anyway")
+            self._close_stopper()
+            return
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"Actuation worker did not finish within {timeout}s of shutdown")
+
+    def _ensure_worker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='actuation-scheduler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._stop_due is not None:
+                timeout = max(0.0, self._stop_due - time.monotonic())
+
+            try:
+                job = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._close_stopper()
+                continue
+
+            if job is None:
+                # shutdown(): close the stopper without waiting for the delay
+                if self._stop_due is not None:
+                    self._close_stopper()
+                with self._lock:
+                    self._thread = None
+                return
+
+            with self._lock:
+                self._queued.remove(job)
+                self._in_flight = job
+                job['state'] = 'in_flight'
+
+            try:
+                self._execute(job)
+            except Exception as e:
+                logger.error(f"Error running actuation sequence: {str(e)}")
+                with self._lock:
+                    job.update(state='failed', error=str(e))
+
+            with self._lock:
+                self._in_flight = None
+                self._history.append(job)
+
+    def _execute(self, job):
+        ip_address = job['ip_address']
+
+        # Open the stopper unless a previous sort left it open on this device
+        if self._stop_due is None or self._stop_ip != ip_address:
+            if self._stop_due is not None:
+                self._close_stopper()
+            try:
+                self._post(ip_address, 'control', {'command': 'release'})
+            except Exception as e:
+                logger.warning(f"Could not move stopper (release): {e}")
+
+        try:
+            response = self._post(ip_address, 'sort', {
+                'type': job['type'],
+                'from_camera': job['from_camera']
+            })
+            with self._lock:
+                job.update(
+                    state='done' if response.status_code == 200 else 'failed',
+                    status_code=response.status_code
+                )
+        finally:
+            # Close the stopper after the delay, without blocking new sorts
+            with self._lock:
+                self._stop_due = time.monotonic() + self.stop_delay
+                self._stop_ip = ip_address
+
+    def _close_stopper(self):
+        ip_address = self._stop_ip
+        with self._lock:
+            self._stop_due = None
+            self._stop_ip = None
+        try:
+            self._post(ip_address, 'control', {'command': 'stop'})
+        except Exception as e:
+            logger.warning(f"Could not move stopper (stop): {e}")
+
+    def _post(self, ip_address, endpoint, payload):
+        logger.info(f"Sending to ESP32 at {ip_address}/{endpoint}: {payload}")
+        return device_client.post(ip_address, endpoint, payload, timeout=self.timeout)
+
+    @staticmethod
+    def _public(job):
+        return {key: value for key, value in job.items() if key != 'ip_address'}
+
+
+# One scheduler per device, so one line's stopper delay never holds up another
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(device_id=1):
+    """Return the actuation scheduler of a device, creating it on first use."""
+    with _schedulers_lock:
+        scheduler = _schedulers.get(device_id)
+        if scheduler is None:
+            scheduler = _schedulers[device_id] = ActuationScheduler()
+        return scheduler
+
+
+def all_schedulers():
+    """Return the schedulers created so far, by device id."""
+    with _schedulers_lock:
+        return dict(_schedulers)
+
+
+def shutdown_schedulers():
+    """Shut down every scheduler, sending any pending stop."""
+    for scheduler in all_schedulers().values():
+        scheduler.shutdown()
+
+
+atexit.register(shutdown_schedulers)
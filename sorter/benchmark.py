@@ -0,0 +1,259 @@
+import base64
+import platform
+import time
+
+import cv2
+import numpy as np
+
+# BGR colors the detector should classify
+TOMATO_COLORS = {
+    'ripe': (30, 40, 200),
+    'green': (40, 170, 60),
+}
+
+# Tomato radius as a fraction of the frame size
+TOMATO_SIZES = {
+    'small': 0.1,
+    'medium': 0.2,
+    'large': 0.3,
+}
+
+# Background variants: (noise sigma, clutter shapes)
+BACKGROUNDS = {
+    'clean': (0, 0),
+    'noisy': (12, 0),
+    'clutter': (0, 12),
+}
+
+# Stages reported by TomatoDetector timings, in pipeline order
+STAGES = ['base64', 'decode', 'resize', 'hsv', 'blur', 'mask', 'contours', 'shape']
+
+
+def synthetic_frame(width, height, seed=0, tomato_color=(30, 40, 200), size=0.2, noise=0, clutter=0):
+    """
+    Generate a conveyor-like frame with a tomato in the middle.
+
+    Args:
+        width (int): Frame width
+        height (int): Frame height
+        seed (int): Seed for the background noise and clutter
+        tomato_color (tuple): BGR color of the tomato, or None for an empty belt
+        size (float): Tomato radius as a fraction of the frame size
+        noise (float): Standard deviation of Gaussian noise over the whole frame
+        clutter (int): Number of dull background shapes (debris, belt marks)
+
+    Returns:
+        numpy.ndarray: BGR image
+    """
+    rng = np.random.default_rng(seed)
+    image = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+
+    for _ in range(clutter):
+        # Low-saturation browns and greys, plus the odd speck too small to count
+        color = tuple(int(c) for c in rng.integers(50, 140) + rng.integers(-15, 15, 3))
+        center = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        if rng.random() < 0.5:
+            corner = (center[0] + int(rng.integers(10, width // 6)), center[1] + int(rng.integers(10, height // 6)))
+            cv2.rectangle(image, center, corner, color, -1)
+        else:
+            cv2.circle(image, center, int(rng.integers(3, 12)), TOMATO_COLORS['ripe'], -1)
+
+    if tomato_color is not None:
+        axes = (max(1, int(width * size)), max(1, int(height * size)))
+        cv2.ellipse(image, (width // 2, height // 2), axes, 0, 0, 360, tomato_color, -1)
+
+    if noise:
+        noisy = image.astype(np.int16) + rng.normal(0, noise, image.shape).astype(np.int16)
+        image = np.clip(noisy, 0, 255).astype(np.uint8)
+    return image
+
+
+def synthetic_corpus(resolutions, seed=0):
+    """
+    Yield the benchmark corpus: every tomato type, size and background per resolution.
+
+    Args:
+        resolutions (dict): Name -> (width, height)
+        seed (int): Base seed, so runs with the same seed see the same frames
+
+    Yields:
+        dict: name, resolution, expected type (None for an empty belt) and image
+    """
+    cases = [(kind, size) for kind in TOMATO_COLORS for size in TOMATO_SIZES] + [(None, None)]
+    for resolution, (width, height) in resolutions.items():
+        for kind, size in cases:
+            for background, (noise, clutter) in BACKGROUNDS.items():
+                name = f"{kind}-{size}-{background}" if kind else f"empty-{background}"
+                yield {
+                    'name': name,
+                    'resolution': resolution,
+                    'expected': kind,
+                    'image': synthetic_frame(
+                        width, height, seed=seed,
+                        tomato_color=TOMATO_COLORS.get(kind),
+                        size=TOMATO_SIZES.get(size, 0),
+                        noise=noise,
+                        clutter=clutter
+                    ),
+                }
+
+
+def _summarize(samples):
+    return {
+        'mean_ms': float(np.mean(samples)),
+        'median_ms': float(np.median(samples)),
+        'min_ms': float(np.min(samples)),
+        'p95_ms': float(np.percentile(samples, 95)),
+        'fps': float(1000 / np.mean(samples)) if np.mean(samples) > 0 else 0.0,
+    }
+
+
+def time_detect(detector, image, iterations=50):
+    """
+    Measure the per-frame latency of detector.detect().
+
+    Returns:
+        dict: mean, median and min latency in milliseconds
+    """
+    detector.detect(image)  # warm-up
+
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        detector.detect(image)
+        samples.append((time.perf_counter() - start) * 1000)
+
+    return _summarize(samples)
+
+
+def time_stages(func, data, iterations=50):
+    """
+    Measure a detector entry point and the time it spends in each stage.
+
+    Args:
+        func (callable): detect, detect_from_bytes or detect_from_base64
+        data: Its input
+        iterations (int): Timed calls after one warm-up call
+
+    Returns:
+        tuple: (latency summary, median ms per stage, last result)
+    """
+    result = func(data)  # warm-up
+
+    samples = []
+    stages = {}
+    for _ in range(iterations):
+        timings = {}
+        start = time.perf_counter()
+        result = func(data, timings)
+        samples.append((time.perf_counter() - start) * 1000)
+        for stage, elapsed in timings.items():
+            stages.setdefault(stage, []).append(elapsed)
+
+    medians = {stage: float(np.median(stages[stage])) for stage in STAGES if stage in stages}
+    return _summarize(samples), medians, result
+
+
+def benchmark_case(detector, image, iterations=50, quality=90):
+    """
+    Benchmark one frame through detect, detect_from_bytes and detect_from_base64.
+
+    The frame is JPEG-encoded once up front, like a browser upload.
+
+    Returns:
+        dict: Per-entry-point latency and stage medians, plus the detection
+    """
+    encoded = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(encoded).decode()
+
+    report = {}
+    for entry, func, data in [
+        ('detect', detector.detect, image),
+        ('detect_from_bytes', detector.detect_from_bytes, encoded),
+        ('detect_from_base64', detector.detect_from_base64, data_url),
+    ]:
+        latency, stages, result = time_stages(func, data, iterations)
+        report[entry] = dict(latency, stages=stages)
+
+    report['detected'] = result.get('type')
+    report['confidence'] = float(result.get('confidence', 0))
+    return report
+
+
+def run_benchmark(detector, resolutions, iterations=50, seed=0, names=None):
+    """
+    Run the synthetic corpus and collect machine-readable results.
+
+    Args:
+        detector (TomatoDetector): Detector under test
+        resolutions (dict): Name -> (width, height)
+        iterations (int): Timed calls per case and entry point
+        seed (int): Corpus seed
+        names (list): Only run cases whose name contains one of these
+
+    Returns:
+        dict: Environment, detector settings, per-case results and accuracy
+    """
+    cases = []
+    for case in synthetic_corpus(resolutions, seed):
+        if names and not any(name in case['name'] for name in names):
+            continue
+        report = benchmark_case(detector, case['image'], iterations)
+        report.update(
+            name=case['name'],
+            resolution=case['resolution'],
+            expected=case['expected'],
+            correct=report['detected'] == case['expected'],
+        )
+        cases.append(report)
+
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'threads': cv2.getNumThreads(),
+        },
+        'detector': {
+            'sensitivity': detector.sensitivity,
+            'detection_width': detector.detection_width,
+            'roi': list(detector.roi),
+            'pyramid_levels': detector.pyramid_levels,
+            'min_contour_area': detector.min_contour_area,
+        },
+        'iterations': iterations,
+        'seed': seed,
+        'accuracy': sum(case['correct'] for case in cases) / len(cases) if cases else 0.0,
+        'cases': cases,
+    }
+
+
+def compare_results(baseline, current, threshold=0.2, entry='detect_from_bytes'):
+    """
+    Find cases that got slower or changed classification since a baseline run.
+
+    Args:
+        baseline (dict): Earlier run_benchmark() output
+        current (dict): New run_benchmark() output
+        threshold (float): Allowed relative increase of the median latency
+        entry (str): Entry point whose median is compared
+
+    Returns:
+        list: Dicts with case, resolution, reason and the old/new values
+    """
+    previous = {(case['name'], case['resolution']): case for case in baseline.get('cases', [])}
+    regressions = []
+    for case in current['cases']:
+        old = previous.get((case['name'], case['resolution']))
+        if old is None or entry not in old:
+            continue
+        key = {'case': case['name'], 'resolution': case['resolution']}
+
+        before, after = old[entry]['median_ms'], case[entry]['median_ms']
+        if before > 0 and after > before * (1 + threshold):
+            regressions.append(dict(key, reason='latency', before=before, after=after))
+        if old.get('correct') and not case['correct']:
+            regressions.append(dict(key, reason='accuracy', before=old['detected'], after=case['detected']))
+    return regressions
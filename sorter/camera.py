@@ -0,0 +1,261 @@
+import logging
+import threading
+import time
+from collections import deque
+
+import cv2
+from django.db import close_old_connections
+
+from .frame_tracker import fingerprint_frame, gated_result
+from .metrics import frame_seconds, metrics, record_detection
+from .models import ESPDevice
+from .tomato_detector import TomatoDetector
+
+logger = logging.getLogger(__name__)
+
+
+def parse_source(source):
+    """Return a camera index for numeric sources, else the path/URL unchanged."""
+    return int(source) if str(source).isdigit() else source
+
+
+def _rate(times):
+    """Events per second over a deque of monotonic timestamps."""
+    if len(times) < 2 or times[-1] == times[0]:
+        return 0.0
+    return (len(times) - 1) / (times[-1] - times[0])
+
+
+class CameraService:
+    """
+    Headless capture: reads a camera or video file and sorts what it sees.
+
+    A capture thread reads frames with ``cv2.VideoCapture`` and keeps only
+    the newest one; a processing thread takes it and runs the same stages
+    as /api/detect/ (frame tracker, presence gate, TomatoDetector) on the
+    decoded array, with no JPEG encode/decode in between. Confirmed
+    detections are handed to ``on_commit``.
+
+    When processing falls behind, frames the capture thread overwrites
+    are counted as dropped. Video files are paced at their own frame rate
+    by default so they behave like a live camera; ``process_all`` makes the
+    capture thread wait instead, so every frame of a recording is
+    processed.
+    """
+
+    def __init__(self, source, camera='capture', tracker=None, gate=None, on_commit=None,
+                 realtime=None, process_all=False, config_interval=1.0, device_id=None):
+        """
+        Initialize the service.
+
+        Args:
+            source (int | str): Camera index, video file path or stream URL
+            camera (str): Camera identifier for the tracker and gate
+            tracker (FrameTracker): Temporal filter, or None to commit every
+                ripe/green frame
+            gate (PresenceGate): Empty-belt gate, or None to classify every frame
+            on_commit (callable): Called as on_commit(device, tomato_type, result)
+                for each confirmed detection
+            realtime (bool): Pace reads at the source's frame rate (default:
+                only for files)
+            process_all (bool): Never drop frames, wait for processing instead
+            config_interval (float): Seconds between detector config checks
+            device_id (int): Sorter line whose config and actuator are used
+                (default: the default device)
+        """
+        self.source = parse_source(source)
+        self.camera = camera
+        self.tracker = tracker
+        self.gate = gate
+        self.on_commit = on_commit
+        self.is_file = not isinstance(self.source, int)
+        self.realtime = self.is_file if realtime is None else realtime
+        self.process_all = process_all
+        self.config_interval = config_interval
+        self.device_id = device_id
+
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._frame = None
+        self._finished = False
+        self._threads = []
+        self.error = None
+
+        self._device = None
+        self._detector = None
+        self._version = None
+        self._config_checked = 0.0
+
+        self._counts = dict.fromkeys(
+            ['read', 'processed', 'dropped', 'duplicates', 'gated', 'classified', 'detections', 'sorts'], 0
+        )
+        self._read_times = deque(maxlen=60)
+        self._process_times = deque(maxlen=60)
+        self._started = None
+
+    def start(self):
+        """Start the capture and processing threads."""
+        self._started = time.monotonic()
+        self._threads = [
+            threading.Thread(target=self._capture, name='camera-capture', daemon=True),
+            threading.Thread(target=self._process_loop, name='camera-process', daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Ask both threads to finish."""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+    def join(self, timeout=None):
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def is_running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def stats(self):
+        """Return frame counters and the recent capture/processing rates."""
+        with self._cond:
+            stats = dict(self._counts)
+            stats['capture_fps'] = round(_rate(self._read_times), 1)
+            stats['process_fps'] = round(_rate(self._process_times), 1)
+        stats['elapsed'] = round(time.monotonic() - self._started, 1) if self._started else 0.0
+        stats['config_version'] = self._version
+        return stats
+
+    def _capture(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            self.error = f"Could not open video source {self.source!r}"
+            logger.error(self.error)
+            self._finish()
+            return
+
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        interval = 1.0 / fps if self.realtime and fps and fps > 0 else 0
+        next_read = time.monotonic()
+        failures = 0
+
+        try:
+            while not self._stop.is_set():
+                ok, frame = capture.read()
+                if not ok:
+                    if self.is_file:
+                        break
+                    # Live cameras drop out now and then; reopen after a few misses
+                    failures += 1
+                    if failures % 10 == 0:
+                        logger.warning(f"No frames from {self.source!r}, reopening")
+                        capture.release()
+                        capture.open(self.source)
+                    time.sleep(0.1)
+                    continue
+                failures = 0
+
+                with self._cond:
+                    if self.process_all:
+                        while self._frame is not None and not self._stop.is_set():
+                            self._cond.wait(0.1)
+                    if self._frame is not None:
+                        self._counts['dropped'] += 1
+                    self._frame = frame
+                    self._counts['read'] += 1
+                    self._read_times.append(time.monotonic())
+                    self._cond.notify_all()
+
+                if interval:
+                    next_read += interval
+                    delay = next_read - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    else:
+                        next_read = time.monotonic()
+        finally:
+            capture.release()
+            self._finish()
+
+    def _finish(self):
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    def _process_loop(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._frame is None and not self._finished and not self._stop.is_set():
+                        self._cond.wait(0.5)
+                    if self._stop.is_set() or self._frame is None:
+                        return
+                    frame, self._frame = self._frame, None
+                    self._cond.notify_all()
+
+                try:
+                    self._process(frame)
+                except Exception as e:
+                    logger.error(f"Error processing camera frame: {str(e)}")
+        finally:
+            close_old_connections()
+
+    def _refresh_detector(self):
+        now = time.monotonic()
+        if self._detector is not None and now - self._config_checked < self.config_interval:
+            return
+        self._config_checked = now
+
+        # Served from the device cache; rebuild only when the config version moved
+        close_old_connections()
+        self._device = ESPDevice.get_device(self.device_id)
+        if self._device.config_version != self._version:
+            self._detector = TomatoDetector(self._device.detector_config())
+            self._version = self._device.config_version
+
+    def _process(self, frame):
+        started = time.perf_counter() if metrics.enabled else None
+        self._refresh_detector()
+
+        fingerprint = fingerprint_frame(frame) if (self.tracker or self.gate) else None
+        counter = None
+        result = None
+
+        if self.tracker is not None:
+            result = self.tracker.cached_result(self.camera, fingerprint, self._version)
+            if result is not None:
+                counter = 'duplicates'
+
+        if result is None and self.gate is not None and self.gate.is_empty(self.camera, fingerprint):
+            result = gated_result(self._version)
+            counter = 'gated'
+
+        if result is None:
+            timings = {} if started is not None else None
+            result = self._detector.detect(frame, timings)
+            result['config_version'] = self._version
+            counter = 'classified'
+            record_detection(result, timings)
+            if self.gate is not None and result.get('type') is None:
+                self.gate.learn(self.camera, fingerprint)
+
+        commit = None
+        if self.tracker is not None:
+            commit = self.tracker.observe(self.camera, fingerprint, result, counter == 'duplicates')['commit']
+        elif result.get('type') in ('ripe', 'green'):
+            commit = result['type']
+
+        with self._cond:
+            self._counts['processed'] += 1
+            self._counts[counter] += 1
+            if result.get('type') in ('ripe', 'green'):
+                self._counts['detections'] += 1
+            if commit:
+                self._counts['sorts'] += 1
+            self._process_times.append(time.monotonic())
+
+        if started is not None:
+            frame_seconds.observe(time.perf_counter() - started, path='duplicate' if counter == 'duplicates' else counter)
+
+        if commit and self.on_commit is not None:
+            self.on_commit(self._device, commit, result)
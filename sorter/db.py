@@ -0,0 +1,43 @@
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# PRAGMA sets applied to every new SQLite connection, selected with the
+# TOMATO_SQLITE_PROFILE setting. 'production' switches to WAL so dashboard
+# reads no longer block on tomato inserts (and vice versa), relaxes fsyncs
+# to WAL checkpoints, waits for locks instead of failing with "database is
+# locked", and memory-maps the file for reads.
+SQLITE_PROFILES = {
+    'default': {},
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'cache_size': -16000,
+    },
+}
+
+
+def get_sqlite_pragmas():
+    """Return the PRAGMAs for the configured profile plus any overrides."""
+    profile = getattr(settings, 'TOMATO_SQLITE_PROFILE', 'default')
+    if profile not in SQLITE_PROFILES:
+        logger.warning(f"Unknown SQLite profile '{profile}', using defaults")
+        profile = 'default'
+    pragmas = dict(SQLITE_PROFILES[profile])
+    pragmas.update(getattr(settings, 'TOMATO_SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created handler applying the SQLite PRAGMAs."""
+    if connection.vendor != 'sqlite':
+        return
+
+    with connection.cursor() as cursor:
+        for name, value in get_sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
@@ -0,0 +1,351 @@
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from .tomato_detector import TomatoDetector
+
+logger = logging.getLogger(__name__)
+
+
+class DetectorBusy(Exception):
+    """Raised when the detection queue is full and the frame was not accepted."""
+
+
+# Immutable detector configuration of one device. ``settings`` is a sorted
+# tuple of (key, value) pairs so a snapshot can be shared between threads
+# and sent to worker processes without anyone mutating it.
+DetectorConfig = namedtuple('DetectorConfig', ['device', 'version', 'settings'])
+
+
+def make_detector_config(config, version, device=1):
+    """Freeze a detector configuration dict into a DetectorConfig."""
+    return DetectorConfig(device, version, tuple(sorted(config.items())))
+
+
+# Per-worker detectors by device, replaced when a task carries a different
+# config version for that device
+_worker_detectors = {}
+
+
+def _worker_get_detector(snapshot):
+    cached = _worker_detectors.get(snapshot.device)
+    if cached is None or cached[0] != snapshot.version:
+        cached = _worker_detectors[snapshot.device] = (snapshot.version, TomatoDetector(dict(snapshot.settings)))
+    return cached[1]
+
+
+def _detect_frame(detector, frame, timed=False):
+    """Detect on one frame, either encoded bytes or a decoded BGR array."""
+    timings = {} if timed else None
+    if isinstance(frame, np.ndarray):
+        try:
+            result = detector.detect(frame, timings)
+        except Exception as e:
+            logger.error(f"Error processing frame: {str(e)}")
+            result = {"error": str(e)}
+    else:
+        result = detector.detect_from_bytes(frame, timings)
+    if timed:
+        result['timings'] = timings
+    return result
+
+
+def _detect_in_worker(shm_name, frame_specs, snapshot, timed=False):
+    """
+    Run detection on frames handed over through shared memory.
+
+    Args:
+        shm_name (str): Name of the shared memory block holding the frames
+        frame_specs (list): One entry per frame, ('encoded', offset, size)
+            for JPEG/PNG bytes or ('raw', offset, shape, dtype) for a decoded
+            BGR array
+        snapshot (DetectorConfig): Detector configuration to use
+        timed (bool): Add per-stage ``timings`` (ms) to each result
+
+    Returns:
+        list: Detection results per frame, tagged with the config version
+    """
+    detector = _worker_get_detector(snapshot)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    results = []
+    try:
+        for spec in frame_specs:
+            if spec[0] == 'encoded':
+                _, offset, size = spec
+                frame = shm.buf[offset:offset + size]
+            else:
+                _, offset, shape, dtype = spec
+                frame = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            try:
+                results.append(_detect_frame(detector, frame, timed))
+            finally:
+                # No views may outlive the block, or close() fails
+                if isinstance(frame, memoryview):
+                    frame.release()
+                del frame
+    finally:
+        shm.close()
+
+    for result in results:
+        result['config_version'] = snapshot.version
+    return results
+
+
+def _detect_in_thread(frames, snapshot, timed=False):
+    """In-process fallback used when no worker processes are configured."""
+    detector = _worker_get_detector(snapshot)
+    results = [_detect_frame(detector, frame, timed) for frame in frames]
+    for result in results:
+        result['config_version'] = snapshot.version
+    return results
+
+
+def _pack_frames(frames):
+    """
+    Lay out frames back to back for one shared memory block.
+
+    Returns:
+        tuple: (frames, frame_specs, total_size) with arrays made contiguous
+    """
+    packed = []
+    specs = []
+    offset = 0
+    for frame in frames:
+        if isinstance(frame, np.ndarray):
+            frame = np.ascontiguousarray(frame)
+            size = frame.nbytes
+            specs.append(('raw', offset, frame.shape, frame.dtype.str))
+        else:
+            size = len(frame)
+            specs.append(('encoded', offset, size))
+        packed.append(frame)
+        offset += size
+    return packed, specs, offset
+
+
+class DetectionExecutor:
+    """
+    Runs TomatoDetector in a pool of worker processes.
+
+    Frames are copied once into a shared memory block and only its name is
+    sent to the worker, so neither JPEG bytes nor decoded arrays are
+    pickled. Each task carries the DetectorConfig snapshot of its device
+    that was current when it was submitted; workers keep one TomatoDetector
+    per device and replace it only when that device's snapshot version
+    changes, so a config update never touches a detector while it is
+    running and devices never share thresholds.
+
+    At most ``max_pending`` tasks (a single frame or a whole batch) are
+    queued or running at once; further submissions raise DetectorBusy right away so callers can shed load
+    instead of piling up behind the pool. With ``workers=0`` detection runs
+    on a single background thread in this process.
+
+    With an ``on_results`` callback, workers also time each detector stage
+    and the callback receives every finished task's results (each carrying
+    a ``timings`` dict) and its duration in seconds.
+    """
+
+    def __init__(self, workers=2, max_pending=4, on_results=None):
+        """
+        Initialize the executor. Worker processes start on first use.
+
+        Args:
+            workers (int): Number of worker processes (0 for in-process)
+            max_pending (int): Maximum tasks queued or in flight
+            on_results (callable): Called as on_results(results, seconds)
+                when a task finishes, e.g. to record metrics
+        """
+        self.workers = workers
+        self.max_pending = max(1, max_pending)
+        self.on_results = on_results
+
+        self._lock = threading.Lock()
+        self._pool = None
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._pending = 0
+        self._rejected = 0
+        self._completed = 0
+
+        self._snapshots = {}
+
+    def config_version(self, device=1):
+        """Version of the configuration used for a device's new frames."""
+        snapshot = self._snapshots.get(device)
+        return snapshot.version if snapshot is not None else 0
+
+    def configure(self, config, version, device=1):
+        """
+        Swap in a new detector configuration for a device's frames submitted from now on.
+
+        Frames already queued finish with the snapshot they were submitted
+        with. Calling this again with the current version is a no-op.
+
+        Args:
+            config (dict): Detector configuration
+            version (int): Version of this configuration
+            device (int): Device the configuration belongs to
+        """
+        if version != self.config_version(device):
+            self._snapshots[device] = make_detector_config(config, version, device)
+
+    def submit_batch(self, frames, device=1):
+        """
+        Queue several frames as one task.
+
+        The whole batch goes to a single worker in one shared memory block
+        and takes one slot of ``max_pending``.
+
+        Args:
+            frames (list): Encoded images and/or decoded BGR arrays
+            device (int): Device whose detector configuration is used
+
+        Returns:
+            concurrent.futures.Future: Resolves to a list of results, one per frame
+
+        Raises:
+            DetectorBusy: If max_pending tasks are already queued
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise DetectorBusy(f"{self.max_pending} detection tasks already pending")
+
+        with self._lock:
+            self._pending += 1
+        snapshot = self._snapshots.get(device) or make_detector_config({}, 0, device)
+        timed = self.on_results is not None
+
+        try:
+            if self.workers <= 0:
+                future = self._get_pool().submit(_detect_in_thread, list(frames), snapshot, timed)
+                future.add_done_callback(lambda f: self._release())
+            else:
+                future = self._submit_shared(frames, snapshot, timed)
+        except Exception:
+            self._release()
+            raise
+
+        if timed:
+            future.add_done_callback(self._report(time.perf_counter()))
+        return future
+
+    def detect(self, frame, device=1):
+        """Run detection on one frame and wait for the result."""
+        return self.submit_batch([frame], device).result()[0]
+
+    async def adetect(self, frame, device=1):
+        """Run detection on one frame without blocking the event loop."""
+        results = await asyncio.wrap_future(self.submit_batch([frame], device))
+        return results[0]
+
+    async def adetect_batch(self, frames, device=1):
+        """Run detection on several frames without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit_batch(frames, device))
+
+    def stats(self):
+        """Return queue and throughput counters."""
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': self._pending,
+                'completed': self._completed,
+                'rejected': self._rejected,
+                'devices': len(self._snapshots),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_shared(self, frames, snapshot, timed=False):
+        frames, specs, size = _pack_frames(frames)
+
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+        try:
+            for frame, spec in zip(frames, specs):
+                offset = spec[1]
+                if isinstance(frame, np.ndarray):
+                    np.ndarray(frame.shape, dtype=frame.dtype, buffer=shm.buf, offset=offset)[...] = frame
+                else:
+                    shm.buf[offset:offset + spec[2]] = frame
+
+            try:
+                future = self._get_pool().submit(_detect_in_worker, shm.name, specs, snapshot, timed)
+            except BrokenProcessPool:
+                logger.warning("Detection worker pool broke, restarting it")
+                self._reset_pool()
+                future = self._get_pool().submit(_detect_in_worker, shm.name, specs, snapshot, timed)
+        except Exception:
+            shm.close()
+            shm.unlink()
+            raise
+
+        def cleanup(_future):
+            shm.close()
+            shm.unlink()
+            self._release()
+
+        future.add_done_callback(cleanup)
+        return future
+
+    def _report(self, started):
+        def report(future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            try:
+                self.on_results(future.result(), time.perf_counter() - started)
+            except Exception as e:
+                logger.error(f"Error reporting detection results: {str(e)}")
+        return report
+
+    def _release(self):
+        with self._lock:
+            self._pending -= 1
+            self._completed += 1
+        self._slots.release()
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.workers <= 0:
+                    self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='detector')
+                else:
+                    # spawn: the web process runs threads, which fork does not copy safely
+                    self._pool = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+def create_executor():
+    """Build the executor from the TOMATO_DETECTION_* settings."""
+    from django.conf import settings
+
+    from .metrics import metrics, record_detections
+
+    executor = DetectionExecutor(
+        workers=getattr(settings, 'TOMATO_DETECTION_WORKERS', 2),
+        max_pending=getattr(settings, 'TOMATO_DETECTION_MAX_PENDING', 4),
+        on_results=record_detections if metrics.enabled else None
+    )
+    atexit.register(executor.shutdown)
+    return executor
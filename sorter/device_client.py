@@ -0,0 +1,105 @@
+import logging
+import time
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from .metrics import device_errors_total, device_request_seconds, metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceClient:
+    """
+    HTTP client for the ESP32 sorter with a shared keep-alive connection pool.
+
+    The ESP32 web server only keeps a handful of sockets, so all requests go
+    through one ``requests.Session`` whose pool is capped at ``pool_size``
+    connections per device and reused across calls instead of opening a new
+    TCP connection per command. The pool blocks: a request that finds every
+    connection busy waits for one to come back rather than opening an extra
+    socket, so the wait is bounded by the busy requests' timeouts. Pools are
+    kept for up to ``pool_hosts`` devices; beyond that the least recently
+    used device's pool is closed and reopened on its next request. The
+    ``a*`` variants run the blocking call in a worker thread so async views
+    can await several device calls concurrently without stalling the event
+    loop.
+    """
+
+    def __init__(self, timeout=2, pool_size=2, pool_hosts=32):
+        """
+        Initialize the client.
+
+        Args:
+            timeout (float): Default timeout for device requests in seconds
+            pool_size (int): Maximum pooled connections kept per device
+            pool_hosts (int): Number of devices whose pools are kept open
+        """
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0, pool_block=True)
+        self.session.mount('http://', adapter)
+
+    def get(self, ip_address, endpoint, timeout=None):
+        """Send a GET request to the device and return the response."""
+        return self._request('GET', ip_address, endpoint, timeout=timeout or self.timeout)
+
+    def post(self, ip_address, endpoint, payload, timeout=None):
+        """Send a JSON POST request to the device and return the response."""
+        return self._request('POST', ip_address, endpoint, json=payload, timeout=timeout or self.timeout)
+
+    def status(self, ip_address, timeout=None):
+        """Fetch the device /status payload."""
+        return self.get(ip_address, 'status', timeout=timeout)
+
+    def control(self, ip_address, command, timeout=None):
+        """Send a /control command such as 'release' or 'stop'."""
+        return self.post(ip_address, 'control', {'command': command}, timeout=timeout)
+
+    def sort(self, ip_address, tomato_type, from_camera=False, timeout=None):
+        """Send a /sort command for a ripe or green tomato."""
+        payload = {
+            'type': tomato_type,
+            'from_camera': from_camera
+        }
+        return self.post(ip_address, 'sort', payload, timeout=timeout)
+
+    def _request(self, method, ip_address, endpoint, **kwargs):
+        url = f"http://{ip_address}/{endpoint}"
+        if not metrics.enabled:
+            return self.session.request(method, url, **kwargs)
+
+        # Round-trip time and failures per endpoint for /metrics
+        start = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.Timeout:
+            device_errors_total.inc(endpoint=endpoint, reason='timeout')
+            raise
+        except requests.RequestException:
+            device_errors_total.inc(endpoint=endpoint, reason='connection')
+            raise
+        finally:
+            device_request_seconds.observe(time.perf_counter() - start, endpoint=endpoint)
+
+        if response.status_code != 200:
+            device_errors_total.inc(endpoint=endpoint, reason='http')
+        return response
+
+    async def astatus(self, ip_address, timeout=None):
+        return await sync_to_async(self.status, thread_sensitive=False)(ip_address, timeout=timeout)
+
+    async def acontrol(self, ip_address, command, timeout=None):
+        return await sync_to_async(self.control, thread_sensitive=False)(ip_address, command, timeout=timeout)
+
+    async def asort(self, ip_address, tomato_type, from_camera=False, timeout=None):
+        return await sync_to_async(self.sort, thread_sensitive=False)(
+            ip_address, tomato_type, from_camera=from_camera, timeout=timeout
+        )
+
+
+# Shared client for the whole process
+device_client = DeviceClient(pool_hosts=getattr(settings, 'TOMATO_DEVICE_POOL_HOSTS', 32))
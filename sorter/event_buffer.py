@@ -0,0 +1,236 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SortingSession, Tomato, TomatoRollup, minute_bucket
+
+logger = logging.getLogger(__name__)
+
+SortEvent = namedtuple('SortEvent', ['session_id', 'is_ripe', 'source', 'confidence', 'timestamp'])
+
+
+class TomatoEventBuffer:
+    """
+    Buffers sort events and writes them to the database in batches.
+
+    Each flush inserts the pending events with one ``bulk_create`` and bumps
+    the session counters with one F() update per session and the
+    TomatoRollup rows with one per session and minute, all in a single
+    transaction. A flush happens when ``max_events`` events are pending
+    (inline, in the thread that added the last one) or ``max_delay`` seconds
+    after the oldest pending event (on a background thread), whichever
+    comes first. ``flush()`` is also registered with ``atexit`` so a normal
+    shutdown writes everything out.
+
+    Failed flushes: a batch the database rejects with an IntegrityError
+    (e.g. an event for a deleted session) is split in halves and retried
+    until the offending events are isolated; those are logged and moved to
+    ``rejected`` and the rest are written. Any other error (e.g. the
+    database is locked) puts the unwritten events back to be retried on the
+    next flush. At most ``max_pending`` events are kept; beyond that the
+    oldest are dropped and logged, so an unreachable database cannot grow
+    the buffer without bound.
+
+    Loss bound: only events that have not been flushed yet live solely in
+    memory, and those are lost if the process is killed without running
+    exit handlers. That is the batch being written plus the events pending
+    behind it. With a single adding thread and a database that accepts
+    writes, this is at most ``max_events - 1`` events, all recorded within
+    ``max_delay`` seconds (plus the time of one flush) before the crash, and
+    with ``max_events=1`` every event is written before ``add()`` returns.
+    Concurrent adders keep appending while a batch is written, so pending
+    can grow past ``max_events``; it is capped at ``max_pending`` and a
+    batch is at most what was pending when it was taken, so no more than
+    ``2 * max_pending`` events are ever held in memory.
+    """
+
+    def __init__(self, max_events=50, max_delay=0.5, max_pending=10000):
+        """
+        Initialize the buffer.
+
+        Args:
+            max_events (int): Flush as soon as this many events are pending
+            max_delay (float): Longest time in seconds an event stays pending
+            max_pending (int): Most events kept while flushes keep failing
+        """
+        self.max_events = max(1, max_events)
+        self.max_delay = max_delay
+        self.max_pending = max(self.max_events, max_pending)
+
+        # Events the database refused, kept for inspection
+        self.rejected = deque(maxlen=100)
+        self.dropped = 0
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._events = []
+        self._oldest = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def add(self, session_id, is_ripe, source='manual', confidence=None, timestamp=None):
+        """
+        Record a sorted tomato.
+
+        Args:
+            session_id (int): Session the tomato belongs to
+            is_ripe (bool): Whether the tomato is ripe
+            source (str): 'manual' or 'camera'
+            confidence (float): Detection confidence for camera sorts
+            timestamp (datetime): Event time, defaults to now
+        """
+        event = SortEvent(session_id, is_ripe, source, confidence, timestamp or timezone.now())
+        with self._lock:
+            self._events.append(event)
+            self._trim()
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            full = len(self._events) >= self.max_events
+            if not full:
+                self._ensure_flusher()
+
+        if full:
+            self.flush()
+        else:
+            self._wake.set()
+
+    def pending(self):
+        """Return the number of events not yet written."""
+        with self._lock:
+            return len(self._events)
+
+    def pending_counts(self, session_id):
+        """
+        Return the (ripe, green) counts still buffered for a session.
+
+        Adding these to the stored session counters gives exact totals
+        before the next flush.
+        """
+        with self._lock:
+            ripe = sum(1 for event in self._events if event.session_id == session_id and event.is_ripe)
+            green = sum(1 for event in self._events if event.session_id == session_id and not event.is_ripe)
+        return ripe, green
+
+    def flush(self):
+        """
+        Write all pending events.
+
+        Returns:
+            int: Number of events written
+        """
+        with self._flush_lock:
+            with self._lock:
+                events = self._events
+                self._events = []
+                self._oldest = None
+            if not events:
+                return 0
+            return self._write_isolating(events)
+
+    def _write_isolating(self, events):
+        """
+        Write events, splitting batches to isolate ones the database rejects.
+
+        Returns:
+            int: Number of events written
+        """
+        written = 0
+        # Stack of batches still to write, next batch last
+        batches = [events]
+        while batches:
+            batch = batches.pop()
+            try:
+                self._write(batch)
+                written += len(batch)
+            except IntegrityError as e:
+                if len(batch) == 1:
+                    logger.error(f"Dropping rejected tomato event {batch[0]}: {str(e)}")
+                    self.rejected.append(batch[0])
+                else:
+                    middle = len(batch) // 2
+                    batches.extend([batch[middle:], batch[:middle]])
+            except Exception as e:
+                unwritten = batch + [event for remaining in reversed(batches) for event in remaining]
+                logger.error(f"Error flushing {len(unwritten)} tomato events: {str(e)}")
+                with self._lock:
+                    self._events[:0] = unwritten
+                    self._trim()
+                    self._oldest = time.monotonic()
+                break
+        return written
+
+    def _trim(self):
+        """Drop the oldest events beyond max_pending. Call with _lock held."""
+        excess = len(self._events) - self.max_pending
+        if excess > 0:
+            del self._events[:excess]
+            self.dropped += excess
+            logger.error(f"Tomato event buffer full, dropped the {excess} oldest event(s)")
+
+    def _write(self, events):
+        counts = {}
+        rollups = {}
+        for event in events:
+            ripe, green = counts.get(event.session_id, (0, 0))
+            counts[event.session_id] = (ripe + event.is_ripe, green + (not event.is_ripe))
+            key = (event.session_id, minute_bucket(event.timestamp))
+            ripe, green = rollups.get(key, (0, 0))
+            rollups[key] = (ripe + event.is_ripe, green + (not event.is_ripe))
+
+        with transaction.atomic():
+            Tomato.objects.bulk_create([
+                Tomato(
+                    session_id=event.session_id,
+                    is_ripe=event.is_ripe,
+                    source=event.source,
+                    confidence=event.confidence,
+                    timestamp=event.timestamp
+                )
+                for event in events
+            ])
+            for session_id, (ripe, green) in counts.items():
+                SortingSession.objects.filter(pk=session_id).update(
+                    ripe_count=F('ripe_count') + ripe,
+                    green_count=F('green_count') + green
+                )
+            TomatoRollup.add(rollups)
+
+    def _ensure_flusher(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='tomato-event-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                oldest = self._oldest
+            if oldest is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            remaining = oldest + self.max_delay - time.monotonic()
+            if remaining > 0:
+                time.sleep(remaining)
+                continue
+
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+# Shared buffer for the web process
+event_buffer = TomatoEventBuffer(
+    max_events=getattr(settings, 'TOMATO_EVENT_BUFFER_SIZE', 50),
+    max_delay=getattr(settings, 'TOMATO_EVENT_FLUSH_MS', 500) / 1000,
+    max_pending=getattr(settings, 'TOMATO_EVENT_BUFFER_MAX_PENDING', 10000)
+)
+atexit.register(event_buffer.flush)
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import threading
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+
+def format_sse(event, data):
+    """Encode one event in the text/event-stream format."""
+    return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+
+class Subscription:
+    """Queue of events for one subscriber, owned by its event loop."""
+
+    def __init__(self, loop, max_queued):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.dropped = 0
+
+    def _put(self, item):
+        # Runs on the subscriber's loop; a slow reader loses its oldest events
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(item)
+
+    async def get(self):
+        """Wait for the next (event, data) pair."""
+        return await self.queue.get()
+
+
+class EventPublisher:
+    """
+    In-process fan-out of dashboard events.
+
+    The code that changes something (a sort, a session starting or ending,
+    the status poller seeing the device change) publishes one event, and
+    every subscribed stream (SSE responses, the detection socket) gets a
+    copy, so N dashboards cost a single producer. ``publish`` may be called
+    from any thread; each subscriber receives events on its own event loop
+    through a bounded queue.
+
+    With ``only_changes=True`` an event is dropped when its data equals the
+    last one published under the same name and key, so state events only
+    go out when the state actually changed. The key separates the state of
+    several devices sharing one event name.
+    """
+
+    def __init__(self, max_queued=100):
+        """
+        Initialize the publisher.
+
+        Args:
+            max_queued (int): Events buffered per subscriber before the
+                oldest are dropped
+        """
+        self.max_queued = max_queued
+
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._last = {}
+
+    def subscribe(self):
+        """Register a subscriber on the running event loop."""
+        subscription = Subscription(asyncio.get_running_loop(), self.max_queued)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def publish(self, event, data, only_changes=False, key=None):
+        """
+        Send an event to every subscriber.
+
+        Args:
+            event (str): Event name
+            data (dict): JSON-serializable payload
+            only_changes (bool): Skip the event if data did not change
+            key: What the state belongs to, e.g. a device id, for only_changes
+
+        Returns:
+            bool: Whether the event was published
+        """
+        with self._lock:
+            if only_changes and self._last.get((event, key)) == data:
+                return False
+            self._last[(event, key)] = data
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, (event, data))
+            except RuntimeError:
+                # The subscriber's loop is gone
+                self.unsubscribe(subscription)
+        return True
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+
+# Shared publisher for the whole process
+publisher = EventPublisher()
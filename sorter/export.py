@@ -0,0 +1,112 @@
+import csv
+import json
+
+from asgiref.sync import sync_to_async
+
+from .models import Tomato
+
+# Exported columns: Tomato lookup and header name
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('session_id', 'session_id'),
+    ('session__device_id', 'device_id'),
+    ('timestamp', 'timestamp'),
+    ('is_ripe', 'type'),
+    ('source', 'source'),
+    ('confidence', 'confidence'),
+]
+
+HEADER = [name for _, name in EXPORT_COLUMNS]
+
+
+class _Echo:
+    """File-like object whose write() returns the line, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+_csv_writer = csv.writer(_Echo())
+
+
+def _record(row):
+    """Turn a values_list row into export values."""
+    pk, session_id, device_id, timestamp, is_ripe, source, confidence = row
+    return [pk, session_id, device_id, timestamp.isoformat(), 'ripe' if is_ripe else 'green', source, confidence]
+
+
+def _csv_line(row):
+    return _csv_writer.writerow(_record(row))
+
+
+def _ndjson_line(row):
+    return json.dumps(dict(zip(HEADER, _record(row)))) + '\n'
+
+
+# Format name -> (content type, file extension, header line, row formatter)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv', _csv_writer.writerow(HEADER), _csv_line),
+    'ndjson': ('application/x-ndjson', 'ndjson', '', _ndjson_line),
+}
+
+
+def export_queryset(session_id=None, device_id=None, start=None, end=None):
+    """
+    Select the Tomato rows to export, oldest first.
+
+    Args:
+        session_id (int): Only this session
+        device_id (int): Only sessions of this device
+        start (datetime): Only tomatoes sorted at or after this time
+        end (datetime): Only tomatoes sorted before this time
+
+    Returns:
+        QuerySet: values_list rows in EXPORT_COLUMNS order
+    """
+    tomatoes = Tomato.objects.order_by('pk')
+    if session_id is not None:
+        tomatoes = tomatoes.filter(session_id=session_id)
+    if device_id is not None:
+        tomatoes = tomatoes.filter(session__device_id=device_id)
+    if start is not None:
+        tomatoes = tomatoes.filter(timestamp__gte=start)
+    if end is not None:
+        tomatoes = tomatoes.filter(timestamp__lt=end)
+    return tomatoes.values_list(*(lookup for lookup, _ in EXPORT_COLUMNS))
+
+
+def iter_export(rows, format='csv', chunk_size=2000):
+    """
+    Yield an export as text chunks of up to chunk_size rows.
+
+    Rows are fetched with ``iterator(chunk_size)``, so memory use does not
+    depend on how many rows are exported.
+
+    Args:
+        rows (QuerySet): From export_queryset()
+        format (str): 'csv' or 'ndjson'
+        chunk_size (int): Rows per database fetch and per yielded chunk
+    """
+    _, _, header, line = EXPORT_FORMATS[format]
+    lines = [header] if header else []
+    for row in rows.iterator(chunk_size=chunk_size):
+        lines.append(line(row))
+        if len(lines) >= chunk_size:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+async def aiter_export(rows, format='csv', chunk_size=2000):
+    """
+    Async variant of iter_export, for streaming responses under ASGI.
+
+    QuerySet.aiterator() starts values_list queries on the event loop, which
+    Django refuses, so each chunk is pulled from iter_export in a worker
+    thread instead.
+    """
+    chunks = iter_export(rows, format, chunk_size)
+    next_chunk = sync_to_async(next)
+    while (chunk := await next_chunk(chunks, None)) is not None:
+        yield chunk
@@ -0,0 +1,277 @@
+import threading
+import time
+from collections import deque, namedtuple
+
+import cv2
+import numpy as np
+
+# Size of the grayscale thumbnail frames are compared on
+FINGERPRINT_SIZE = (32, 24)
+
+TrackedFrame = namedtuple('TrackedFrame', ['fingerprint', 'result', 'time', 'digest'])
+
+
+def fingerprint_frame(frame):
+    """
+    Reduce a frame to a tiny grayscale thumbnail for change detection.
+
+    Encoded JPEGs are decoded with ``IMREAD_REDUCED_GRAYSCALE_8``, which lets
+    libjpeg skip most of the work, so this costs a fraction of a full
+    decode.
+
+    Args:
+        frame (bytes | memoryview | numpy.ndarray): Encoded image data or a
+            decoded BGR image
+
+    Returns:
+        numpy.ndarray | None: FINGERPRINT_SIZE uint8 image, or None if the
+        frame could not be decoded
+    """
+    if isinstance(frame, np.ndarray):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    else:
+        buffer = np.frombuffer(frame, dtype=np.uint8)
+        if buffer.size == 0:
+            return None
+        gray = cv2.imdecode(buffer, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if gray is None:
+            return None
+    return cv2.resize(gray, FINGERPRINT_SIZE, interpolation=cv2.INTER_AREA)
+
+
+def gated_result(config_version=None):
+    """Detection result reported for a frame the presence gate found empty."""
+    return {
+        'type': None,
+        'confidence': 0,
+        'contours': 0,
+        'is_tomato': False,
+        'gated': True,
+        'config_version': config_version
+    }
+
+
+class _Camera:
+    """Recent frames and the running decision streak for one camera."""
+
+    def __init__(self, history):
+        self.frames = deque(maxlen=history)
+        self.reference = None
+        self.streak_type = None
+        self.streak = 0
+        self.committed = False
+
+
+class FrameTracker:
+    """
+    Temporal filter between the camera and the sorter.
+
+    Keeps a small ring buffer of recent frames per camera. A frame that is
+    near-identical to the last frame
+    that was actually classified (no thumbnail pixel differs by
+    ``diff_threshold`` gray levels or more) reuses that frame's result
+    instead of being classified again. Comparing with the last classified
+    frame rather than the previous one means slow drift, like a tomato
+    creeping along the belt, still adds up to a new classification.
+
+    Every frame extends or resets a streak of identical detection types,
+    whether it was classified or reused the previous result, so a tomato
+    held still by the stopper confirms after ``confirm_frames`` frames. A
+    sort is committed once a ripe or green streak reaches
+    ``confirm_frames``, and only once per streak, so a tomato sitting in
+    front of the camera is sorted a single time however many frames see it.
+
+    Frames passed with a content digest that matches one of the last
+    ``history`` frames are re-posts of the same encoded image, not new
+    views of the belt; they get the cached result but leave the streak
+    unchanged, so posting one JPEG K times never confirms a sort.
+    """
+
+    def __init__(self, history=8, confirm_frames=3, diff_threshold=8, max_age=5.0):
+        """
+        Initialize the tracker.
+
+        Args:
+            history (int): Frames kept per camera for spotting re-posts
+            confirm_frames (int): Consistent frames needed to commit a sort
+            diff_threshold (float): Largest per-pixel gray level difference
+                below which a frame counts as unchanged
+            max_age (float): Seconds a previous result may be reused for
+        """
+        self.history = max(1, history)
+        self.confirm_frames = max(1, confirm_frames)
+        self.diff_threshold = diff_threshold
+        self.max_age = max_age
+
+        self._lock = threading.Lock()
+        self._cameras = {}
+
+    def cached_result(self, camera, fingerprint, config_version=None):
+        """
+        Return the previous result if this frame is unchanged, else None.
+
+        Results from a different detector config version are never reused.
+        """
+        if fingerprint is None:
+            return None
+
+        with self._lock:
+            state = self._cameras.get(camera)
+            if state is None or state.reference is None:
+                return None
+            last = state.reference
+
+        if time.monotonic() - last.time > self.max_age:
+            return None
+        if config_version is not None and last.result.get('config_version') != config_version:
+            return None
+        if cv2.norm(fingerprint, last.fingerprint, cv2.NORM_INF) >= self.diff_threshold:
+            return None
+        return dict(last.result)
+
+    def observe(self, camera, fingerprint, result, duplicate=False, digest=None):
+        """
+        Record a frame's result and decide whether to sort.
+
+        Args:
+            camera (str): Camera identifier
+            fingerprint (numpy.ndarray): Thumbnail from fingerprint_frame
+            result (dict): Detection result for the frame
+            duplicate (bool): The result was reused from cached_result
+            digest (bytes): Hash of the encoded frame, to spot re-posts of
+                the same image (None for decoded camera frames)
+
+        Returns:
+            dict: ``commit`` (the type to sort now, or None), ``type`` and
+            ``streak`` of the current run of identical detections,
+            ``confirm_frames`` and ``repeat`` (the frame was a re-post)
+        """
+        detected_type = result.get('type')
+        if detected_type not in ('ripe', 'green'):
+            detected_type = None
+
+        with self._lock:
+            state = self._cameras.get(camera)
+            if state is None:
+                state = self._cameras[camera] = _Camera(self.history)
+
+            repeat = digest is not None and any(frame.digest == digest for frame in state.frames)
+
+            frame = TrackedFrame(fingerprint, dict(result), time.monotonic(), digest)
+            state.frames.append(frame)
+            if fingerprint is not None and not duplicate:
+                state.reference = frame
+
+            if repeat:
+                pass
+            elif detected_type == state.streak_type:
+                state.streak += 1
+            else:
+                state.streak_type = detected_type
+                state.streak = 1
+                state.committed = False
+
+            commit = None
+            if detected_type is not None and not state.committed and state.streak >= self.confirm_frames:
+                state.committed = True
+                commit = detected_type
+
+            return {
+                'commit': commit,
+                'type': state.streak_type,
+                'streak': state.streak,
+                'confirm_frames': self.confirm_frames,
+                'repeat': repeat
+            }
+
+    def reset(self, camera=None):
+        """Forget one camera's history, or every camera's when None."""
+        with self._lock:
+            if camera is None:
+                self._cameras.clear()
+            else:
+                self._cameras.pop(camera, None)
+
+
+class PresenceGate:
+    """
+    Cheap empty-belt check run before full classification.
+
+    Keeps a running-average background per camera on the fingerprint
+    thumbnails (``cv2.accumulateWeighted``). A frame where fewer than
+    ``min_changed`` of the thumbnail pixels differ from the background by
+    more than ``threshold`` gray levels is reported empty and skips the
+    detector. The background only learns from frames that are empty, either
+    gated here or classified as containing no tomato, so a tomato standing
+    in view never fades into it.
+    """
+
+    def __init__(self, threshold=10, min_changed=0.005, learning_rate=0.05):
+        """
+        Initialize the gate.
+
+        Args:
+            threshold (float): Gray level difference for a pixel to count as changed
+            min_changed (float): Fraction of changed pixels that means something is present
+            learning_rate (float): Weight of each new empty frame in the background
+        """
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.learning_rate = learning_rate
+
+        self._lock = threading.Lock()
+        self._backgrounds = {}
+        self._checked = 0
+        self._gated = 0
+
+    def is_empty(self, camera, fingerprint):
+        """
+        Return True if the frame matches the camera's empty background.
+
+        Frames are never gated before a background has been learned.
+        """
+        if fingerprint is None:
+            return False
+
+        with self._lock:
+            background = self._backgrounds.get(camera)
+            self._checked += 1
+            if background is None:
+                return False
+
+            difference = cv2.absdiff(fingerprint, cv2.convertScaleAbs(background))
+            changed = cv2.countNonZero(cv2.threshold(difference, self.threshold, 255, cv2.THRESH_BINARY)[1])
+            empty = changed < self.min_changed * fingerprint.size
+            if empty:
+                self._gated += 1
+                cv2.accumulateWeighted(fingerprint, background, self.learning_rate)
+            return empty
+
+    def learn(self, camera, fingerprint):
+        """Blend a frame known to be empty into the camera's background."""
+        if fingerprint is None:
+            return
+
+        with self._lock:
+            background = self._backgrounds.get(camera)
+            if background is None:
+                self._backgrounds[camera] = fingerprint.astype(np.float32)
+            else:
+                cv2.accumulateWeighted(fingerprint, background, self.learning_rate)
+
+    def reset(self, camera=None):
+        """Forget one camera's background, or every camera's when None."""
+        with self._lock:
+            if camera is None:
+                self._backgrounds.clear()
+            else:
+                self._backgrounds.pop(camera, None)
+
+    def stats(self):
+        """Return how many frames were checked and how many were gated."""
+        with self._lock:
+            return {
+                'checked': self._checked,
+                'gated': self._gated,
+                'hit_rate': round(self._gated / self._checked, 3) if self._checked else 0.0
+            }
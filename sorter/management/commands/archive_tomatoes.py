@@ -0,0 +1,72 @@
+import logging
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+
+from sorter.retention import archive_dir, archive_session, expired_sessions, optimize_database
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Move Tomato rows of sessions that ended more than the retention period ago to gzipped "
+        "NDJSON archive files, keeping the session counters and per-minute rollups, then ANALYZE."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'TOMATO_RETENTION_DAYS', 90),
+            help="Archive sessions that ended more than this many days ago"
+        )
+        parser.add_argument('--archive-dir', help="Directory for the archive files (default: TOMATO_ARCHIVE_DIR)")
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'TOMATO_RETENTION_BATCH_SIZE', 500),
+            help="Rows deleted per transaction"
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0.05,
+            help="Seconds to wait between delete batches so other writers get the database (default: 0.05)"
+        )
+        parser.add_argument('--dry-run', action='store_true', help="List the sessions that would be archived")
+        parser.add_argument(
+            '--vacuum', action='store_true',
+            help="Also VACUUM to shrink the database file (locks the whole database while it runs)"
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 0:
+            raise CommandError("--days must not be negative")
+        directory = options['archive_dir'] or archive_dir()
+        sessions = expired_sessions(options['days'])
+
+        if options['dry_run']:
+            for session in sessions.annotate(rows=Count('tomatoes')):
+                self.stdout.write(f"{session}: {session.rows} tomato row(s)")
+            return
+
+        archived = deleted = failed = 0
+        for session in sessions:
+            try:
+                rows, removed = archive_session(
+                    session, directory,
+                    batch_size=max(1, options['batch_size']),
+                    pause=options['pause']
+                )
+            except Exception as e:
+                logger.error(f"Error archiving session {session.pk}: {str(e)}")
+                self.stderr.write(f"Session {session.pk}: {str(e)}")
+                failed += 1
+                continue
+            archived += rows
+            deleted += removed
+            self.stdout.write(f"Session {session.pk}: archived {rows}, deleted {removed}")
+
+        if deleted or options['vacuum']:
+            optimize_database(vacuum=options['vacuum'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {archived} and deleted {deleted} tomato row(s) to {directory}"
+            + (f", {failed} session(s) failed" if failed else "")
+        ))
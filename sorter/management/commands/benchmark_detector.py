@@ -0,0 +1,113 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sorter.benchmark import STAGES, compare_results, run_benchmark, synthetic_frame, time_detect
+from sorter.tomato_detector import TomatoDetector
+
+RESOLUTIONS = {
+    '640x480': (640, 480),
+    '1280x720': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+
+class Command(BaseCommand):
+    help = "Measure TomatoDetector latency, per stage, on synthetic frames."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--resolution', action='append', choices=sorted(RESOLUTIONS),
+            help="Frame size to test (repeatable, default: 640x480 and 1080p)"
+        )
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument(
+            '--pyramid-levels', type=int, action='append',
+            help="Detector pyramid levels to compare (repeatable, default: 0 and 1)"
+        )
+        parser.add_argument(
+            '--corpus', action='store_true',
+            help="Run the full synthetic corpus (ripe/green/empty, sizes, noise, clutter) with per-stage timings"
+        )
+        parser.add_argument('--case', action='append', help="Only corpus cases whose name contains this (repeatable)")
+        parser.add_argument('--seed', type=int, default=0, help="Corpus seed (default: 0)")
+        parser.add_argument('--output', help="Write the corpus results as JSON to this file")
+        parser.add_argument('--compare', help="Baseline JSON from an earlier --output run to check for regressions")
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help="Allowed relative median slowdown before --compare fails (default: 0.2)"
+        )
+
+    def handle(self, *args, **options):
+        resolutions = options['resolution'] or ['640x480', '1080p']
+
+        if options['corpus'] or options['output'] or options['compare'] or options['case']:
+            return self.run_corpus(resolutions, options)
+
+        levels = options['pyramid_levels'] or [0, 1]
+        for name in resolutions:
+            width, height = RESOLUTIONS[name]
+            image = synthetic_frame(width, height)
+            for level in levels:
+                detector = TomatoDetector()
+                detector.pyramid_levels = level
+                timing = time_detect(detector, image, options['iterations'])
+                result = detector.detect(image)
+                self.stdout.write(
+                    f"{name:>9} pyramid={level}: median {timing['median_ms']:.2f} ms, "
+                    f"min {timing['min_ms']:.2f} ms -> {result['type']} ({result['confidence']:.1f})"
+                )
+
+    def run_corpus(self, resolutions, options):
+        baseline = None
+        if options['compare']:
+            try:
+                with open(options['compare']) as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not read baseline {options['compare']}: {e}")
+
+        detector = TomatoDetector()
+        if options['pyramid_levels']:
+            detector.pyramid_levels = options['pyramid_levels'][0]
+
+        results = run_benchmark(
+            detector,
+            {name: RESOLUTIONS[name] for name in resolutions},
+            iterations=options['iterations'],
+            seed=options['seed'],
+            names=options['case']
+        )
+        if not results['cases']:
+            raise CommandError("No corpus cases matched")
+
+        for case in results['cases']:
+            self.stdout.write(self.format_case(case))
+        self.stdout.write(f"Accuracy: {results['accuracy']:.0%} of {len(results['cases'])} cases")
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline is not None:
+            regressions = compare_results(baseline, results, options['threshold'])
+            for item in regressions:
+                if item['reason'] == 'latency':
+                    change = f"{item['before']:.2f} -> {item['after']:.2f} ms"
+                else:
+                    change = f"{item['before']} -> {item['after']}"
+                self.stderr.write(f"Regression {item['resolution']} {item['case']}: {item['reason']} {change}")
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) against {options['compare']}")
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
+
+    def format_case(self, case):
+        stages = case['detect_from_base64']['stages']
+        breakdown = ' '.join(f"{stage} {stages[stage]:.2f}" for stage in STAGES if stage in stages)
+        mark = 'ok' if case['correct'] else f"expected {case['expected']}"
+        return (
+            f"{case['resolution']:>9} {case['name']:<20} detect {case['detect']['median_ms']:.2f} ms "
+            f"({case['detect']['fps']:.0f} fps), base64 {case['detect_from_base64']['median_ms']:.2f} ms "
+            f"[{breakdown}] -> {case['detected']} ({case['confidence']:.1f}) {mark}"
+        )
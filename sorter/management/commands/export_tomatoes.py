@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from sorter.export import EXPORT_FORMATS, export_queryset, iter_export
+from sorter.timeutils import parse_time
+
+
+class Command(BaseCommand):
+    help = "Write the sorted tomato log as CSV or NDJSON, streaming rows from the database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--session', type=int, help="Only this session")
+        parser.add_argument('--device', type=int, help="Only sessions of this device")
+        parser.add_argument('--start', help="Only tomatoes sorted at or after this ISO date/time")
+        parser.add_argument('--end', help="Only tomatoes sorted before this ISO date/time")
+        parser.add_argument('--output', '-o', help="File to write (default: stdout)")
+        parser.add_argument(
+            '--chunk-size', type=int, default=getattr(settings, 'TOMATO_EXPORT_CHUNK_SIZE', 2000),
+            help="Rows fetched per database round-trip"
+        )
+
+    def handle(self, *args, **options):
+        try:
+            start = parse_time(options['start']) if options['start'] else None
+            end = parse_time(options['end']) if options['end'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        rows = export_queryset(
+            session_id=options['session'],
+            device_id=options['device'],
+            start=start,
+            end=end
+        )
+        chunks = iter_export(rows, options['format'], max(1, options['chunk_size']))
+
+        if options['output']:
+            with open(options['output'], 'w', newline='') as f:
+                f.writelines(chunks)
+        else:
+            # No ending: the chunks already end in newlines
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from sorter.models import SortingSession, TomatoRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-minute TomatoRollup rows behind /api/stats/ from the Tomato rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_ids', nargs='*', type=int, help="Sessions to rebuild (default: all)")
+
+    def handle(self, *args, **options):
+        sessions = None
+        if options['session_ids']:
+            sessions = SortingSession.objects.filter(id__in=options['session_ids'])
+
+        written = TomatoRollup.rebuild(sessions)
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup row(s)"))
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from sorter.models import SortingSession
+
+
+class Command(BaseCommand):
+    help = "Recompute SortingSession ripe/green counters from the Tomato rows."
+
+    def add_arguments(self, parser):
+        parser.add_argument('session_ids', nargs='*', type=int, help="Sessions to check (default: all)")
+        parser.add_argument('--active', action='store_true', help="Only check the active session(s)")
+
+    def handle(self, *args, **options):
+        sessions = SortingSession.objects.order_by('id')
+        if options['session_ids']:
+            sessions = sessions.filter(id__in=options['session_ids'])
+        if options['active']:
+            sessions = sessions.filter(is_active=True)
+
+        checked = 0
+        fixed = 0
+        for session in sessions.iterator():
+            old = (session.ripe_count, session.green_count)
+            if session.reconcile_counts():
+                fixed += 1
+                self.stdout.write(
+                    f"Session {session.id}: ripe {old[0]} -> {session.ripe_count}, "
+                    f"green {old[1]} -> {session.green_count}"
+                )
+            checked += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} session(s), fixed {fixed}"))
@@ -0,0 +1,126 @@
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sorter.camera import CameraService
+from sorter.metrics import CONTENT_TYPE, metrics
+from sorter.models import ESPDevice
+from sorter.views import frame_tracker, presence_gate, sort_detection
+
+
+class Command(BaseCommand):
+    help = "Read a camera or video file with OpenCV and sort tomatoes without a browser."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', nargs='?', default='0', help="Camera index, video file or stream URL (default: 0)")
+        parser.add_argument('--camera', default='capture', help="Name used for frame tracking (default: capture)")
+        parser.add_argument('--device', type=int, help="Id of the sorter line to drive (default: the default device)")
+        parser.add_argument('--duration', type=float, help="Stop after this many seconds")
+        parser.add_argument('--max-frames', type=int, help="Stop after processing this many frames")
+        parser.add_argument(
+            '--realtime', action=argparse.BooleanOptionalAction, default=None,
+            help="Pace reads at the source frame rate (default: on for files, off for cameras)"
+        )
+        parser.add_argument('--process-all', action='store_true', help="Process every frame instead of dropping late ones")
+        parser.add_argument('--no-gate', action='store_true', help="Classify every frame, skipping the presence gate")
+        parser.add_argument('--dry-run', action='store_true', help="Report confirmed detections without sorting")
+        parser.add_argument('--stats-interval', type=float, default=5.0, help="Seconds between stats lines")
+        parser.add_argument(
+            '--metrics-port', type=int,
+            help="Serve Prometheus metrics for this process at http://0.0.0.0:PORT/metrics"
+        )
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        if options['device'] is not None and not ESPDevice.objects.filter(pk=options['device']).exists():
+            raise CommandError(f"No device with id {options['device']}")
+
+        def on_commit(device, tomato_type, result):
+            confidence = result.get('confidence', 0)
+            if dry_run:
+                self.stdout.write(f"Would sort {tomato_type} ({confidence:.1f})")
+            elif not device.ip_address or not device.is_online:
+                self.stderr.write(f"Detected {tomato_type} but the device is offline or IP not set")
+            elif sort_detection(device, tomato_type, confidence) is None:
+                self.stderr.write(f"Detected {tomato_type} but the actuation queue is full")
+            else:
+                self.stdout.write(f"Sorted {tomato_type} ({confidence:.1f})")
+
+        service = CameraService(
+            options['source'],
+            camera=options['camera'],
+            tracker=frame_tracker,
+            gate=None if options['no_gate'] else presence_gate,
+            on_commit=on_commit,
+            realtime=options['realtime'],
+            process_all=options['process_all'],
+            device_id=options['device']
+        )
+
+        server = None
+        if options['metrics_port']:
+            metrics.enabled = True
+            metrics.stats('tomato_camera', service.stats, 'Headless camera capture and processing')
+            server = self.serve_metrics(options['metrics_port'])
+
+        service.start()
+
+        started = time.monotonic()
+        next_stats = started + options['stats_interval']
+        try:
+            while service.is_running():
+                service.join(0.1)
+                stats = service.stats()
+                if options['max_frames'] and stats['processed'] >= options['max_frames']:
+                    break
+                if options['duration'] and time.monotonic() - started >= options['duration']:
+                    break
+                if time.monotonic() >= next_stats:
+                    self.stdout.write(self.format_stats(stats))
+                    next_stats += options['stats_interval']
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
+            service.join(5)
+            if server is not None:
+                server.shutdown()
+
+        if service.error:
+            raise CommandError(service.error)
+        self.stdout.write(self.style.SUCCESS(self.format_stats(service.stats())))
+
+    def serve_metrics(self, port):
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+        except OSError as e:
+            raise CommandError(f"Could not serve metrics on port {port}: {e}")
+        threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+        self.stdout.write(f"Serving metrics at http://0.0.0.0:{port}/metrics")
+        return server
+
+    def format_stats(self, stats):
+        return (
+            f"{stats['elapsed']:.1f}s: read {stats['read']} ({stats['capture_fps']} fps), "
+            f"processed {stats['processed']} ({stats['process_fps']} fps), dropped {stats['dropped']}, "
+            f"duplicates {stats['duplicates']}, gated {stats['gated']}, classified {stats['classified']}, "
+            f"detections {stats['detections']}, sorts {stats['sorts']}"
+        )
@@ -0,0 +1,264 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond OpenCV stages up to device timeouts
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for metrics: a name, help text and one value per label combination."""
+
+    kind = None
+
+    def __init__(self, registry, name, help, labelnames=()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def collect(self):
+        """Return the exposition lines for this metric."""
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._lines(key, value) for key, value in items)
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(_Metric):
+    """Monotonic count, e.g. detections by type."""
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _lines(self, key, value):
+        return f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets, plus their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds spent in the with block."""
+        if not self.registry.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _lines(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return '\n'.join(lines)
+
+
+class _StatsGauges:
+    """Gauges read at scrape time from a stats() dict, one per numeric key."""
+
+    def __init__(self, prefix, func, help):
+        self.prefix = prefix
+        self.func = func
+        self.help = help
+
+    def collect(self):
+        try:
+            stats = self.func()
+        except Exception as e:
+            logger.error(f"Error collecting {self.prefix} metrics: {str(e)}")
+            return []
+
+        lines = []
+        for key, value in stats.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            name = f'{self.prefix}_{key}'
+            lines.extend([
+                f'# HELP {name} {self.help} ({key})',
+                f'# TYPE {name} gauge',
+                f'{name} {_format_value(value)}',
+            ])
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms in the Prometheus text format.
+
+    Metrics are plain objects updated from any thread. While the registry is
+    disabled, ``inc``/``observe``/``time`` return after a single attribute
+    check and call sites skip building timing dicts, so leaving the
+    instrumentation in the hot path costs next to nothing. ``stats`` gauges
+    are only read when ``render`` runs, i.e. on a scrape.
+    """
+
+    def __init__(self, enabled=False):
+        """
+        Initialize the registry.
+
+        Args:
+            enabled (bool): Whether metrics are recorded and served
+        """
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(self, name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self, name, help, labelnames, buckets))
+
+    def stats(self, prefix, func, help):
+        """
+        Export the numeric values of func() as gauges named prefix_<key>.
+
+        Args:
+            prefix (str): Metric name prefix
+            func (callable): Returns a dict such as DetectionExecutor.stats()
+            help (str): Help text shared by the gauges
+        """
+        return self._register(_StatsGauges(prefix, func, help))
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        """Clear recorded counters and histograms."""
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            if isinstance(metric, _Metric):
+                metric.reset()
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+
+# Shared registry for the process
+metrics = MetricsRegistry(enabled=getattr(settings, 'TOMATO_METRICS_ENABLED', False))
+
+detect_stage_seconds = metrics.histogram(
+    'tomato_detect_stage_seconds', 'Time spent in each TomatoDetector stage', ['stage']
+)
+detection_task_seconds = metrics.histogram(
+    'tomato_detection_task_seconds', 'Detection pool task time from submit to result, including queueing'
+)
+detections_total = metrics.counter(
+    'tomato_detections_total', 'Frames run through the detector, by detected type', ['type']
+)
+frame_seconds = metrics.histogram(
+    'tomato_frame_seconds', 'Time to handle one camera frame, by how it was resolved', ['path']
+)
+sorts_total = metrics.counter(
+    'tomato_sorts_total', 'Sorts queued on the actuation scheduler', ['type', 'source']
+)
+device_request_seconds = metrics.histogram(
+    'tomato_device_request_seconds', 'ESP32 HTTP round-trip time', ['endpoint']
+)
+device_errors_total = metrics.counter(
+    'tomato_device_errors_total', 'Failed ESP32 requests', ['endpoint', 'reason']
+)
+
+
+def record_detection(result, timings=None):
+    """
+    Count one detector result and observe its stage timings.
+
+    Args:
+        result (dict): TomatoDetector result
+        timings (dict): Stage times in milliseconds, as filled in by detect()
+    """
+    if not metrics.enabled:
+        return
+    detections_total.inc(type='error' if 'error' in result else (result.get('type') or 'none'))
+    for stage, elapsed in (timings or {}).items():
+        detect_stage_seconds.observe(elapsed / 1000, stage=stage)
+
+
+def record_detections(results, elapsed):
+    """Record a finished detection pool task, called by DetectionExecutor."""
+    detection_task_seconds.observe(elapsed)
+    for result in results:
+        record_detection(result, result.get('timings'))
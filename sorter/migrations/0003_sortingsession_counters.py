@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:41
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def backfill_counters(apps, schema_editor):
+    SortingSession = apps.get_model('sorter', 'SortingSession')
+    sessions = SortingSession.objects.annotate(
+        ripe=Count('tomatoes', filter=Q(tomatoes__is_ripe=True)),
+        green=Count('tomatoes', filter=Q(tomatoes__is_ripe=False))
+    )
+    for session in sessions.iterator():
+        SortingSession.objects.filter(pk=session.pk).update(
+            ripe_count=session.ripe,
+            green_count=session.green
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0002_espdevice_detection_mode_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sortingsession',
+            name='green_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='sortingsession',
+            name='ripe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:42
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def end_duplicate_active_sessions(apps, schema_editor):
+    # Keep only the most recent active session so the constraint can be added
+    SortingSession = apps.get_model('sorter', 'SortingSession')
+    active = SortingSession.objects.filter(is_active=True).order_by('-start_time', '-id')
+    latest = active.first()
+    if latest is not None:
+        active.exclude(pk=latest.pk).update(is_active=False, end_time=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0003_sortingsession_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(end_duplicate_active_sessions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='sortingsession',
+            index=models.Index(fields=['-start_time'], name='sorter_session_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tomato',
+            index=models.Index(fields=['session', 'is_ripe', 'timestamp'], name='sorter_tomato_session_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='sortingsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('is_active',), name='sorter_one_active_session'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0004_session_tomato_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tomato',
+            name='confidence',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tomato',
+            name='source',
+            field=models.CharField(choices=[('manual', 'Manual'), ('camera', 'Camera')], default='manual', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='tomato',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
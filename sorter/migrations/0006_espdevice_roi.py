@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0005_tomato_source_confidence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='espdevice',
+            name='detection_width',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='espdevice',
+            name='roi_height',
+            field=models.IntegerField(default=100),
+        ),
+        migrations.AddField(
+            model_name='espdevice',
+            name='roi_width',
+            field=models.IntegerField(default=100),
+        ),
+        migrations.AddField(
+            model_name='espdevice',
+            name='roi_x',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='espdevice',
+            name='roi_y',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 17:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0006_espdevice_roi'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='espdevice',
+            name='config_version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0007_espdevice_config_version'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='sortingsession',
+            name='sorter_one_active_session',
+        ),
+        migrations.AddConstraint(
+            model_name='sortingsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('device',), name='sorter_one_active_session_per_device'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q
+from django.db.models.functions import TruncMinute
+
+
+def backfill_rollups(apps, schema_editor):
+    Tomato = apps.get_model('sorter', 'Tomato')
+    TomatoRollup = apps.get_model('sorter', 'TomatoRollup')
+    rows = (
+        Tomato.objects.annotate(minute=TruncMinute('timestamp'))
+        .values('session_id', 'minute')
+        .annotate(ripe=Count('id', filter=Q(is_ripe=True)), green=Count('id', filter=Q(is_ripe=False)))
+        .order_by()
+    )
+    TomatoRollup.objects.bulk_create([
+        TomatoRollup(session_id=row['session_id'], bucket=row['minute'], ripe_count=row['ripe'], green_count=row['green'])
+        for row in rows.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0008_session_active_per_device'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TomatoRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('ripe_count', models.PositiveIntegerField(default=0)),
+                ('green_count', models.PositiveIntegerField(default=0)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='sorter.sortingsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='sorter_rollup_bucket_idx')],
+                'constraints': [models.UniqueConstraint(fields=('session', 'bucket'), name='sorter_rollup_session_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sorter', '0009_tomato_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sortingsession',
+            name='archived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
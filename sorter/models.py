@@ -1,6 +1,28 @@
-from django.db import models
+import copy
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncMinute
 from django.utils import timezone
 
+# In-process cache of ESPDevice rows keyed by primary key. Entries are
+# refreshed on save (write-through) and expire after TOMATO_DEVICE_CACHE_TTL
+# seconds so changes made by other processes are picked up.
+_device_cache = {}
+_device_cache_lock = threading.Lock()
+
+def invalidate_device_cache(pk=None):
+    """Drop one cached device, or all of them when pk is None."""
+    with _device_cache_lock:
+        if pk is None:
+            _device_cache.clear()
+        else:
+            _device_cache.pop(pk, None)
+
 class ESPDevice(models.Model):
     name = models.CharField(max_length=100, default="Tomato Sorter")
     ip_address = models.CharField(max_length=15, blank=True, null=True)
@@ -16,6 +38,18 @@ class ESPDevice(models.Model):
     green_threshold_max = models.IntegerField(default=70)
     detection_sensitivity = models.IntegerField(default=70)
 
+    # Region of interest in percent of the frame, and the width frames are
+    # scaled down to before detection (0 keeps the camera resolution)
+    roi_x = models.IntegerField(default=0)
+    roi_y = models.IntegerField(default=0)
+    roi_width = models.IntegerField(default=100)
+    roi_height = models.IntegerField(default=100)
+    detection_width = models.IntegerField(default=0)
+
+    # Bumped whenever detector_config() changes so detector workers rebuild
+    # their detector only then
+    config_version = models.PositiveIntegerField(default=1)
+
     DETECTION_MODES = (
         ('auto', 'Automatic'),
         ('manual', 'Manual'),
@@ -26,24 +60,185 @@ class ESPDevice(models.Model):
     def __str__(self):
         return f"{self.name} ({self.ip_address})"
 
+    def detector_config(self):
+        """Return the TomatoDetector configuration for this device."""
+        return {
+            'ripe_threshold_min': self.ripe_threshold_min,
+            'ripe_threshold_max': self.ripe_threshold_max,
+            'green_threshold_min': self.green_threshold_min,
+            'green_threshold_max': self.green_threshold_max,
+            'detection_sensitivity': self.detection_sensitivity,
+            'roi': (self.roi_x, self.roi_y, self.roi_width, self.roi_height),
+            'detection_width': self.detection_width
+        }
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        if kwargs.get('update_fields') is None:
+            self._cache_put()
+        else:
+            invalidate_device_cache(self.pk)
+
+    def delete(self, *args, **kwargs):
+        pk = self.pk
+        result = super().delete(*args, **kwargs)
+        invalidate_device_cache(pk)
+        return result
+
+    def _cache_put(self):
+        ttl = getattr(settings, 'TOMATO_DEVICE_CACHE_TTL', 5.0)
+        with _device_cache_lock:
+            _device_cache[self.pk] = (time.monotonic() + ttl, copy.copy(self))
+
+    @classmethod
+    def _cache_get(cls, pk):
+        with _device_cache_lock:
+            entry = _device_cache.get(pk)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        # Hand out a copy so callers can modify it without touching the cache
+        return copy.copy(entry[1])
+
     @classmethod
     def get_default_device(cls):
-        device, created = cls.objects.get_or_create(id=1)
+        device = cls._cache_get(1)
+        if device is None:
+            device, created = cls.objects.get_or_create(id=1)
+            device._cache_put()
+        return device
+
+    @classmethod
+    async def aget_default_device(cls):
+        device = cls._cache_get(1)
+        if device is None:
+            device = await sync_to_async(cls.get_default_device)()
+        return device
+
+    @classmethod
+    def get_device(cls, pk=None):
+        """
+        Return a device through the cache, the default device when pk is None.
+
+        Raises:
+            ESPDevice.DoesNotExist: If there is no device with that id
+        """
+        if pk is None or int(pk) == 1:
+            return cls.get_default_device()
+        device = cls._cache_get(int(pk))
+        if device is None:
+            device = cls.objects.get(pk=pk)
+            device._cache_put()
+        return device
+
+    @classmethod
+    async def aget_device(cls, pk=None):
+        if pk is None or int(pk) == 1:
+            return await cls.aget_default_device()
+        device = cls._cache_get(int(pk))
+        if device is None:
+            device = await sync_to_async(cls.get_device)(pk)
         return device
 
+    def set_online(self, is_online):
+        """
+        Persist an online/offline transition.
+
+        Only writes when the value actually changes, and then only the
+        ``is_online`` and ``last_seen`` columns.
+
+        Returns:
+            bool: True if the row was updated
+        """
+        if self.is_online == is_online:
+            return False
+        self.is_online = is_online
+        self.save(update_fields=['is_online', 'last_seen'])
+        return True
+
+    async def aset_online(self, is_online):
+        return await sync_to_async(self.set_online)(is_online)
+
+    @classmethod
+    def mark_online(cls, ip_address, is_online):
+        """Record an online/offline transition for the device(s) at an address."""
+        updated = cls.objects.filter(ip_address=ip_address).exclude(is_online=is_online).update(
+            is_online=is_online,
+            last_seen=timezone.now()
+        )
+        if updated:
+            invalidate_device_cache()
+        return updated
+
 class SortingSession(models.Model):
     start_time = models.DateTimeField(default=timezone.now)
     end_time = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)
     device = models.ForeignKey(ESPDevice, on_delete=models.CASCADE, related_name='sessions')
 
+    # Running totals maintained by record_tomato() so stats never need a COUNT
+    ripe_count = models.PositiveIntegerField(default=0)
+    green_count = models.PositiveIntegerField(default=0)
+
+    # Set once the session's Tomato rows have been written to an archive file
+    # and are being deleted; from then on the counters and TomatoRollup rows
+    # are the only record in the database and are never recomputed
+    archived_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-start_time'], name='sorter_session_start_idx'),
+        ]
+        constraints = [
+            # One running session per sorter line; also the partial index
+            # behind the active-session lookup
+            models.UniqueConstraint(
+                fields=['device'],
+                condition=Q(is_active=True),
+                name='sorter_one_active_session_per_device'
+            ),
+        ]
+
     def __str__(self):
         return f"Session {self.id} - {self.start_time.strftime('%Y-%m-%d %H:%M')}"
 
+    @classmethod
+    def get_active(cls, device=None):
+        """Return the device's active session (any device's when None), or None."""
+        sessions = cls.objects.filter(is_active=True)
+        if device is not None:
+            sessions = sessions.filter(device=device)
+        return sessions.first()
+
+    @classmethod
+    async def aget_active(cls, device=None):
+        sessions = cls.objects.filter(is_active=True)
+        if device is not None:
+            sessions = sessions.filter(device=device)
+        return await sessions.afirst()
+
+    @classmethod
+    def get_or_start(cls, device):
+        """
+        Return the device's active session, starting one if there is none.
+
+        Two requests racing to start a session both end up with the same one:
+        the loser hits the one-active-session-per-device constraint and re-reads.
+        """
+        session = cls.get_active(device)
+        if session:
+            return session
+        try:
+            with transaction.atomic():
+                return cls.objects.create(device=device)
+        except IntegrityError:
+            return cls.get_active(device)
+
     def end_session(self):
         self.end_time = timezone.now()
         self.is_active = False
-        self.save()
+        # Only these fields: the counters may have been bumped since this
+        # instance was loaded and saving them back would undo those sorts
+        self.save(update_fields=['end_time', 'is_active'])
 
     @property
     def duration(self):
@@ -53,20 +248,154 @@ class SortingSession(models.Model):
 
     @property
     def total_tomatoes(self):
-        return self.tomatoes.count()
+        return self.ripe_count + self.green_count
 
-    @property
-    def ripe_count(self):
-        return self.tomatoes.filter(is_ripe=True).count()
+    def record_tomato(self, is_ripe, source='manual', confidence=None):
+        """
+        Store a sorted tomato and bump the matching session counter.
 
-    @property
-    def green_count(self):
-        return self.tomatoes.filter(is_ripe=False).count()
+        The counter is incremented with an F() expression in the same
+        transaction as the insert, so concurrent sorts never lose updates.
+        The sort views go through the batching TomatoEventBuffer instead;
+        this is the unbuffered single-row path.
+
+        Returns:
+            Tomato: The created tomato
+        """
+        counter = 'ripe_count' if is_ripe else 'green_count'
+        with transaction.atomic():
+            tomato = Tomato.objects.create(session=self, is_ripe=is_ripe, source=source, confidence=confidence)
+            SortingSession.objects.filter(pk=self.pk).update(**{counter: F(counter) + 1})
+            TomatoRollup.add({(self.pk, minute_bucket(tomato.timestamp)): (int(is_ripe), int(not is_ripe))})
+        self.refresh_from_db(fields=['ripe_count', 'green_count'])
+        return tomato
+
+    def reconcile_counts(self):
+        """
+        Recompute the counters from the Tomato rows.
+
+        Archived sessions are left alone, their Tomato rows are gone.
+
+        Returns:
+            bool: True if the stored counters were wrong and have been fixed
+        """
+        if self.archived_at:
+            return False
+        counts = self.tomatoes.aggregate(
+            ripe=Count('id', filter=Q(is_ripe=True)),
+            green=Count('id', filter=Q(is_ripe=False))
+        )
+        if (counts['ripe'], counts['green']) == (self.ripe_count, self.green_count):
+            return False
+        self.ripe_count = counts['ripe']
+        self.green_count = counts['green']
+        self.save(update_fields=['ripe_count', 'green_count'])
+        return True
 
 class Tomato(models.Model):
     session = models.ForeignKey(SortingSession, on_delete=models.CASCADE, related_name='tomatoes')
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set explicitly (not auto_now_add) so buffered events keep their sort time
+    timestamp = models.DateTimeField(default=timezone.now)
     is_ripe = models.BooleanField()
 
+    SOURCES = (
+        ('manual', 'Manual'),
+        ('camera', 'Camera'),
+    )
+    source = models.CharField(max_length=10, choices=SOURCES, default='manual')
+    confidence = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['session', 'is_ripe', 'timestamp'], name='sorter_tomato_session_idx'),
+        ]
+
     def __str__(self):
         return f"{'Ripe' if self.is_ripe else 'Green'} Tomato - {self.timestamp.strftime('%Y-%m-%d %H:%M:%S')}"
+
+
+def minute_bucket(timestamp):
+    """Start of the minute a timestamp falls in, the TomatoRollup bucket key."""
+    return timestamp.replace(second=0, microsecond=0)
+
+class TomatoRollup(models.Model):
+    """
+    Per-minute ripe/green counts of a session, kept in step with Tomato.
+
+    Every write path that inserts Tomato rows adds to the matching rollup
+    rows in the same transaction, so statistics over long ranges sum at
+    most one row per session and minute instead of counting Tomato rows.
+    """
+    session = models.ForeignKey(SortingSession, on_delete=models.CASCADE, related_name='rollups')
+    bucket = models.DateTimeField()
+    ripe_count = models.PositiveIntegerField(default=0)
+    green_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'bucket'], name='sorter_rollup_session_bucket'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket'], name='sorter_rollup_bucket_idx'),
+        ]
+
+    def __str__(self):
+        return f"Session {self.session_id} {self.bucket.strftime('%Y-%m-%d %H:%M')}: {self.ripe_count}/{self.green_count}"
+
+    @classmethod
+    def add(cls, counts):
+        """
+        Add counts to the rollup, creating missing rows.
+
+        Call inside the transaction that inserts the Tomato rows. Missing rows
+        are created with zero counts first (ignoring ones another writer just
+        created) and then incremented with F() expressions, so concurrent
+        writers never lose counts.
+
+        Args:
+            counts (dict): (session_id, bucket) -> (ripe, green)
+        """
+        if not counts:
+            return
+        cls.objects.bulk_create(
+            [cls(session_id=session_id, bucket=bucket) for session_id, bucket in counts],
+            ignore_conflicts=True
+        )
+        for (session_id, bucket), (ripe, green) in counts.items():
+            cls.objects.filter(session_id=session_id, bucket=bucket).update(
+                ripe_count=F('ripe_count') + ripe,
+                green_count=F('green_count') + green
+            )
+
+    @classmethod
+    def rebuild(cls, sessions=None):
+        """
+        Recompute rollup rows from the Tomato rows.
+
+        Archived sessions are skipped: their rollups outlive the Tomato rows.
+
+        Args:
+            sessions (QuerySet): Sessions to rebuild (default: all)
+
+        Returns:
+            int: Number of rollup rows written
+        """
+        tomatoes = Tomato.objects.filter(session__archived_at__isnull=True)
+        rollups = cls.objects.filter(session__archived_at__isnull=True)
+        if sessions is not None:
+            tomatoes = tomatoes.filter(session__in=sessions)
+            rollups = rollups.filter(session__in=sessions)
+
+        rows = (
+            tomatoes.annotate(minute=TruncMinute('timestamp'))
+            .values('session_id', 'minute')
+            .annotate(ripe=Count('id', filter=Q(is_ripe=True)), green=Count('id', filter=Q(is_ripe=False)))
+            .order_by()
+        )
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create([
+                cls(session_id=row['session_id'], bucket=row['minute'], ripe_count=row['ripe'], green_count=row['green'])
+                for row in rows.iterator()
+            ], batch_size=500)
+        return len(created)
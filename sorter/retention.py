@@ -0,0 +1,166 @@
+import gzip
+import os
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .export import export_queryset, iter_export
+from .models import SortingSession, Tomato, TomatoRollup
+
+
+def archive_dir():
+    """Directory archive files are written to, TOMATO_ARCHIVE_DIR."""
+    return Path(getattr(settings, 'TOMATO_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(session_id, directory=None):
+    """Archive file of a session: session-<id>.ndjson.gz in the archive directory."""
+    return Path(directory or archive_dir()) / f'session-{session_id}.ndjson.gz'
+
+
+def expired_sessions(days=None):
+    """
+    Select ended sessions older than the retention period that still have Tomato rows.
+
+    Sessions that were archived but not fully deleted (an interrupted run)
+    are included so the next run finishes them.
+
+    Args:
+        days (int): Retention period (default: TOMATO_RETENTION_DAYS)
+
+    Returns:
+        QuerySet: Sessions, oldest first
+    """
+    if days is None:
+        days = getattr(settings, 'TOMATO_RETENTION_DAYS', 90)
+    cutoff = timezone.now() - timedelta(days=days)
+    return (
+        SortingSession.objects
+        .filter(is_active=False, end_time__lt=cutoff)
+        .filter(Exists(Tomato.objects.filter(session=OuterRef('pk'))))
+        .order_by('end_time', 'pk')
+    )
+
+
+def summarize_session(session):
+    """
+    Make the session counters and TomatoRollup rows match its Tomato rows.
+
+    These are what stays in the database once the rows are archived.
+
+    Returns:
+        int: Number of Tomato rows in the session
+    """
+    session.reconcile_counts()
+    TomatoRollup.rebuild(SortingSession.objects.filter(pk=session.pk))
+    return session.total_tomatoes
+
+
+def write_archive(session, path, chunk_size=2000):
+    """
+    Write a session's Tomato rows to a gzipped NDJSON file.
+
+    The file has the /api/export/ NDJSON format. It is written next to its
+    final name and renamed into place, so a partial file is never mistaken
+    for a complete archive.
+
+    Returns:
+        int: Number of rows written
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(path.name + '.partial')
+
+    written = 0
+    with open(partial, 'wb') as f:
+        with gzip.GzipFile(fileobj=f, mode='wb') as gz:
+            for chunk in iter_export(export_queryset(session_id=session.pk), 'ndjson', chunk_size):
+                gz.write(chunk.encode('utf-8'))
+                written += chunk.count('\n')
+        # On disk before the rows it holds are deleted
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial, path)
+    return written
+
+
+def delete_tomatoes(session, batch_size=500, pause=0.0):
+    """
+    Delete a session's Tomato rows in short transactions of batch_size rows.
+
+    SQLite allows one writer at a time; small batches with an optional pause
+    between them let the event buffer's flushes in between instead of
+    waiting behind one long DELETE.
+
+    Returns:
+        int: Number of rows deleted
+    """
+    deleted = 0
+    while True:
+        ids = list(Tomato.objects.filter(session=session).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        with transaction.atomic():
+            count, _ = Tomato.objects.filter(pk__in=ids).delete()
+        deleted += count
+        if pause:
+            time.sleep(pause)
+
+
+def archive_session(session, directory=None, batch_size=500, pause=0.0):
+    """
+    Move a session's Tomato rows to its archive file.
+
+    The counters and rollups are brought up to date, the rows are written to
+    the archive and checked against the counters, the session is marked
+    archived and only then are the rows deleted. A session that is already
+    marked archived keeps its file and just has its remaining rows deleted.
+
+    Args:
+        session (SortingSession): An ended session
+        directory (Path): Archive directory (default: TOMATO_ARCHIVE_DIR)
+        batch_size (int): Rows per delete transaction
+        pause (float): Seconds to sleep between delete batches
+
+    Returns:
+        tuple: (rows archived, rows deleted)
+    """
+    if session.is_active:
+        raise ValueError(f"Session {session.pk} is still active")
+
+    archived = 0
+    if session.archived_at is None:
+        path = archive_path(session.pk, directory)
+        expected = summarize_session(session)
+        archived = write_archive(session, path, chunk_size=batch_size)
+        if archived != expected:
+            # Rows arrived or vanished while writing; leave them for the next run
+            os.remove(path)
+            raise RuntimeError(f"Session {session.pk}: archived {archived} rows but counters say {expected}")
+        session.archived_at = timezone.now()
+        session.save(update_fields=['archived_at'])
+
+    deleted = delete_tomatoes(session, batch_size=batch_size, pause=pause)
+    return archived, deleted
+
+
+def optimize_database(vacuum=False):
+    """
+    Refresh the query planner statistics and optionally reclaim free space.
+
+    ``ANALYZE`` is cheap and keeps index choices good after large deletes.
+    ``VACUUM`` rewrites the whole database file under an exclusive lock, so
+    it is opt-in and best run while the sorter is idle.
+
+    Args:
+        vacuum (bool): Also run VACUUM
+    """
+    with connection.cursor() as cursor:
+        if vacuum:
+            cursor.execute('VACUUM')
+        cursor.execute('ANALYZE')
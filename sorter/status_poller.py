@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+
+from .device_client import device_client
+
+logger = logging.getLogger(__name__)
+
+
+class _Target:
+    """Polling state for a single device address."""
+
+    def __init__(self, ip_address):
+        self.ip_address = ip_address
+        self.data = {}
+        self.online = None
+        self.fetched_at = None
+        self.checked_at = None
+        self.failures = 0
+        self.error = None
+        self.next_poll = 0.0
+        self.last_access = time.monotonic()
+        self.wake = threading.Event()
+        self.thread = None
+
+
+class DeviceStatusPoller:
+    """
+    Keeps a cached snapshot of each ESP32 ``/status`` payload.
+
+    One background thread per device refreshes the snapshot every
+    ``interval`` seconds while someone is reading it, so any number of
+    dashboards cost a single request stream to the device. Failed polls back
+    off exponentially up to ``max_backoff`` seconds, and polling pauses once
+    nobody has read the snapshot for ``idle_timeout`` seconds. Readers never
+    touch the network; they get the latest snapshot with its age and a
+    ``stale`` flag.
+    """
+
+    def __init__(self, interval=2.0, max_backoff=30.0, idle_timeout=60.0, timeout=2, on_change=None, on_data=None):
+        """
+        Initialize the poller.
+
+        Args:
+            interval (float): Seconds between polls while the device answers
+            max_backoff (float): Upper bound for the delay between failed polls
+            idle_timeout (float): Stop polling after this long without readers
+            timeout (float): Timeout for each status request
+            on_change (callable): Called as on_change(ip_address, online) when
+                the device goes online or offline
+            on_data (callable): Called as on_data(ip_address, data) when the
+                /status payload differs from the previous one
+        """
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.on_change = on_change
+        self.on_data = on_data
+
+        self._lock = threading.Lock()
+        self._targets = {}
+
+    def snapshot(self, ip_address):
+        """
+        Return the cached status for a device, starting its poller if needed.
+
+        Returns:
+            dict: ``online`` (None until the first poll finishes), ``data``
+            (the last /status payload), ``fetched_at`` (epoch seconds of the
+            last successful poll), ``age``, ``stale``, ``failures`` and ``error``
+        """
+        with self._lock:
+            target = self._targets.get(ip_address)
+            if target is None:
+                target = self._targets[ip_address] = _Target(ip_address)
+            target.last_access = time.monotonic()
+            if target.thread is None or not target.thread.is_alive():
+                target.thread = threading.Thread(
+                    target=self._run, args=(target,), name=f'status-poller-{ip_address}', daemon=True
+                )
+                target.thread.start()
+            return self._public(target)
+
+    def refresh(self, ip_address):
+        """Ask the poller to fetch a device's status now instead of waiting."""
+        with self._lock:
+            target = self._targets.get(ip_address)
+        if target is not None:
+            target.wake.set()
+
+    def forget(self, ip_address):
+        """Drop a device, e.g. after its IP address changed."""
+        with self._lock:
+            target = self._targets.pop(ip_address, None)
+        if target is not None:
+            target.wake.set()
+
+    def _run(self, target):
+        while True:
+            with self._lock:
+                if self._targets.get(target.ip_address) is not target:
+                    return
+                if time.monotonic() - target.last_access > self.idle_timeout:
+                    target.thread = None
+                    return
+
+            self._poll(target)
+
+            target.wake.wait(max(0.0, target.next_poll - time.monotonic()))
+            target.wake.clear()
+
+    def _poll(self, target):
+        data = None
+        error = None
+        try:
+            response = device_client.status(target.ip_address, timeout=self.timeout)
+            if response.status_code == 200:
+                data = response.json()
+            else:
+                error = f'HTTP {response.status_code}'
+        except Exception as e:
+            error = str(e)
+
+        now = time.monotonic()
+        with self._lock:
+            was_online = target.online
+            data_changed = data is not None and data != target.data
+            target.checked_at = time.time()
+            if data is not None:
+                target.data = data
+                target.online = True
+                target.fetched_at = target.checked_at
+                target.failures = 0
+                target.error = None
+                target.next_poll = now + self.interval
+            else:
+                target.online = False
+                target.failures += 1
+                target.error = error
+                backoff = min(self.max_backoff, self.interval * (2 ** target.failures))
+                target.next_poll = now + backoff
+
+        if was_online != target.online:
+            logger.info(f"ESP32 at {target.ip_address} is now {'online' if target.online else 'offline'}")
+            if self.on_change is not None:
+                try:
+                    self.on_change(target.ip_address, target.online)
+                except Exception as e:
+                    logger.error(f"Error handling status change for {target.ip_address}: {str(e)}")
+
+        if data_changed and self.on_data is not None:
+            try:
+                self.on_data(target.ip_address, data)
+            except Exception as e:
+                logger.error(f"Error handling status data for {target.ip_address}: {str(e)}")
+
+    def _public(self, target):
+        age = None
+        if target.fetched_at is not None:
+            age = round(time.time() - target.fetched_at, 3)
+        return {
+            'ip': target.ip_address,
+            'online': target.online,
+            'data': dict(target.data),
+            'fetched_at': target.fetched_at,
+            'checked_at': target.checked_at,
+            'age': age,
+            'stale': age is None or age > self.interval * 2,
+            'failures': target.failures,
+            'error': target.error,
+        }
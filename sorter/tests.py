@@ -1,3 +1,887 @@
-from django.test import TestCase
+import asyncio
+import base64
+import csv
+import datetime as dt
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError
+from django.db.models import Sum
+from django.test import AsyncClient, SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from .actuation import ActuationScheduler, get_scheduler
+from .benchmark import TOMATO_COLORS, synthetic_frame
+from .camera import CameraService
+from .detection_pool import DetectorBusy
+from .event_buffer import TomatoEventBuffer
+from .frame_tracker import FrameTracker, PresenceGate, fingerprint_frame
+from .models import ESPDevice, SortingSession, Tomato, TomatoRollup, invalidate_device_cache
+from .retention import archive_path, archive_session, expired_sessions
+from .status_poller import DeviceStatusPoller
+from .timeutils import parse_time
+from .tomato_detector import TomatoDetector
+from .views import persist_online_state
+
+
+RIPE = (20, 20, 220)
+GREEN = (30, 180, 30)
+
+
+def tomato_jpeg(color=RIPE, radius=150):
+    """A synthetic belt frame with one tomato, JPEG encoded."""
+    frame = np.full((480, 640, 3), 60, np.uint8)
+    if color is not None:
+        cv2.ellipse(frame, (320, 240), (radius, radius), 0, 0, 360, color, -1)
+    return cv2.imencode('.jpg', frame)[1].tobytes()
+
+
+class TomatoEventBufferTests(TransactionTestCase):
+    """The flusher thread uses its own connection, so data must be committed."""
+
+    def setUp(self):
+        self.device = ESPDevice.objects.create()
+        self.session = SortingSession.objects.create(device=self.device)
+
+    def stored(self):
+        self.session.refresh_from_db()
+        return Tomato.objects.filter(session=self.session).count()
+
+    def test_flushes_when_max_events_pending(self):
+        buffer = TomatoEventBuffer(max_events=3, max_delay=60)
+        buffer.add(self.session.pk, True)
+        buffer.add(self.session.pk, False)
+        self.assertEqual(self.stored(), 0)
+
+        buffer.add(self.session.pk, True)
+        self.assertEqual(self.stored(), 3)
+        self.assertEqual((self.session.ripe_count, self.session.green_count), (2, 1))
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_flushes_after_max_delay(self):
+        buffer = TomatoEventBuffer(max_events=100, max_delay=0.05)
+        buffer.add(self.session.pk, True)
+
+        deadline = time.monotonic() + 5
+        while buffer.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(buffer.pending(), 0)
+        # The events leave the queue when the write starts; wait for it to end
+        with buffer._flush_lock:
+            pass
+        self.assertEqual(self.stored(), 1)
+
+    def test_at_most_max_events_minus_one_unwritten(self):
+        buffer = TomatoEventBuffer(max_events=5, max_delay=60)
+        for added in range(1, 13):
+            buffer.add(self.session.pk, True)
+            self.assertLessEqual(buffer.pending(), buffer.max_events - 1)
+            self.assertEqual(self.stored() + buffer.pending(), added)
+
+    def test_concurrent_adders_stay_within_max_pending(self):
+        buffer = TomatoEventBuffer(max_events=10, max_delay=60, max_pending=12)
+        written = []
+        held = []
+
+        def slow_write(events):
+            # Adders keep going while the batch is in flight
+            time.sleep(0.002)
+            held.append((len(events), buffer.pending()))
+            written.extend(events)
+
+        def adder(n):
+            for i in range(200):
+                buffer.add(self.session.pk, True, confidence=n * 1000 + i)
+
+        with mock.patch.object(buffer, '_write', side_effect=slow_write):
+            threads = [threading.Thread(target=adder, args=(n,)) for n in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            buffer.flush()
+
+        self.assertLessEqual(max(pending for _, pending in held), 12)
+        self.assertLessEqual(max(batch + pending for batch, pending in held), 24)
+        # Every event was written once or counted as dropped
+        confidences = [event.confidence for event in written]
+        self.assertEqual(len(confidences), len(set(confidences)))
+        self.assertEqual(len(written) + buffer.dropped, 1600)
+        self.assertEqual(buffer.pending(), 0)
+
+    def test_rejected_event_does_not_block_the_batch(self):
+        buffer = TomatoEventBuffer(max_events=100, max_delay=60)
+        buffer.add(self.session.pk + 1000, True)
+        for _ in range(5):
+            buffer.add(self.session.pk, True)
+
+        self.assertEqual(buffer.flush(), 5)
+        self.assertEqual(buffer.pending(), 0)
+        self.assertEqual(self.stored(), 5)
+        self.assertEqual(self.session.ripe_count, 5)
+        self.assertEqual([event.session_id for event in buffer.rejected], [self.session.pk + 1000])
+
+    def test_failed_flush_is_retried(self):
+        buffer = TomatoEventBuffer(max_events=100, max_delay=60)
+        for _ in range(3):
+            buffer.add(self.session.pk, False)
+
+        with mock.patch.object(buffer, '_write', side_effect=OperationalError('database is locked')):
+            self.assertEqual(buffer.flush(), 0)
+        self.assertEqual(buffer.pending(), 3)
+        self.assertEqual(self.stored(), 0)
+
+        self.assertEqual(buffer.flush(), 3)
+        self.assertEqual(self.stored(), 3)
+        self.assertEqual(self.session.green_count, 3)
+
+    def test_pending_events_are_capped(self):
+        buffer = TomatoEventBuffer(max_events=2, max_delay=60, max_pending=4)
+        with mock.patch.object(buffer, '_write', side_effect=OperationalError('database is locked')):
+            for _ in range(10):
+                buffer.add(self.session.pk, True)
+        self.assertEqual(buffer.pending(), 4)
+        self.assertEqual(buffer.dropped, 6)
+
+
+class SortingSessionTests(TransactionTestCase):
+
+    def test_end_session_keeps_counts_recorded_since_load(self):
+        session = SortingSession.objects.create(device=ESPDevice.objects.create())
+        stale = SortingSession.objects.get(pk=session.pk)
+
+        buffer = TomatoEventBuffer(max_events=3, max_delay=60)
+        for _ in range(3):
+            buffer.add(session.pk, True)
+
+        stale.end_session()
+        session.refresh_from_db()
+        self.assertFalse(session.is_active)
+        self.assertEqual(session.ripe_count, 3)
+
+
+class ActuationSchedulerTests(SimpleTestCase):
+
+    def test_shutdown_sends_pending_stop(self):
+        scheduler = ActuationScheduler(stop_delay=60)
+        with mock.patch('sorter.actuation.device_client') as client:
+            client.post.return_value.status_code = 200
+            scheduler.schedule_sort('10.0.0.2', 'ripe')
+            scheduler.shutdown(timeout=5)
+
+        payloads = [call.args[2] for call in client.post.call_args_list]
+        self.assertEqual(payloads[0], {'command': 'release'})
+        self.assertEqual(payloads[1], {'type': 'ripe', 'from_camera': True})
+        self.assertEqual(payloads[-1], {'command': 'stop'})
+        self.assertFalse(scheduler.status()['stopper_open'])
+
+
+class FrameTrackerTests(SimpleTestCase):
+
+    def stationary_tomato(self):
+        frame = np.full((480, 640, 3), 60, np.uint8)
+        cv2.ellipse(frame, (320, 240), (90, 80), 0, 0, 360, (30, 40, 200), -1)
+        return fingerprint_frame(frame)
+
+    def test_stationary_tomato_confirms_within_confirm_frames(self):
+        tracker = FrameTracker(confirm_frames=3)
+        fingerprint = self.stationary_tomato()
+        ripe = {'type': 'ripe', 'confidence': 9.0, 'config_version': 1}
+
+        commits = []
+        for _ in range(6):
+            cached = tracker.cached_result('cam', fingerprint, 1)
+            result = cached if cached is not None else ripe
+            commits.append(tracker.observe('cam', fingerprint, result, cached is not None)['commit'])
+
+        # Classified once, reused twice, sorted once
+        self.assertEqual(commits, [None, None, 'ripe', None, None, None])
+
+    def test_reposted_image_does_not_confirm(self):
+        tracker = FrameTracker(confirm_frames=3)
+        fingerprint = self.stationary_tomato()
+        ripe = {'type': 'ripe', 'confidence': 9.0, 'config_version': 1}
+
+        for _ in range(5):
+            cached = tracker.cached_result('cam', fingerprint, 1)
+            decision = tracker.observe('cam', fingerprint, cached or ripe, cached is not None, digest=b'same jpeg')
+            self.assertIsNone(decision['commit'])
+        self.assertEqual(decision['streak'], 1)
+        self.assertTrue(decision['repeat'])
+
+        decision = tracker.observe('cam', fingerprint, ripe, True, digest=b'next jpeg')
+        self.assertEqual(decision['streak'], 2)
+
+
+class PresenceGateTests(SimpleTestCase):
+
+    def setUp(self):
+        self.gate = PresenceGate()
+        self.empty = fingerprint_frame(tomato_jpeg(color=None))
+        self.tomato = fingerprint_frame(tomato_jpeg())
+        self.green = fingerprint_frame(tomato_jpeg(GREEN))
+
+    def test_nothing_gated_before_background_is_learned(self):
+        self.assertFalse(self.gate.is_empty('cam', self.empty))
+        self.assertEqual(self.gate.stats()['gated'], 0)
+
+    def test_empty_frames_are_gated(self):
+        self.gate.learn('cam', self.empty)
+        self.assertTrue(self.gate.is_empty('cam', self.empty))
+        self.assertFalse(self.gate.is_empty('cam', self.tomato))
+        self.assertFalse(self.gate.is_empty('cam', self.green))
+        self.assertFalse(self.gate.is_empty('other', self.empty))
+        self.assertEqual(self.gate.stats(), {'checked': 4, 'gated': 1, 'hit_rate': 0.25})
+
+    def test_held_tomato_is_never_absorbed(self):
+        self.gate.learn('cam', self.empty)
+        for _ in range(500):
+            self.assertFalse(self.gate.is_empty('cam', self.tomato))
+        self.assertTrue(self.gate.is_empty('cam', self.empty))
+
+
+class CameraServiceTests(TransactionTestCase):
+
+    def setUp(self):
+        # The default sensitivity (70) is stricter than the flat synthetic tomato scores
+        ESPDevice.objects.update_or_create(id=1, defaults={'detection_sensitivity': 50})
+
+    def write_clip(self, path):
+        """Empty belt, a ripe tomato moving through, empty belt again."""
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (640, 480))
+        empty = np.full((480, 640, 3), 60, np.uint8)
+        frames = [empty] * 20
+        for x in range(160, 480, 16):
+            frame = empty.copy()
+            cv2.ellipse(frame, (x, 240), (90, 80), 0, 0, 360, (30, 40, 200), -1)
+            frames.append(frame)
+        frames += [empty] * 20
+        for frame in frames:
+            writer.write(frame)
+        writer.release()
+        return len(frames)
+
+    def test_recorded_clip_sorts_once(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'belt.avi')
+            frames = self.write_clip(path)
+
+            commits = []
+            service = CameraService(
+                path,
+                tracker=FrameTracker(confirm_frames=3),
+                gate=PresenceGate(),
+                on_commit=lambda device, tomato_type, result: commits.append(tomato_type),
+                realtime=False,
+                process_all=True
+            )
+            service.start()
+            service.join(timeout=60)
+
+        self.assertFalse(service.is_running())
+        self.assertIsNone(service.error)
+        stats = service.stats()
+        self.assertEqual(stats['read'], frames)
+        self.assertEqual(stats['processed'], frames)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertEqual(commits, ['ripe'])
+        self.assertEqual(stats['sorts'], 1)
+
+
+class RetentionTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.device = ESPDevice.objects.create()
+        self.session = self.old_session(ripe=30, green=15)
+
+    def old_session(self, ripe, green, days=120):
+        start = timezone.now() - timedelta(days=days)
+        session = SortingSession.objects.create(
+            device=self.device, start_time=start, end_time=start + timedelta(hours=1), is_active=False
+        )
+        Tomato.objects.bulk_create([
+            Tomato(session=session, is_ripe=index < ripe, timestamp=start + timedelta(seconds=10 * index))
+            for index in range(ripe + green)
+        ])
+        return session
+
+    def archived_rows(self, session):
+        with gzip.open(archive_path(session.pk, self.directory), 'rt') as f:
+            return [json.loads(line) for line in f]
+
+    def rollup_totals(self, session):
+        return TomatoRollup.objects.filter(session=session).aggregate(ripe=Sum('ripe_count'), green=Sum('green_count'))
+
+    def test_archive_matches_deleted_rows(self):
+        ids = set(Tomato.objects.filter(session=self.session).values_list('pk', flat=True))
+        archived, deleted = archive_session(self.session, self.directory, batch_size=7)
+
+        self.assertEqual((archived, deleted), (45, 45))
+        rows = self.archived_rows(self.session)
+        self.assertEqual({row['id'] for row in rows}, ids)
+        self.assertEqual(sum(row['type'] == 'ripe' for row in rows), 30)
+        self.assertFalse(Tomato.objects.filter(session=self.session).exists())
+
+    def test_counters_and_rollups_survive(self):
+        archive_session(self.session, self.directory)
+
+        self.session.refresh_from_db()
+        self.assertIsNotNone(self.session.archived_at)
+        self.assertEqual((self.session.ripe_count, self.session.green_count), (30, 15))
+        self.assertEqual(self.rollup_totals(self.session), {'ripe': 30, 'green': 15})
+
+    def test_interrupted_run_resumes(self):
+        with mock.patch('sorter.retention.time.sleep', side_effect=RuntimeError('killed')):
+            with self.assertRaises(RuntimeError):
+                archive_session(self.session, self.directory, batch_size=10, pause=1)
+        self.assertEqual(Tomato.objects.filter(session=self.session).count(), 35)
+
+        self.session.refresh_from_db()
+        self.assertIn(self.session, expired_sessions(90))
+        archived, deleted = archive_session(self.session, self.directory, batch_size=10)
+
+        self.assertEqual((archived, deleted), (0, 35))
+        rows = self.archived_rows(self.session)
+        self.assertEqual(len(rows), 45)
+        self.assertEqual(len({row['id'] for row in rows}), 45)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.total_tomatoes, 45)
+
+    def test_row_count_mismatch_keeps_rows(self):
+        with mock.patch('sorter.retention.summarize_session', return_value=46):
+            with self.assertRaises(RuntimeError):
+                archive_session(self.session, self.directory)
+
+        self.session.refresh_from_db()
+        self.assertIsNone(self.session.archived_at)
+        self.assertEqual(Tomato.objects.filter(session=self.session).count(), 45)
+        self.assertFalse(os.path.exists(archive_path(self.session.pk, self.directory)))
+
+    def test_active_session_is_refused(self):
+        active = SortingSession.objects.create(device=self.device)
+        Tomato.objects.create(session=active, is_ripe=True)
+        with self.assertRaises(ValueError):
+            archive_session(active, self.directory)
+        self.assertEqual(Tomato.objects.filter(session=active).count(), 1)
+
+    def test_maintenance_commands_skip_archived_sessions(self):
+        archive_session(self.session, self.directory)
+
+        call_command('reconcile_session_counts', stdout=StringIO())
+        call_command('rebuild_tomato_rollups', stdout=StringIO())
+
+        self.session.refresh_from_db()
+        self.assertEqual((self.session.ripe_count, self.session.green_count), (30, 15))
+        self.assertEqual(self.rollup_totals(self.session), {'ripe': 30, 'green': 15})
+
+    def test_command_only_archives_expired_sessions(self):
+        recent = self.old_session(ripe=2, green=1, days=10)
+        out = StringIO()
+        call_command('archive_tomatoes', '--archive-dir', self.directory, '--pause', '0', stdout=out)
+
+        self.assertIn('Archived 45 and deleted 45', out.getvalue())
+        self.assertEqual(Tomato.objects.filter(session=recent).count(), 3)
+        self.assertFalse(Tomato.objects.filter(session=self.session).exists())
+
+
+class TomatoStatsTests(TestCase):
+
+    def setUp(self):
+        # Devices cached by an earlier test were rolled back with it
+        invalidate_device_cache()
+        self.device = ESPDevice.get_default_device()
+        self.start = timezone.now().replace(minute=0, second=0, microsecond=0) - timedelta(days=2)
+        self.session = SortingSession.objects.create(device=self.device, start_time=self.start)
+
+        # Sorts spread over two days, written through the event buffer like the views do
+        buffer = TomatoEventBuffer(max_events=1000, max_delay=60)
+        for index in range(300):
+            buffer.add(self.session.pk, index % 3 != 0, timestamp=self.start + timedelta(seconds=577 * index + 13))
+        buffer.flush()
+
+    def stats(self, **params):
+        params.setdefault('session', self.session.pk)
+        return self.client.get('/api/stats/', params).json()
+
+    def raw_counts(self, truncate):
+        counts = Counter()
+        for timestamp, is_ripe in Tomato.objects.filter(session=self.session).values_list('timestamp', 'is_ripe'):
+            counts[(truncate(timestamp), is_ripe)] += 1
+        return counts
+
+    def assert_buckets_match(self, bucket, truncate):
+        data = self.stats(bucket=bucket)
+        counts = self.raw_counts(truncate)
+        expected = sorted({period for period, _ in counts})
+        self.assertEqual([row['start'] for row in data['buckets']], [period.isoformat().replace('+00:00', 'Z') for period in expected])
+        for row, period in zip(data['buckets'], expected):
+            self.assertEqual(row['ripe_count'], counts[(period, True)])
+            self.assertEqual(row['green_count'], counts[(period, False)])
+        self.assertEqual(data['totals']['total_count'], 300)
+
+    def test_minute_buckets_match_raw_rows(self):
+        self.assert_buckets_match('minute', lambda ts: ts.replace(second=0, microsecond=0))
+
+    def test_hour_buckets_match_raw_rows(self):
+        self.assert_buckets_match('hour', lambda ts: ts.replace(minute=0, second=0, microsecond=0))
+
+    def test_day_buckets_match_raw_rows(self):
+        self.assert_buckets_match('day', lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0))
+
+    def test_pending_events_count_once_flushed(self):
+        buffer = TomatoEventBuffer(max_events=1000, max_delay=60)
+        for _ in range(4):
+            buffer.add(self.session.pk, True)
+
+        # Buffered sorts are not in the rollups, nor in the stored counters, until the flush
+        self.assertEqual(self.stats()['totals']['total_count'], 300)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.total_tomatoes, 300)
+
+        buffer.flush()
+        self.assertEqual(self.stats()['totals']['total_count'], 304)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.total_tomatoes, 304)
+
+    def test_rebuild_reproduces_incremental_rollups(self):
+        incremental = list(TomatoRollup.objects.order_by('session_id', 'bucket').values_list(
+            'session_id', 'bucket', 'ripe_count', 'green_count'
+        ))
+        call_command('rebuild_tomato_rollups', stdout=StringIO())
+        rebuilt = list(TomatoRollup.objects.order_by('session_id', 'bucket').values_list(
+            'session_id', 'bucket', 'ripe_count', 'green_count'
+        ))
+        self.assertEqual(rebuilt, incremental)
+        self.assertEqual(sum(row[2] + row[3] for row in rebuilt), 300)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/stats/', {'bucket': 'week'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/stats/', {'session': 999}).status_code, 404)
+        self.assertEqual(self.client.get('/api/stats/', {'start': 'yesterday'}).status_code, 400)
+
+
+class ParseTimeTests(SimpleTestCase):
+
+    def test_date_is_midnight_utc(self):
+        self.assertEqual(parse_time('2026-10-18'), dt.datetime(2026, 10, 18, tzinfo=dt.timezone.utc))
+
+    def test_naive_datetime_is_made_aware(self):
+        self.assertEqual(parse_time('2026-10-18T14:30:00'), dt.datetime(2026, 10, 18, 14, 30, tzinfo=dt.timezone.utc))
+
+    def test_offset_is_kept(self):
+        parsed = parse_time('2026-10-18T14:30:00+02:00')
+        self.assertEqual(parsed, dt.datetime(2026, 10, 18, 12, 30, tzinfo=dt.timezone.utc))
+
+    def test_invalid_value(self):
+        with self.assertRaises(ValueError):
+            parse_time('last tuesday')
+
+
+class ExportFixture:
+
+    def setUp(self):
+        invalidate_device_cache()
+        self.device = ESPDevice.get_default_device()
+        self.other_device = ESPDevice.objects.create(name="Line 2")
+        self.first = SortingSession.objects.create(device=self.device, is_active=False)
+        self.second = SortingSession.objects.create(device=self.other_device)
+
+        day = dt.datetime(2026, 10, 1, 8, tzinfo=dt.timezone.utc)
+        self.tomatoes = [
+            Tomato.objects.create(session=self.first, is_ripe=True, timestamp=day, source='manual'),
+            Tomato.objects.create(session=self.first, is_ripe=False, timestamp=day + timedelta(days=1), source='camera', confidence=12.5),
+            Tomato.objects.create(session=self.second, is_ripe=True, timestamp=day + timedelta(days=2), source='camera', confidence=9.0),
+        ]
+
+    def export(self, **params):
+        response = self.client.get('/api/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def ndjson_ids(self, **params):
+        return [json.loads(line)['id'] for line in self.export(format='ndjson', **params).splitlines()]
+
+
+
+class ExportTests(ExportFixture, TestCase):
+
+    def test_csv_header_and_rows(self):
+        response = self.client.get('/api/export/')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="tomatoes.csv"')
+
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['id', 'session_id', 'device_id', 'timestamp', 'type', 'source', 'confidence'])
+        self.assertEqual(rows[1], [
+            str(self.tomatoes[0].pk), str(self.first.pk), str(self.device.pk),
+            '2026-10-01T08:00:00+00:00', 'ripe', 'manual', ''
+        ])
+        self.assertEqual(rows[2][4:], ['green', 'camera', '12.5'])
+        self.assertEqual(len(rows), 4)
+
+    def test_ndjson(self):
+        response = self.client.get('/api/export/', {'format': 'ndjson'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(records[2], {
+            'id': self.tomatoes[2].pk, 'session_id': self.second.pk, 'device_id': self.other_device.pk,
+            'timestamp': '2026-10-03T08:00:00+00:00', 'type': 'ripe', 'source': 'camera', 'confidence': 9.0
+        })
+
+    def test_filters(self):
+        ids = [tomato.pk for tomato in self.tomatoes]
+        self.assertEqual(self.ndjson_ids(session=self.first.pk), ids[:2])
+        self.assertEqual(self.ndjson_ids(device=self.other_device.pk), ids[2:])
+        self.assertEqual(self.ndjson_ids(start='2026-10-02'), ids[1:])
+        self.assertEqual(self.ndjson_ids(end='2026-10-02T08:00:00'), ids[:1])
+        self.assertEqual(self.ndjson_ids(start='2026-10-02T09:00:00+02:00', end='2026-10-03'), ids[1:2])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/api/export/', {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/', {'session': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/', {'start': 'soon'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/export/', {'device': 999}).status_code, 404)
+
+    def test_wsgi_streams_sync_iterator(self):
+        response = self.client.get('/api/export/', {'format': 'ndjson'})
+        self.assertFalse(response.is_async)
+        self.assertEqual(len(b''.join(response.streaming_content).splitlines()), 3)
+
+    def test_command_matches_endpoint(self):
+        out = StringIO()
+        call_command('export_tomatoes', '--format', 'ndjson', '--device', str(self.device.pk), stdout=out)
+        self.assertEqual(out.getvalue(), self.export(format='ndjson', device=self.device.pk))
+
+
+class ExportAsgiTests(ExportFixture, TransactionTestCase):
+    """The async iterator reads in a worker thread, so data must be committed."""
+
+    def test_asgi_streams_async_iterator(self):
+        async def fetch():
+            response = await AsyncClient().get('/api/export/')
+            return response.is_async, b''.join([chunk async for chunk in response.streaming_content])
+
+        is_async, body = asyncio.run(fetch())
+        self.assertTrue(is_async)
+        self.assertEqual(body.decode(), self.export())
+
+
+class DetectTests(TestCase):
+
+    def setUp(self):
+        invalidate_device_cache()
+        ESPDevice.get_default_device()
+
+    def detect(self, camera, **kwargs):
+        return self.client.post(f'/api/detect/?camera={camera}', **kwargs).json()
+
+    def test_raw_jpeg_body(self):
+        data = self.detect('raw', data=tomato_jpeg(), content_type='image/jpeg')
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual(data['detection']['type'], 'ripe')
+
+    def test_octet_stream_body(self):
+        data = self.detect('octet', data=tomato_jpeg(GREEN), content_type='application/octet-stream')
+        self.assertEqual(data['detection']['type'], 'green')
+
+    def test_multipart_upload(self):
+        upload = SimpleUploadedFile('frame.jpg', tomato_jpeg(), content_type='image/jpeg')
+        data = self.detect('multipart', data={'image': upload})
+        self.assertEqual(data['detection']['type'], 'ripe')
+
+    def test_legacy_base64_json(self):
+        image = 'data:image/jpeg;base64,' + base64.b64encode(tomato_jpeg()).decode()
+        data = self.detect('base64', data=json.dumps({'image': image}), content_type='application/json')
+        self.assertEqual(data['detection']['type'], 'ripe')
+
+    def test_empty_body(self):
+        data = self.detect('empty', data=b'', content_type='image/jpeg')
+        self.assertEqual(data, {'status': 'error', 'message': 'No image provided'})
+
+    def test_garbage_bytes(self):
+        data = self.detect('garbage', data=b'not a jpeg at all', content_type='image/jpeg')
+        self.assertEqual(data['status'], 'error')
+        self.assertIn('Could not decode image', data['message'])
+
+
+class DetectBatchTests(TestCase):
+
+    def setUp(self):
+        invalidate_device_cache()
+        # Online with an address, so a sort would reach the actuator if one were queued
+        ESPDevice.objects.update_or_create(id=1, defaults={'ip_address': '10.0.0.2', 'is_online': True})
+
+    def post_frames(self, frames):
+        uploads = [SimpleUploadedFile(f'{index}.jpg', frame, content_type='image/jpeg') for index, frame in enumerate(frames)]
+        return self.client.post('/api/detect/batch/', {'frames': uploads})
+
+    def test_majority_vote(self):
+        data = self.post_frames([tomato_jpeg(RIPE), tomato_jpeg(GREEN), tomato_jpeg(RIPE)]).json()
+        self.assertEqual(data['status'], 'success')
+        self.assertEqual([result['type'] for result in data['results']], ['ripe', 'green', 'ripe'])
+        self.assertEqual(data['decision']['type'], 'ripe')
+
+    def test_never_actuates(self):
+        with mock.patch('sorter.views.get_scheduler') as get_scheduler, \
+                mock.patch('sorter.views.device_client') as client:
+            data = self.post_frames([tomato_jpeg(RIPE)] * 5).json()
+
+        self.assertEqual(data['decision']['type'], 'ripe')
+        get_scheduler.assert_not_called()
+        self.assertFalse(client.method_calls)
+        self.assertFalse(Tomato.objects.exists())
+
+    def test_undecodable_frame(self):
+        data = self.post_frames([tomato_jpeg(RIPE), b'garbage', tomato_jpeg(RIPE)]).json()
+        self.assertEqual(data['status'], 'success')
+        self.assertIn('error', data['results'][1])
+        self.assertEqual(data['results'][0]['type'], 'ripe')
+        self.assertEqual(data['decision']['type'], 'ripe')
+
+    def test_busy_detector_answers_503(self):
+        with mock.patch('sorter.views.detection_executor.adetect_batch', side_effect=DetectorBusy()):
+            response = self.post_frames([tomato_jpeg()])
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class DetectorConfigVersionTests(TestCase):
+
+    def setUp(self):
+        invalidate_device_cache()
+        self.device = ESPDevice.get_default_device()
+
+    def post_config(self, **data):
+        return self.client.post('/api/webcam-config/', data).json()['config']['config_version']
+
+    def test_version_only_moves_when_detector_config_changes(self):
+        version = self.device.config_version
+        sensitivity = self.device.detection_sensitivity
+
+        self.assertEqual(self.post_config(webcam_enabled='true'), version)
+        self.assertEqual(self.post_config(detection_sensitivity=sensitivity), version)
+        self.assertEqual(self.post_config(detection_sensitivity=sensitivity - 10), version + 1)
+        self.assertEqual(ESPDevice.objects.get(pk=self.device.pk).config_version, version + 1)
+
+    def test_stale_cached_result_is_not_reused(self):
+        tracker = FrameTracker()
+        fingerprint = fingerprint_frame(tomato_jpeg())
+        tracker.observe('cam', fingerprint, {'type': 'ripe', 'confidence': 20.0, 'config_version': 1})
+
+        self.assertIsNotNone(tracker.cached_result('cam', fingerprint, 1))
+        self.assertIsNone(tracker.cached_result('cam', fingerprint, 2))
+
+
+class MultiDeviceTests(TransactionTestCase):
+
+    def setUp(self):
+        invalidate_device_cache()
+        self.device = ESPDevice.objects.create(name="Line 1", ip_address='10.0.0.2', is_online=True)
+        self.other_device = ESPDevice.objects.create(name="Line 2", ip_address='10.0.0.3', is_online=True)
+
+        # The ESP32 answers without JSON, so the counts come from the session
+        reply = mock.Mock(status_code=200)
+        reply.json.side_effect = ValueError
+        patcher = mock.patch('sorter.views.device_client.asort', new=mock.AsyncMock(return_value=reply))
+        self.asort = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('sorter.views.status_poller.refresh')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Flushed by the test, not by a timer thread racing it for the database
+        self.buffer = TomatoEventBuffer(max_events=50, max_delay=60)
+        patcher = mock.patch('sorter.views.event_buffer', new=self.buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sort(self, device, tomato_type):
+        return self.client.post('/api/sort/', {'type': tomato_type, 'device': device.pk}).json()
+
+    def test_devices_have_separate_schedulers(self):
+        self.assertIs(get_scheduler(self.device.pk), get_scheduler(self.device.pk))
+        self.assertIsNot(get_scheduler(self.device.pk), get_scheduler(self.other_device.pk))
+
+    def test_devices_have_separate_sessions_and_counts(self):
+        self.sort(self.device, 'ripe')
+        self.sort(self.other_device, 'green')
+        first = self.sort(self.device, 'ripe')
+        second = self.sort(self.other_device, 'ripe')
+
+        self.assertEqual((first['ripe_count'], first['green_count']), (2, 0))
+        self.assertEqual((second['ripe_count'], second['green_count']), (1, 1))
+        self.assertEqual(
+            [call.args[0] for call in self.asort.call_args_list],
+            ['10.0.0.2', '10.0.0.3', '10.0.0.2', '10.0.0.3']
+        )
+
+        self.buffer.flush()
+        session = SortingSession.objects.get(device=self.device, is_active=True)
+        other_session = SortingSession.objects.get(device=self.other_device, is_active=True)
+        self.assertNotEqual(session.pk, other_session.pk)
+        self.assertEqual((session.ripe_count, session.green_count), (2, 0))
+        self.assertEqual((other_session.ripe_count, other_session.green_count), (1, 1))
+
+    def test_unknown_device_is_404(self):
+        self.assertEqual(self.client.get('/api/status/?device=999').status_code, 404)
+        self.assertEqual(self.client.get('/api/stats/?device=999').status_code, 404)
+        self.assertEqual(self.client.post('/api/sort/', {'type': 'ripe', 'device': 999}).status_code, 404)
+        self.assertEqual(self.client.post('/api/control/', {'action': 'stop', 'device': 999}).status_code, 404)
+        self.assertEqual(self.client.post('/api/webcam-config/', {'device': 999}).status_code, 404)
+        self.asort.assert_not_called()
+
+
+class DeviceStatusPollerTests(TransactionTestCase):
+
+    def setUp(self):
+        self.device = ESPDevice.objects.create(ip_address='10.0.0.9', is_online=False)
+        patcher = mock.patch('sorter.status_poller.device_client.status')
+        self.status = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Polls once on start and then only when refreshed
+        self.on_change = mock.Mock(side_effect=persist_online_state)
+        self.poller = DeviceStatusPoller(interval=60, on_change=self.on_change)
+        self.addCleanup(self.poller.forget, '10.0.0.9')
+
+    def wait_for_changes(self, count):
+        deadline = time.monotonic() + 5
+        while self.on_change.call_count < count and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.on_change.call_count, count)
+
+    def test_marks_device_online_then_offline(self):
+        self.status.return_value = mock.Mock(status_code=200, json=mock.Mock(return_value={'ripe_count': 4}))
+        self.assertIsNone(self.poller.snapshot('10.0.0.9')['online'])
+        self.wait_for_changes(1)
+        self.device.refresh_from_db()
+        self.assertTrue(self.device.is_online)
+        snapshot = self.poller.snapshot('10.0.0.9')
+        self.assertEqual((snapshot['online'], snapshot['data']), (True, {'ripe_count': 4}))
+
+        self.status.side_effect = ConnectionError('unreachable')
+        self.poller.refresh('10.0.0.9')
+        self.wait_for_changes(2)
+        self.device.refresh_from_db()
+        self.assertFalse(self.device.is_online)
+        snapshot = self.poller.snapshot('10.0.0.9')
+        self.assertEqual((snapshot['online'], snapshot['failures'], snapshot['error']), (False, 1, 'unreachable'))
+        # The last good payload stays readable while the device is offline
+        self.assertEqual(snapshot['data'], {'ripe_count': 4})
+
+
+class DeviceCacheTests(TestCase):
+
+    def setUp(self):
+        invalidate_device_cache()
+        self.device = ESPDevice.objects.create(name="Line 2")
+        ESPDevice.get_device(self.device.pk)
+
+    def test_served_from_cache_until_saved(self):
+        ESPDevice.objects.filter(pk=self.device.pk).update(name="Changed elsewhere")
+        with self.assertNumQueries(0):
+            self.assertEqual(ESPDevice.get_device(self.device.pk).name, "Line 2")
+
+        self.device.name = "Line 3"
+        self.device.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(ESPDevice.get_device(self.device.pk).name, "Line 3")
+
+        self.device.detection_sensitivity = 40
+        self.device.save(update_fields=['detection_sensitivity'])
+        self.assertEqual(ESPDevice.get_device(self.device.pk).detection_sensitivity, 40)
+
+    def test_mark_online_invalidates(self):
+        self.device.ip_address = '10.0.0.4'
+        self.device.save()
+        ESPDevice.mark_online('10.0.0.4', True)
+        self.assertTrue(ESPDevice.get_device(self.device.pk).is_online)
+
+    def test_entry_expires_after_ttl(self):
+        ESPDevice.objects.filter(pk=self.device.pk).update(name="Changed elsewhere")
+        # Cached in setUp with the default TTL of 5 seconds
+        later = time.monotonic() + 10
+        with mock.patch('sorter.models.time.monotonic', return_value=later):
+            self.assertEqual(ESPDevice.get_device(self.device.pk).name, "Changed elsewhere")
+
+
+def reference_detect(detector, image):
+    """
+    Red and green scores of the full resolution pipeline detect() replaced:
+    blur in HSV, one inRange per class, every contour measured separately.
+    """
+    blurred = cv2.GaussianBlur(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), detector.blur_size, 0)
+    scores = []
+    for low, high in [(detector.ripe_hue_min, detector.ripe_hue_max), (detector.green_hue_min, detector.green_hue_max)]:
+        mask = cv2.inRange(blurred, np.array([low, 100, 100]), np.array([high, 255, 255]))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [c for c in contours if cv2.contourArea(c) > detector.min_contour_area]
+        if not contours:
+            scores.append(0.0)
+            continue
+        largest = max(contours, key=cv2.contourArea)
+        shape = detector._analyze_tomato_shape({'largest': largest, 'largest_area': cv2.contourArea(largest)})
+        area = sum(cv2.contourArea(c) for c in contours)
+        scores.append(area / (image.shape[0] * image.shape[1]) * 100 * shape)
+    return scores
+
+
+def reference_type(detector, scores):
+    red_score, green_score = scores
+    threshold = detector.sensitivity / 10
+    if red_score > green_score and red_score > threshold:
+        return 'ripe'
+    if green_score > red_score and green_score > threshold:
+        return 'green'
+    return None
+
+
+class DetectorParityTests(SimpleTestCase):
+
+    def corpus(self, count, noise=0):
+        """Fixed-seed cluttered belt frames with a ripe, green or no tomato."""
+        for seed in range(count):
+            rng = np.random.default_rng(20000 + seed)
+            kind = rng.choice(['ripe', 'green', 'empty'])
+            yield seed, synthetic_frame(
+                640, 480, seed=seed,
+                tomato_color=TOMATO_COLORS.get(kind),
+                size=float(rng.uniform(0.03, 0.3)),
+                clutter=int(rng.integers(6, 40)),
+                noise=noise
+            )
+
+    def test_full_resolution_matches_reference(self):
+        detector = TomatoDetector()
+        detector.pyramid_levels = 0
+        for seed, image in self.corpus(60):
+            scores = reference_detect(detector, image)
+            result = detector.detect(image)
+            self.assertEqual(result['type'], reference_type(detector, scores), seed)
+            if result['type'] is not None:
+                self.assertAlmostEqual(result['confidence'], max(scores), places=6, msg=seed)
+
+    def test_pyramid_only_differs_at_the_threshold(self):
+        detector = TomatoDetector()
+        threshold = detector.sensitivity / 10
+        for seed, image in self.corpus(200):
+            scores = reference_detect(detector, image)
+            result = detector.detect(image)
+            if result['type'] != reference_type(detector, scores):
+                self.assertLess(abs(max(max(scores), result['confidence']) - threshold), 0.5, seed)
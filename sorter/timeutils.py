@@ -0,0 +1,31 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+def parse_time(value):
+    """
+    Parse an ISO date or datetime, as given to /api/stats/ and /api/export/.
+
+    A date means its midnight and naive values are taken in the current
+    time zone.
+
+    Args:
+        value (str): e.g. '2026-10-18' or '2026-10-18T14:30:00+02:00'
+
+    Returns:
+        datetime: An aware datetime
+
+    Raises:
+        ValueError: If the value is neither a date nor a datetime
+    """
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(f"Invalid date or time: {value}")
+        parsed = datetime.datetime.combine(date, datetime.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
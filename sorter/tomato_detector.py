@@ -2,11 +2,50 @@ import cv2
 import numpy as np
 import base64
 import logging
-from io import BytesIO
-from PIL import Image
+import time
 
 logger = logging.getLogger(__name__)
 
+# Bits of the label image built from the hue lookup table
+RIPE_LABEL = 1
+GREEN_LABEL = 2
+
+# Region of interest (x, y, width, height) in percent of the frame
+FULL_FRAME_ROI = (0, 0, 100, 100)
+
+# Minimum saturation and value for a pixel to count as tomato colored
+MIN_SATURATION = 100
+MIN_VALUE = 100
+
+
+def decode_image(image_data):
+    """
+    Decode an encoded image buffer straight into a BGR OpenCV image.
+
+    Args:
+        image_data (bytes | memoryview): Encoded image data
+
+    Returns:
+        numpy.ndarray | None: BGR image, or None if the data is not an image
+    """
+    buffer = np.frombuffer(image_data, dtype=np.uint8)
+    if buffer.size == 0:
+        return None
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+
+
+def _lap(timings, stage, start):
+    """Add the milliseconds since start to timings[stage] and return the current time."""
+    now = time.perf_counter()
+    timings[stage] = timings.get(stage, 0.0) + (now - start) * 1000
+    return now
+
+
+def decode_base64(base64_image):
+    """Return the bytes of a base64 string or ``data:`` URL."""
+    return base64.b64decode(base64_image.split(',')[1] if ',' in base64_image else base64_image)
+
+
 class TomatoDetector:
     """
     A class for detecting and classifying tomatoes in images.
@@ -28,15 +67,20 @@ class TomatoDetector:
         self.green_hue_min = self.config.get('green_threshold_min', 31)
         self.green_hue_max = self.config.get('green_threshold_max', 70)
         self.sensitivity = self.config.get('detection_sensitivity', 70)
+        self.roi = tuple(self.config.get('roi', FULL_FRAME_ROI))
+        self.detection_width = self.config.get('detection_width', 0)
 
         # Initialize OpenCV parameters
-        self.min_contour_area = 1000  # Minimum contour area to consider
+        self.min_contour_area = 1000  # Minimum contour area to consider (full resolution pixels)
         self.blur_size = (5, 5)  # Gaussian blur kernel size
+        self.pyramid_levels = 1  # pyrDown steps (5x5 Gaussian + 2x decimation) before HSV
 
         # Tomato shape parameters
         self.min_circularity = 0.6  # Minimum circularity for tomato (1.0 is perfect circle)
         self.min_convexity = 0.8    # Minimum convexity for tomato shape
 
+        self.hue_lut = self._build_hue_lut()
+
     def update_config(self, config):
         """Update detector configuration."""
         self.config.update(config)
@@ -45,85 +89,136 @@ class TomatoDetector:
         self.green_hue_min = self.config.get('green_threshold_min', 31)
         self.green_hue_max = self.config.get('green_threshold_max', 70)
         self.sensitivity = self.config.get('detection_sensitivity', 70)
+        self.roi = tuple(self.config.get('roi', FULL_FRAME_ROI))
+        self.detection_width = self.config.get('detection_width', 0)
+        self.hue_lut = self._build_hue_lut()
+
+    def _build_hue_lut(self):
+        """
+        Build the hue -> label lookup table.
+
+        Each entry holds RIPE_LABEL and/or GREEN_LABEL bits, so overlapping
+        ripe and green ranges still produce both masks.
+        """
+        hues = np.arange(256)
+        lut = np.zeros(256, dtype=np.uint8)
+        lut[(hues >= self.ripe_hue_min) & (hues <= self.ripe_hue_max)] |= RIPE_LABEL
+        lut[(hues >= self.green_hue_min) & (hues <= self.green_hue_max)] |= GREEN_LABEL
+        return lut
 
-    def detect_from_base64(self, base64_image):
+    def detect_from_base64(self, base64_image, timings=None):
         """
         Detect tomatoes from a base64 encoded image.
 
         Args:
             base64_image (str): Base64 encoded image string
+            timings (dict): Optional, receives per-stage times in ms (see detect)
 
         Returns:
             dict: Detection results
         """
         try:
             # Decode base64 image
-            image_data = base64.b64decode(base64_image.split(',')[1] if ',' in base64_image else base64_image)
-            image = Image.open(BytesIO(image_data))
+            start = time.perf_counter() if timings is not None else None
+            image_data = decode_base64(base64_image)
+            if timings is not None:
+                _lap(timings, 'base64', start)
+            return self.detect_from_bytes(image_data, timings)
 
-            # Convert PIL image to OpenCV format
-            cv_image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        except Exception as e:
+            logger.error(f"Error processing base64 image: {str(e)}")
+            return {"error": str(e)}
+
+    def detect_from_bytes(self, image_data, timings=None):
+        """
+        Detect tomatoes from encoded image bytes (JPEG, PNG, ...).
+
+        The buffer is wrapped with ``np.frombuffer`` so a ``bytes`` object or
+        a ``memoryview`` of the request body is decoded by ``cv2.imdecode``
+        without any intermediate copies.
+
+        Args:
+            image_data (bytes | memoryview): Encoded image data
+            timings (dict): Optional, receives per-stage times in ms (see detect)
+
+        Returns:
+            dict: Detection results
+        """
+        try:
+            start = time.perf_counter() if timings is not None else None
+            cv_image = decode_image(image_data)
+            if timings is not None:
+                _lap(timings, 'decode', start)
+            if cv_image is None:
+                return {"error": "Could not decode image"}
 
             # Process the image
-            return self.detect(cv_image)
+            return self.detect(cv_image, timings)
 
         except Exception as e:
-            logger.error(f"Error processing base64 image: {str(e)}")
+            logger.error(f"Error processing image bytes: {str(e)}")
             return {"error": str(e)}
 
-    def detect(self, image):
+    def detect(self, image, timings=None):
         """
         Detect and classify tomatoes in an image.
 
         Args:
             image (numpy.ndarray): OpenCV image in BGR format
+            timings (dict): Optional, receives the milliseconds spent in each
+                stage: resize (ROI crop, resize and pyramid), hsv, blur, mask,
+                contours and shape. Leave as None outside benchmarks.
 
         Returns:
             dict: Detection results with type and confidence
         """
-        # Convert to HSV color space
-        hsv_image = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-
-        # Apply Gaussian blur to reduce noise
-        blurred = cv2.GaussianBlur(hsv_image, self.blur_size, 0)
-
-        # Create masks for red and green tomatoes
-        # Red tomatoes (hue around 0-30)
-        lower_red = np.array([self.ripe_hue_min, 100, 100])
-        upper_red = np.array([self.ripe_hue_max, 255, 255])
-        red_mask = cv2.inRange(blurred, lower_red, upper_red)
-
-        # Green tomatoes (hue around 31-70)
-        lower_green = np.array([self.green_hue_min, 100, 100])
-        upper_green = np.array([self.green_hue_max, 255, 255])
-        green_mask = cv2.inRange(blurred, lower_green, upper_green)
+        mark = time.perf_counter() if timings is not None else None
 
-        # Find contours in the masks
-        red_contours, _ = cv2.findContours(red_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        green_contours, _ = cv2.findContours(green_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Crop to the region of interest and blur once, on the smaller working image
+        roi_image = self._crop_roi(image)
+        working, scale = self._downscale(roi_image)
+        if timings is not None:
+            mark = _lap(timings, 'resize', mark)
 
-        # Filter contours by size
-        red_contours = [c for c in red_contours if cv2.contourArea(c) > self.min_contour_area]
-        green_contours = [c for c in green_contours if cv2.contourArea(c) > self.min_contour_area]
-
-        # Calculate total area of contours
-        red_area = sum(cv2.contourArea(c) for c in red_contours)
-        green_area = sum(cv2.contourArea(c) for c in green_contours)
+        # Convert to HSV color space
+        hsv_image = cv2.cvtColor(working, cv2.COLOR_BGR2HSV)
+        if timings is not None:
+            mark = _lap(timings, 'hsv', mark)
+
+        if self.pyramid_levels <= 0:
+            # No pyramid step, apply Gaussian blur to reduce noise
+            hsv_image = cv2.GaussianBlur(hsv_image, self.blur_size, 0)
+        if timings is not None:
+            mark = _lap(timings, 'blur', mark)
+
+        # Label every pixel as ripe and/or green in one pass
+        labels = self._label_pixels(hsv_image)
+        if timings is not None:
+            mark = _lap(timings, 'mask', mark)
+
+        # Find contours for each label, measuring each contour once
+        min_area = self.min_contour_area * scale * scale
+        red_stats = self._contour_stats(cv2.bitwise_and(labels, RIPE_LABEL), min_area)
+        green_stats = self._contour_stats(cv2.bitwise_and(labels, GREEN_LABEL), min_area)
+        if timings is not None:
+            mark = _lap(timings, 'contours', mark)
 
         # Calculate image area
-        image_area = image.shape[0] * image.shape[1]
+        image_area = working.shape[0] * working.shape[1]
 
         # Calculate percentages
-        red_percent = (red_area / image_area) * 100 if image_area > 0 else 0
-        green_percent = (green_area / image_area) * 100 if image_area > 0 else 0
+        red_percent = (red_stats['area'] / image_area) * 100 if image_area > 0 else 0
+        green_percent = (green_stats['area'] / image_area) * 100 if image_area > 0 else 0
 
         # Analyze shape to confirm it's a tomato
-        red_shape_score = self._analyze_tomato_shape(red_contours)
-        green_shape_score = self._analyze_tomato_shape(green_contours)
+        red_shape_score = self._analyze_tomato_shape(red_stats)
+        green_shape_score = self._analyze_tomato_shape(green_stats)
 
         # Combine color and shape scores
         red_score = red_percent * red_shape_score
         green_score = green_percent * green_shape_score
+        if timings is not None:
+            _lap(timings, 'shape', mark)
 
         # Determine tomato type based on combined scores and sensitivity threshold
         min_confidence = self.sensitivity / 10  # Convert sensitivity (0-100) to minimum confidence threshold
@@ -132,14 +227,14 @@ class TomatoDetector:
             return {
                 "type": "ripe",
                 "confidence": red_score,
-                "contours": len(red_contours),
+                "contours": red_stats['count'],
                 "is_tomato": red_shape_score > 0.5  # Threshold for tomato shape
             }
         elif green_score > red_score and green_score > min_confidence:
             return {
                 "type": "green",
                 "confidence": green_score,
-                "contours": len(green_contours),
+                "contours": green_stats['count'],
                 "is_tomato": green_shape_score > 0.5  # Threshold for tomato shape
             }
         else:
@@ -150,24 +245,138 @@ class TomatoDetector:
                 "is_tomato": False
             }
 
-    def _analyze_tomato_shape(self, contours):
+    def roi_rect(self, shape):
+        """
+        Return the region of interest in pixels for a frame shape.
+
+        Returns:
+            tuple: (x0, y0, x1, y1)
+        """
+        height, width = shape[:2]
+        x, y, roi_width, roi_height = self.roi
+        x0 = min(width - 1, width * x // 100)
+        y0 = min(height - 1, height * y // 100)
+        x1 = max(x0 + 1, min(width, width * (x + roi_width) // 100))
+        y1 = max(y0 + 1, min(height, height * (y + roi_height) // 100))
+        return x0, y0, x1, y1
+
+    def _crop_roi(self, image):
+        """Return a view of the region of interest (no copy)."""
+        if self.roi == FULL_FRAME_ROI:
+            return image
+        x0, y0, x1, y1 = self.roi_rect(image.shape)
+        return image[y0:y1, x0:x1]
+
+    def _downscale(self, image):
+        """
+        Shrink the frame to the working resolution.
+
+        When detection_width is set, the frame is first resized so that the
+        pyramid steps end at that width. Each pyramid level is a 5x5
+        Gaussian blur fused with a 2x decimation, so the blur and every later
+        stage run on a quarter of the pixels per level. With
+        pyramid_levels = 0 there is no pyramid step and detect() blurs the
+        working image with blur_size instead.
+
+        The pyramid blurs BGR before the HSV conversion rather than HSV
+        after it, so classifications are not identical to the full
+        resolution pipeline: confidences move by a few tenths, which flips
+        frames scoring right at the sensitivity threshold, and contours of
+        noisy frames come out smoother and pass the shape check more often.
+        pyramid_levels = 0 without detection_width reproduces the full
+        resolution results exactly.
+
+        Returns:
+            tuple: (working image, linear scale relative to the input)
+        """
+        levels = max(0, self.pyramid_levels)
+        working = image
+
+        if self.detection_width:
+            resize_width = self.detection_width << levels
+            if resize_width < image.shape[1]:
+                resize_height = max(1, round(image.shape[0] * resize_width / image.shape[1]))
+                # The pyramid step after it low-passes the image, so the
+                # cheaper bilinear resize is enough there
+                interpolation = cv2.INTER_LINEAR if levels else cv2.INTER_AREA
+                working = cv2.resize(image, (resize_width, resize_height), interpolation=interpolation)
+
+        for _ in range(levels):
+            working = cv2.pyrDown(working)
+        return working, working.shape[1] / image.shape[1]
+
+    def _label_pixels(self, hsv_image):
+        """
+        Build the label image for a blurred HSV image.
+
+        The hue channel goes through the lookup table and pixels below the
+        saturation/value floor are cleared, replacing one inRange call per
+        class.
+
+        Returns:
+            numpy.ndarray: Single channel image of RIPE_LABEL/GREEN_LABEL bits
+        """
+        hue, saturation, value = cv2.split(hsv_image)
+        labels = cv2.LUT(hue, self.hue_lut)
+
+        # Both saturation and value must reach their floors
+        _, saturated = cv2.threshold(saturation, MIN_SATURATION - 1, 255, cv2.THRESH_BINARY)
+        _, bright = cv2.threshold(value, MIN_VALUE - 1, 255, cv2.THRESH_BINARY)
+        return cv2.bitwise_and(labels, cv2.bitwise_and(saturated, bright))
+
+    def _contour_stats(self, mask, min_area):
+        """
+        Find the external contours in a mask and measure them once.
+
+        Args:
+            mask (numpy.ndarray): Single channel mask, nonzero is foreground
+            min_area (float): Minimum contour area in working image pixels
+
+        Returns:
+            dict: ``count`` and total ``area`` of the contours larger than
+            min_area, plus the ``largest`` contour and its ``largest_area``
+            for shape analysis
+        """
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        count = 0
+        total_area = 0.0
+        largest = None
+        largest_area = 0.0
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area <= min_area:
+                continue
+            count += 1
+            total_area += area
+            if largest is None or area > largest_area:
+                largest = contour
+                largest_area = area
+
+        return {
+            'count': count,
+            'area': total_area,
+            'largest': largest,
+            'largest_area': largest_area
+        }
+
+    def _analyze_tomato_shape(self, stats):
         """
-        Analyze contours to determine if they resemble tomatoes.
+        Analyze the largest contour to determine if it resembles a tomato.
 
         Args:
-            contours (list): List of contours to analyze
+            stats (dict): Contour measurements from _contour_stats
 
         Returns:
             float: Shape score between 0 and 1, where 1 is most likely a tomato
         """
-        if not contours:
+        # The largest contour is the most likely to be the tomato
+        largest_contour = stats['largest']
+        if largest_contour is None:
             return 0.0
 
-        # Find the largest contour (most likely to be the tomato)
-        largest_contour = max(contours, key=cv2.contourArea)
-
         # Calculate circularity (how close to a circle)
-        area = cv2.contourArea(largest_contour)
+        area = stats['largest_area']
         perimeter = cv2.arcLength(largest_contour, True)
         circularity = 0.0
         if perimeter > 0:
@@ -213,25 +422,25 @@ class TomatoDetector:
         else:
             return output  # No detection to draw
 
-        # Draw a rectangle in the center of the image
-        h, w = output.shape[:2]
-        center_x, center_y = w // 2, h // 2
-        rect_size = min(w, h) // 3
+        # Draw a rectangle around the region of interest, or in the center
+        # of the image when the whole frame is analyzed
+        if self.roi != FULL_FRAME_ROI:
+            left, top, right, bottom = self.roi_rect(output.shape)
+        else:
+            h, w = output.shape[:2]
+            center_x, center_y = w // 2, h // 2
+            rect_size = min(w, h) // 3
+            left, top = center_x - rect_size, center_y - rect_size
+            right, bottom = center_x + rect_size, center_y + rect_size
 
-        cv2.rectangle(
-            output,
-            (center_x - rect_size, center_y - rect_size),
-            (center_x + rect_size, center_y + rect_size),
-            color,
-            2
-        )
+        cv2.rectangle(output, (left, top), (right, bottom), color, 2)
 
         # Add text with confidence
         confidence = f"{label}: {detection_result['confidence']:.1f}%"
         cv2.putText(
             output,
             confidence,
-            (center_x - rect_size, center_y - rect_size - 10),
+            (left, top - 10),
             cv2.FONT_HERSHEY_SIMPLEX,
             0.6,
             color,
@@ -244,7 +453,7 @@ class TomatoDetector:
             cv2.putText(
                 output,
                 verification_text,
-                (center_x - rect_size, center_y - rect_size - 40),
+                (left, top - 40),
                 cv2.FONT_HERSHEY_SIMPLEX,
                 0.6,
                 (0, 0, 255) if not detection_result.get("is_tomato", False) else (0, 255, 0),
@@ -252,3 +461,41 @@ class TomatoDetector:
             )
 
         return output
+
+
+def majority_vote(results):
+    """
+    Combine per-frame detection results into a single decision.
+
+    Frames that failed to decode or process do not vote. A type wins only
+    when it has more than half of the remaining votes, with frames where
+    nothing was found voting for "none".
+
+    Args:
+        results (list): Detection result dicts, one per frame
+
+    Returns:
+        dict: ``type`` ('ripe', 'green' or None), ``votes`` per type,
+        ``frames`` that voted and the mean ``confidence`` of the winners
+    """
+    votes = {'ripe': 0, 'green': 0, 'none': 0}
+    confidences = {'ripe': [], 'green': []}
+    for result in results:
+        if 'error' in result:
+            continue
+        detected_type = result.get('type') or 'none'
+        votes[detected_type] += 1
+        if detected_type in confidences:
+            confidences[detected_type].append(result.get('confidence', 0))
+
+    frames = sum(votes.values())
+    winner = max(votes, key=votes.get)
+    if frames == 0 or winner == 'none' or votes[winner] * 2 <= frames:
+        return {'type': None, 'votes': votes, 'frames': frames, 'confidence': 0}
+
+    return {
+        'type': winner,
+        'votes': votes,
+        'frames': frames,
+        'confidence': sum(confidences[winner]) / len(confidences[winner])
+    }
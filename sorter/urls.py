@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import home, update_device_ip, control_device, sort_tomato, get_status, update_webcam_config, detect_tomato
+from .views import home, update_device_ip, control_device, sort_tomato, get_status, list_devices, tomato_stats, export_tomatoes, event_stream, update_webcam_config, detect_tomato, detect_batch, export_metrics
 
 urlpatterns = [
     path('', home, name='home'),
@@ -7,6 +7,12 @@ urlpatterns = [
     path('api/control/', control_device, name='control_device'),
     path('api/sort/', sort_tomato, name='sort_tomato'),
     path('api/status/', get_status, name='get_status'),
+    path('api/devices/', list_devices, name='list_devices'),
+    path('api/stats/', tomato_stats, name='tomato_stats'),
+    path('api/export/', export_tomatoes, name='export_tomatoes'),
+    path('api/events/', event_stream, name='event_stream'),
     path('api/webcam-config/', update_webcam_config, name='update_webcam_config'),
     path('api/detect/', detect_tomato, name='detect_tomato'),
+    path('api/detect/batch/', detect_batch, name='detect_batch'),
+    path('metrics', export_metrics, name='metrics'),
 ]
@@ -1,22 +1,200 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.csrf import csrf_exempt
 from django.utils import timezone
-import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMinute
+from asgiref.sync import sync_to_async
+import asyncio
+import datetime
+import hashlib
+import io
 import json
 import logging
-from .models import ESPDevice, SortingSession, Tomato
-from .tomato_detector import TomatoDetector
+import time
+import numpy as np
+from .models import ESPDevice, SortingSession, TomatoRollup
+from .tomato_detector import decode_base64, majority_vote
+from .detection_pool import DetectorBusy, create_executor
+from .actuation import all_schedulers, get_scheduler
+from .device_client import device_client
+from .status_poller import DeviceStatusPoller
+from .event_buffer import event_buffer
+from .frame_tracker import FrameTracker, PresenceGate, fingerprint_frame, gated_result
+from .events import publisher, format_sse
+from .export import EXPORT_FORMATS, aiter_export, export_queryset, iter_export
+from .timeutils import parse_time
+from .metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, frame_seconds, metrics, sorts_total
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
-# Initialize the tomato detector
-tomato_detector = None
+# Pool of detector processes shared by the detection endpoints
+detection_executor = create_executor()
+
+def sync_detector_config(device):
+    """Hand the executor a new config snapshot when the device's version moved."""
+    # Only a new config version builds a new snapshot; otherwise this is an int compare
+    if detection_executor.config_version(device.pk) != device.config_version:
+        detection_executor.configure(device.detector_config(), device.config_version, device.pk)
+
+def request_device_id(request):
+    """The device id a request targets (?device=<id> or a device form field), None for the default."""
+    return request.GET.get('device') or request.POST.get('device') or None
+
+def get_request_device(request):
+    """Return the device a request targets, or None if the id is unknown."""
+    try:
+        return ESPDevice.get_device(request_device_id(request))
+    except (ESPDevice.DoesNotExist, ValueError):
+        return None
+
+async def aget_request_device(request):
+    try:
+        return await ESPDevice.aget_device(request_device_id(request))
+    except (ESPDevice.DoesNotExist, ValueError):
+        return None
+
+def unknown_device_response():
+    return JsonResponse({'status': 'error', 'message': 'Unknown device'}, status=404)
+
+def event_for_device(data, device):
+    """Whether a published event concerns the device (events carry device_id or ip)."""
+    if 'device_id' in data:
+        return data['device_id'] == device.pk
+    if 'ip' in data:
+        return data['ip'] == device.ip_address
+    return True
+
+def detector_busy_response():
+    """503 telling the client to back off because the detection queue is full."""
+    response = JsonResponse({'status': 'busy', 'message': 'Detector busy, retry later'}, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+def persist_online_state(ip_address, is_online):
+    """Record a device going online/offline, called from the status poller."""
+    publisher.publish('device', {'ip': ip_address, 'online': is_online}, only_changes=True, key=ip_address)
+    try:
+        ESPDevice.mark_online(ip_address, is_online)
+    finally:
+        close_old_connections()
+
+def publish_esp_status(ip_address, data):
+    """Push a changed ESP32 /status payload, called from the status poller."""
+    publisher.publish('esp_status', {'ip': ip_address, 'data': data})
+
+# Background ESP32 status poller shared by the dashboard views
+status_poller = DeviceStatusPoller(
+    interval=getattr(settings, 'TOMATO_STATUS_POLL_INTERVAL', 2.0),
+    max_backoff=getattr(settings, 'TOMATO_STATUS_MAX_BACKOFF', 30.0),
+    idle_timeout=getattr(settings, 'TOMATO_STATUS_IDLE_TIMEOUT', 60.0),
+    on_change=persist_online_state,
+    on_data=publish_esp_status
+)
+
+# Skips unchanged frames and confirms detections over several frames
+frame_tracker = FrameTracker(
+    history=getattr(settings, 'TOMATO_FRAME_HISTORY', 8),
+    confirm_frames=getattr(settings, 'TOMATO_CONFIRM_FRAMES', 3),
+    diff_threshold=getattr(settings, 'TOMATO_FRAME_DIFF_THRESHOLD', 8),
+    max_age=getattr(settings, 'TOMATO_FRAME_MAX_AGE', 5.0)
+)
+
+# Short-circuits frames showing only the empty conveyor
+presence_gate = PresenceGate(
+    threshold=getattr(settings, 'TOMATO_GATE_THRESHOLD', 10),
+    min_changed=getattr(settings, 'TOMATO_GATE_MIN_CHANGED', 0.005),
+    learning_rate=getattr(settings, 'TOMATO_GATE_LEARNING_RATE', 0.05)
+)
+
+# Scrape-time gauges for /metrics, read only when someone scrapes
+metrics.stats('tomato_detection_pool', detection_executor.stats, 'Detection pool queue and throughput')
+metrics.stats('tomato_presence_gate', presence_gate.stats, 'Empty-belt gate checks and hit rate')
+metrics.stats('tomato_actuation', lambda: {
+    'devices': len(all_schedulers()),
+    'queued': sum(len(scheduler.status()['queued']) for scheduler in all_schedulers().values())
+}, 'Actuation scheduler queues')
+metrics.stats(
+    'tomato_event_buffer',
+    lambda: {'pending': event_buffer.pending(), 'rejected': len(event_buffer.rejected), 'dropped': event_buffer.dropped},
+    'Sort events waiting to be written, refused by the database or dropped'
+)
+metrics.stats('tomato_events', lambda: {'subscribers': publisher.subscriber_count()}, 'Dashboard event subscribers')
+
+# Content types accepted as a raw encoded image body on the detect endpoint
+BINARY_IMAGE_TYPES = ('image/jpeg', 'image/png', 'application/octet-stream')
+
+def read_image_payload(request):
+    """
+    Extract the image from a detect request.
+
+    Accepts a raw image body (``image/jpeg``), a multipart upload with an
+    ``image`` file, or the legacy JSON body ``{"image": "<base64 data URL>"}``.
+
+    Returns:
+        tuple: (image_data, base64_image) where image_data is a memoryview
+        or bytes for binary uploads and base64_image the legacy string.
+        Either or both may be None.
+    """
+    if request.content_type in BINARY_IMAGE_TYPES:
+        return memoryview(request.body), None
 
-def home(request):
-    device = ESPDevice.get_default_device()
-    active_session = SortingSession.objects.filter(is_active=True).first()
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('image')
+        return (upload.read() if upload else None), None
+
+    if not request.body:
+        return None, None
+
+    data = json.loads(request.body)
+    return None, data.get('image')
+
+NUMPY_TYPES = ('application/x-npz', 'application/x-npy')
+
+def read_batch_payload(request):
+    """
+    Extract the frames from a batch detect request.
+
+    Accepts a multipart upload with any number of ``frames`` files (JPEG,
+    PNG, ...) or a ``.npz``/``.npy`` body of uint8 BGR arrays, either one
+    HxWx3 array per frame or NxHxWx3 stacks. Array bodies count against
+    DATA_UPLOAD_MAX_MEMORY_SIZE, so larger batches should use
+    ``np.savez_compressed`` or multipart.
+
+    Returns:
+        list: Encoded images (bytes) or decoded arrays, in request order
+
+    Raises:
+        ValueError: If an array is not a uint8 BGR image or stack of them
+    """
+    if request.content_type == 'multipart/form-data':
+        return [upload.read() for upload in request.FILES.getlist('frames')]
+
+    if request.content_type not in NUMPY_TYPES or not request.body:
+        return []
+
+    loaded = np.load(io.BytesIO(request.body), allow_pickle=False)
+    if isinstance(loaded, np.ndarray):
+        arrays = [loaded]
+    else:
+        with loaded:
+            arrays = [loaded[name] for name in loaded.files]
+
+    frames = []
+    for array in arrays:
+        if array.dtype != np.uint8 or array.ndim not in (3, 4) or array.shape[-1] != 3:
+            raise ValueError(f"Expected uint8 HxWx3 frames, got {array.dtype} {array.shape}")
+        frames.extend(array if array.ndim == 4 else [array])
+    return frames
+
+async def home(request):
+    device = await aget_request_device(request)
+    if device is None:
+        device = await ESPDevice.aget_default_device()
 
     # Get device status if IP is available
     device_status = {
@@ -28,27 +206,26 @@ def home(request):
     }
 
     if device.ip_address:
-        try:
-            response = requests.get(f"http://{device.ip_address}/status", timeout=2)
-            if response.status_code == 200:
-                data = response.json()
-                device_status['online'] = True
-                device_status['running'] = data.get('running', False)
-                device_status['ripe_count'] = data.get('ripe_count', 0)
-                device_status['green_count'] = data.get('green_count', 0)
-
-                # Update device status
-                device.is_online = True
-                device.save()
-        except:
-            device.is_online = False
-            device.save()
+        # Served from the poller's snapshot, never blocks on the device
+        snapshot = status_poller.snapshot(device.ip_address)
+        if snapshot['online']:
+            data = snapshot['data']
+            device_status['online'] = True
+            device_status['running'] = data.get('running', False)
+            device_status['ripe_count'] = data.get('ripe_count', 0)
+            device_status['green_count'] = data.get('green_count', 0)
+        elif snapshot['online'] is None:
+            # First poll still in flight, show the last known state
+            device_status['online'] = device.is_online
+
+    active_session = await SortingSession.aget_active(device)
 
     # Get session statistics
-    sessions = SortingSession.objects.order_by('-start_time')[:5]
+    sessions = [session async for session in SortingSession.objects.filter(device=device).order_by('-start_time')[:5]]
 
     context = {
         'device': device,
+        'devices': [other async for other in ESPDevice.objects.order_by('pk')],
         'device_status': device_status,
         'active_session': active_session,
         'sessions': sessions,
@@ -61,16 +238,19 @@ def update_device_ip(request):
     if request.method == 'POST':
         ip_address = request.POST.get('ip_address')
         if ip_address:
-            device = ESPDevice.get_default_device()
+            device = get_request_device(request)
+            if device is None:
+                return unknown_device_response()
+            if device.ip_address and device.ip_address != ip_address:
+                status_poller.forget(device.ip_address)
             device.ip_address = ip_address
-            device.save()
+            device.save(update_fields=['ip_address'])
 
             # Test connection
             try:
-                response = requests.get(f"http://{ip_address}/status", timeout=2)
+                response = device_client.status(ip_address)
                 if response.status_code == 200:
-                    device.is_online = True
-                    device.save()
+                    device.set_online(True)
                     return JsonResponse({'status': 'success', 'message': 'Connected successfully'})
             except:
                 pass
@@ -82,42 +262,40 @@ def update_device_ip(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
 @csrf_exempt
-def control_device(request):
+async def control_device(request):
     if request.method == 'POST':
         command = request.POST.get('command')
-        device = ESPDevice.get_default_device()
+        device = await aget_request_device(request)
+        if device is None:
+            return unknown_device_response()
 
         if not device.ip_address or not device.is_online:
             return JsonResponse({'status': 'error', 'message': 'Device is offline or IP not set'})
 
         if command in ['stop', 'release', 'sort_neutral', 'reset_counts']:
             try:
-                payload = {'command': command}
-                response = requests.post(
-                    f"http://{device.ip_address}/control",
-                    json=payload,
-                    timeout=2
-                )
+                response = await device_client.acontrol(device.ip_address, command)
 
                 if response.status_code == 200:
+                    status_poller.refresh(device.ip_address)
+
                     # Handle session management
                     if command == 'release':
                         # Start a new session if none is active
-                        active_session = SortingSession.objects.filter(is_active=True).first()
-                        if not active_session:
-                            SortingSession.objects.create(device=device)
+                        active_session = await sync_to_async(SortingSession.get_or_start)(device)
+                        publish_session(device, active_session)
                     elif command == 'stop':
-                        # End active session
-                        active_session = SortingSession.objects.filter(is_active=True).first()
+                        # End this device's active session
+                        active_session = await SortingSession.aget_active(device)
                         if active_session:
-                            active_session.end_session()
+                            await sync_to_async(active_session.end_session)()
+                        publish_session(device, None)
 
                     return JsonResponse({'status': 'success', 'message': f'Command {command} sent successfully'})
 
                 return JsonResponse({'status': 'error', 'message': 'Failed to send command'})
             except:
-                device.is_online = False
-                device.save()
+                await device.aset_online(False)
                 return JsonResponse({'status': 'error', 'message': 'Device connection failed'})
 
         return JsonResponse({'status': 'error', 'message': 'Invalid command'})
@@ -125,48 +303,37 @@ def control_device(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
 @csrf_exempt
-def sort_tomato(request):
+async def sort_tomato(request):
     if request.method == 'POST':
         tomato_type = request.POST.get('type')
         from_camera = request.POST.get('from_camera') == 'true'
-        device = ESPDevice.get_default_device()
+        device = await aget_request_device(request)
+        if device is None:
+            return unknown_device_response()
 
         if not device.ip_address or not device.is_online:
             return JsonResponse({'status': 'error', 'message': 'Device is offline or IP not set'})
 
         if tomato_type in ['ripe', 'green']:
             try:
-                # Get or create active session
-                active_session = SortingSession.objects.filter(is_active=True).first()
-                if not active_session:
-                    active_session = SortingSession.objects.create(device=device)
-
-                # Record the tomato with source information
-                tomato = Tomato.objects.create(
-                    session=active_session,
-                    is_ripe=(tomato_type == 'ripe')
+                # Record the tomato in the active session
+                active_session = await sync_to_async(record_sort)(
+                    device, tomato_type, source='camera' if from_camera else 'manual'
                 )
 
-                # Add detection source to the payload
-                payload = {
-                    'type': tomato_type,
-                    'from_camera': from_camera
-                }
-
                 # Log the request for debugging
-                logger.info(f"Sending to ESP32 at {device.ip_address}: {payload}")
+                logger.info(f"Sending to ESP32 at {device.ip_address}: {tomato_type} (camera: {from_camera})")
 
                 # Send command to ESP
-                response = requests.post(
-                    f"http://{device.ip_address}/sort",
-                    json=payload,
-                    timeout=2
-                )
+                response = await device_client.asort(device.ip_address, tomato_type, from_camera=from_camera)
 
                 # Log the response for debugging
                 logger.info(f"ESP32 response status: {response.status_code}")
 
                 if response.status_code == 200:
+                    status_poller.refresh(device.ip_address)
+                    counts = session_counts(active_session)
+
                     # Parse the response from ESP32
                     try:
                         esp_data = response.json()
@@ -174,8 +341,8 @@ def sort_tomato(request):
                             'status': 'success',
                             'message': f'Sorted {tomato_type} tomato',
                             'from_camera': from_camera,
-                            'ripe_count': esp_data.get('ripe_count', active_session.ripe_count),
-                            'green_count': esp_data.get('green_count', active_session.green_count),
+                            'ripe_count': esp_data.get('ripe_count', counts['ripe_count']),
+                            'green_count': esp_data.get('green_count', counts['green_count']),
                             'camera_ripe_count': esp_data.get('camera_ripe_count', 0),
                             'camera_green_count': esp_data.get('camera_green_count', 0)
                         })
@@ -185,8 +352,8 @@ def sort_tomato(request):
                             'status': 'success',
                             'message': f'Sorted {tomato_type} tomato',
                             'from_camera': from_camera,
-                            'ripe_count': active_session.ripe_count,
-                            'green_count': active_session.green_count
+                            'ripe_count': counts['ripe_count'],
+                            'green_count': counts['green_count']
                         })
 
                 return JsonResponse({'status': 'error', 'message': 'Failed to send command'})
@@ -198,25 +365,88 @@ def sort_tomato(request):
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
-@csrf_exempt
-def get_status(request):
-    device = ESPDevice.get_default_device()
-    active_session = SortingSession.objects.filter(is_active=True).first()
+def record_sort(device, tomato_type, source='manual', confidence=None):
+    """
+    Record a sorted tomato in the device's active session, starting one if needed.
+
+    The tomato is queued on the event buffer and written with the next
+    batch; session_counts() includes it straight away.
+
+    Returns:
+        SortingSession: The session the tomato was added to
+    """
+    active_session = SortingSession.get_or_start(device)
+    sorts_total.inc(type=tomato_type, source=source)
+    event_buffer.add(
+        active_session.pk,
+        is_ripe=(tomato_type == 'ripe'),
+        source=source,
+        confidence=confidence
+    )
+    publisher.publish('sort', {
+        'device_id': device.pk,
+        'session_id': active_session.pk,
+        'type': tomato_type,
+        'source': source,
+        'confidence': confidence,
+        'timestamp': timezone.now()
+    })
+    publish_session(device, active_session)
+    return active_session
+
+def sort_detection(device, tomato_type, confidence=None):
+    """
+    Sort a confirmed camera detection and record it.
+
+    Release, sort and the delayed stop run on the device's actuation
+    scheduler, so this returns immediately.
+
+    Returns:
+        dict | None: The queued actuation command, or None if the
+        actuation queue is full (nothing is recorded then)
+    """
+    command = get_scheduler(device.pk).schedule_sort(device.ip_address, tomato_type, from_camera=True)
+    if command is not None:
+        record_sort(device, tomato_type, source='camera', confidence=confidence)
+    return command
+
+def publish_session(device, session):
+    """Push a device's active session and its counts, or that none is active."""
+    if session is None:
+        data = {'device_id': device.pk, 'session_active': False}
+    else:
+        data = {
+            'device_id': device.pk,
+            'session_active': True,
+            'session_id': session.pk,
+            **session_counts(session)
+        }
+    publisher.publish('session', data, only_changes=True, key=device.pk)
+
+def session_counts(session):
+    """Return the tomato counts for a session, including buffered sorts."""
+    ripe_pending, green_pending = event_buffer.pending_counts(session.pk)
+    ripe_count = session.ripe_count + ripe_pending
+    green_count = session.green_count + green_pending
+    return {
+        'ripe_count': ripe_count,
+        'green_count': green_count,
+        'total_count': ripe_count + green_count
+    }
+
+async def build_status(device=None):
+    """Return the /api/status/ payload of a device (default: the default device)."""
+    if device is None:
+        device = await ESPDevice.aget_default_device()
+    active_session = await SortingSession.aget_active(device)
 
     status = {
+        'device_id': device.pk,
+        'device_name': device.name,
         'device_online': device.is_online,
         'device_ip': device.ip_address,
         'session_active': active_session is not None,
-        'webcam_config': {
-            'enabled': device.webcam_enabled,
-            'use_webcam': device.use_webcam,
-            'detection_mode': device.detection_mode,
-            'detection_sensitivity': device.detection_sensitivity,
-            'ripe_threshold_min': device.ripe_threshold_min,
-            'ripe_threshold_max': device.ripe_threshold_max,
-            'green_threshold_min': device.green_threshold_min,
-            'green_threshold_max': device.green_threshold_max
-        }
+        'webcam_config': webcam_config(device)
     }
 
     if active_session:
@@ -224,30 +454,279 @@ def get_status(request):
             'session_id': active_session.id,
             'session_start': active_session.start_time.strftime('%Y-%m-%d %H:%M:%S'),
             'session_duration': int(active_session.duration),
-            'ripe_count': active_session.ripe_count,
-            'green_count': active_session.green_count,
-            'total_count': active_session.total_tomatoes
+            **session_counts(active_session)
         })
 
-    # Try to get ESP status
+    # ESP status comes from the poller's cached snapshot
     esp_status = {}
-    if device.ip_address and device.is_online:
-        try:
-            response = requests.get(f"http://{device.ip_address}/status", timeout=2)
-            if response.status_code == 200:
-                esp_status = response.json()
-        except:
-            device.is_online = False
-            device.save()
+    if device.ip_address:
+        snapshot = status_poller.snapshot(device.ip_address)
+        if snapshot['online']:
+            esp_status = snapshot['data']
+        if snapshot['online'] is not None:
+            status['device_online'] = snapshot['online']
+        status['esp_status_meta'] = {
+            'fetched_at': snapshot['fetched_at'],
+            'age': snapshot['age'],
+            'stale': snapshot['stale'],
+            'failures': snapshot['failures'],
+            'error': snapshot['error']
+        }
 
     status['esp_status'] = esp_status
+    status['actuation'] = get_scheduler(device.pk).status()
+    status['detection'] = dict(detection_executor.stats(), gate=presence_gate.stats())
+
+    return status
+
+@csrf_exempt
+async def get_status(request):
+    device = await aget_request_device(request)
+    if device is None:
+        return unknown_device_response()
+    return JsonResponse(await build_status(device))
+
+async def list_devices(request):
+    """
+    Status of every sorter line.
+
+    Each device's ESP32 status comes from its own poller thread, so the
+    snapshots are read without waiting on any device, and the per-device
+    session lookups run concurrently.
+    """
+    devices = [device async for device in ESPDevice.objects.order_by('pk')]
+    statuses = await asyncio.gather(*(build_status(device) for device in devices))
+    return JsonResponse({'devices': statuses})
+
+# /api/stats/ bucket sizes: truncation, minutes per bucket and default range
+STATS_BUCKETS = {
+    'minute': (TruncMinute, 1, datetime.timedelta(hours=1)),
+    'hour': (TruncHour, 60, datetime.timedelta(days=1)),
+    'day': (TruncDay, 1440, datetime.timedelta(days=30)),
+}
+
+def tomato_stats(request):
+    """
+    Ripe/green counts and throughput over time, bucketed by minute, hour or day.
+
+    Query parameters: ``session=<id>`` or ``device=<id>`` (default: the
+    default device), ``bucket`` (minute, hour or day, default hour) and
+    ``start``/``end`` as ISO dates or datetimes. A session defaults to its
+    own span, a device to the last hour, day or 30 days for minute, hour
+    and day buckets. Only buckets with tomatoes are listed.
 
-    return JsonResponse(status)
+    Counts come from summing the per-minute TomatoRollup rows in the
+    database, so a month-long range reads at most one row per session and
+    minute; sorts still in the event buffer appear after the next flush.
+    """
+    bucket = request.GET.get('bucket', 'hour')
+    if bucket not in STATS_BUCKETS:
+        return JsonResponse({'status': 'error', 'message': f'Invalid bucket, use one of {", ".join(STATS_BUCKETS)}'}, status=400)
+    trunc, bucket_minutes, default_range = STATS_BUCKETS[bucket]
+
+    rollups = TomatoRollup.objects.all()
+    scope = {}
+    now = timezone.now()
+    start, end = now - default_range, now
+
+    if request.GET.get('session'):
+        try:
+            session = SortingSession.objects.get(pk=request.GET['session'])
+        except (SortingSession.DoesNotExist, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'Unknown session'}, status=404)
+        rollups = rollups.filter(session=session)
+        scope = {'session_id': session.pk, 'device_id': session.device_id}
+        start, end = session.start_time, session.end_time or now
+    else:
+        device = get_request_device(request)
+        if device is None:
+            return unknown_device_response()
+        rollups = rollups.filter(session__device=device)
+        scope = {'device_id': device.pk}
+
+    try:
+        if request.GET.get('start'):
+            start = parse_time(request.GET['start'])
+        if request.GET.get('end'):
+            end = parse_time(request.GET['end'])
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    # Rollup buckets are minute starts, so include the minute start falls in
+    rows = (
+        rollups.filter(bucket__gte=start.replace(second=0, microsecond=0), bucket__lt=end)
+        .annotate(period=trunc('bucket'))
+        .values('period')
+        .annotate(ripe=Sum('ripe_count'), green=Sum('green_count'))
+        .order_by('period')
+    )
+
+    buckets = []
+    ripe_total = green_total = 0
+    for row in rows:
+        total = row['ripe'] + row['green']
+        ripe_total += row['ripe']
+        green_total += row['green']
+        buckets.append({
+            'start': row['period'],
+            'ripe_count': row['ripe'],
+            'green_count': row['green'],
+            'total_count': total,
+            'per_minute': round(total / bucket_minutes, 2)
+        })
+
+    minutes = max((end - start).total_seconds() / 60, 1)
+    return JsonResponse({
+        'status': 'success',
+        **scope,
+        'bucket': bucket,
+        'start': start,
+        'end': end,
+        'buckets': buckets,
+        'totals': {
+            'ripe_count': ripe_total,
+            'green_count': green_total,
+            'total_count': ripe_total + green_total,
+            'per_minute': round((ripe_total + green_total) / minutes, 2)
+        }
+    })
+
+def export_tomatoes(request):
+    """
+    Stream the Tomato log as CSV or NDJSON.
+
+    Query parameters: ``format`` (csv or ndjson, default csv), ``session``,
+    ``device`` and ``start``/``end`` as ISO dates or datetimes. Rows are
+    read TOMATO_EXPORT_CHUNK_SIZE at a time and sent as they are
+    formatted, so memory use stays flat however long the history is.
+    """
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        return JsonResponse({'status': 'error', 'message': f'Invalid format, use one of {", ".join(EXPORT_FORMATS)}'}, status=400)
+
+    try:
+        session_id = int(request.GET['session']) if request.GET.get('session') else None
+        start = parse_time(request.GET['start']) if request.GET.get('start') else None
+        end = parse_time(request.GET['end']) if request.GET.get('end') else None
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    device_id = None
+    if request_device_id(request) is not None:
+        device = get_request_device(request)
+        if device is None:
+            return unknown_device_response()
+        device_id = device.pk
+
+    rows = export_queryset(session_id=session_id, device_id=device_id, start=start, end=end)
+    chunk_size = getattr(settings, 'TOMATO_EXPORT_CHUNK_SIZE', 2000)
+    # An ASGI server needs an async iterator, or Django reads everything into memory first
+    if isinstance(request, ASGIRequest):
+        content = aiter_export(rows, export_format, chunk_size)
+    else:
+        content = iter_export(rows, export_format, chunk_size)
+
+    content_type, extension = EXPORT_FORMATS[export_format][:2]
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="tomatoes.{extension}"'
+    return response
+
+async def event_stream(request):
+    """
+    Server-sent events for the dashboard.
+
+    Starts with a ``status`` event holding the full /api/status/ payload,
+    then relays ``session``, ``sort``, ``device`` and ``esp_status`` events
+    from the shared publisher as they happen. With ``?device=<id>`` the
+    status is that device's and only its events are relayed; without it
+    events of every device are relayed. Under WSGI a response cannot stay
+    open, so only the ``status`` event is sent and the ``retry`` field
+    makes EventSource reconnect, which degrades to polling.
+    """
+    device = await aget_request_device(request)
+    if device is None:
+        return unknown_device_response()
+    filtered = request_device_id(request) is not None
+
+    if not isinstance(request, ASGIRequest):
+        # Reconnect at the old polling cadence
+        return HttpResponse(
+            "retry: 5000\n\n" + format_sse('status', await build_status(device)),
+            content_type='text/event-stream'
+        )
+
+    subscription = publisher.subscribe()
+    keepalive = getattr(settings, 'TOMATO_SSE_KEEPALIVE', 15.0)
+
+    async def stream():
+        try:
+            yield format_sse('status', await build_status(device))
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(subscription.get(), keepalive)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing the connection, and the
+                    # status poller alive while someone is listening
+                    current = await ESPDevice.aget_device(device.pk)
+                    if current.ip_address:
+                        status_poller.snapshot(current.ip_address)
+                    yield ': keepalive\n\n'
+                    continue
+                if not filtered or event_for_device(data, await ESPDevice.aget_device(device.pk)):
+                    yield format_sse(event, data)
+        finally:
+            publisher.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+# Columns written by update_webcam_config
+WEBCAM_CONFIG_FIELDS = [
+    'webcam_enabled',
+    'detection_mode',
+    'detection_sensitivity',
+    'ripe_threshold_min',
+    'ripe_threshold_max',
+    'green_threshold_min',
+    'green_threshold_max',
+    'roi_x',
+    'roi_y',
+    'roi_width',
+    'roi_height',
+    'detection_width'
+]
+
+def webcam_config(device):
+    """Return the webcam/detection settings reported to the dashboard."""
+    return {
+        'enabled': device.webcam_enabled,
+        'use_webcam': device.use_webcam,
+        'detection_mode': device.detection_mode,
+        'detection_sensitivity': device.detection_sensitivity,
+        'ripe_threshold_min': device.ripe_threshold_min,
+        'ripe_threshold_max': device.ripe_threshold_max,
+        'green_threshold_min': device.green_threshold_min,
+        'green_threshold_max': device.green_threshold_max,
+        'roi': {
+            'x': device.roi_x,
+            'y': device.roi_y,
+            'width': device.roi_width,
+            'height': device.roi_height
+        },
+        'detection_width': device.detection_width,
+        'config_version': device.config_version,
+        'device_id': device.pk
+    }
 
 @csrf_exempt
 def update_webcam_config(request):
     if request.method == 'POST':
-        device = ESPDevice.get_default_device()
+        device = get_request_device(request)
+        if device is None:
+            return unknown_device_response()
+        previous_config = device.detector_config()
 
         # Update webcam settings
         if 'webcam_enabled' in request.POST:
@@ -283,165 +762,233 @@ def update_webcam_config(request):
             except ValueError:
                 pass
 
-        device.save()
+        # Region of interest, in percent of the frame
+        roi_keys = ['roi_x', 'roi_y', 'roi_width', 'roi_height']
+        if all(key in request.POST for key in roi_keys):
+            try:
+                x, y, width, height = (int(request.POST.get(key)) for key in roi_keys)
+                device.roi_x = max(0, min(99, x))
+                device.roi_y = max(0, min(99, y))
+                device.roi_width = max(1, min(100 - device.roi_x, width))
+                device.roi_height = max(1, min(100 - device.roi_y, height))
+            except ValueError:
+                pass
+
+        if 'detection_width' in request.POST:
+            try:
+                device.detection_width = max(0, int(request.POST.get('detection_width')))
+            except ValueError:
+                pass
+
+        update_fields = list(WEBCAM_CONFIG_FIELDS)
+        if device.detector_config() != previous_config:
+            # New detector snapshot for every process that sees this version
+            device.config_version = F('config_version') + 1
+            update_fields.append('config_version')
+
+        device.save(update_fields=update_fields)
+        if 'config_version' in update_fields:
+            device.refresh_from_db(fields=['config_version'])
+        detection_executor.configure(device.detector_config(), device.config_version, device.pk)
 
         return JsonResponse({
             'status': 'success',
             'message': 'Webcam configuration updated',
-            'config': {
-                'enabled': device.webcam_enabled,
-                'detection_mode': device.detection_mode,
-                'detection_sensitivity': device.detection_sensitivity,
-                'ripe_threshold_min': device.ripe_threshold_min,
-                'ripe_threshold_max': device.ripe_threshold_max,
-                'green_threshold_min': device.green_threshold_min,
-                'green_threshold_max': device.green_threshold_max
-            }
+            'config': webcam_config(device)
         })
 
     return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
+async def process_frame(device, image_data, camera='default'):
+    """
+    Run one camera frame through the detection pipeline.
+
+    Unchanged frames reuse the previous result, empty-belt frames are gated,
+    everything else goes to the detection pool. Confirmed ripe/green
+    detections are sorted and recorded.
+
+    Args:
+        device (ESPDevice): Device whose detector config and sorter are used
+        image_data (bytes | memoryview): Encoded frame
+        camera (str): Camera identifier for the frame tracker and gate,
+            scoped to the device
+
+    Returns:
+        dict: Response payload for /api/detect/ and the detection socket
+
+    Raises:
+        DetectorBusy: If the detection pool has no free slot
+    """
+    started = time.perf_counter() if metrics.enabled else None
+    sync_detector_config(device)
+    gate_enabled = getattr(settings, 'TOMATO_GATE_ENABLED', True)
+    camera = f'{device.pk}:{camera}'
+
+    # Frames that did not change since the last one reuse its result
+    fingerprint = await sync_to_async(fingerprint_frame, thread_sensitive=False)(image_data)
+    result = frame_tracker.cached_result(camera, fingerprint, device.config_version)
+    duplicate = result is not None
+    path = 'duplicate'
+
+    if result is None and gate_enabled and presence_gate.is_empty(camera, fingerprint):
+        result = gated_result(device.config_version)
+        path = 'gated'
+
+    if result is None:
+        # Decoding and OpenCV work run in the detection worker pool
+        result = await detection_executor.adetect(image_data, device.pk)
+        path = 'classified'
+
+        # Frames without a tomato teach the gate what the empty belt looks like
+        if gate_enabled and result.get('type') is None and 'error' not in result:
+            presence_gate.learn(camera, fingerprint)
+
+    if started is not None:
+        frame_seconds.observe(time.perf_counter() - started, path='error' if 'error' in result else path)
+
+    if 'error' in result:
+        return {'status': 'error', 'message': result['error']}
+
+    # Sort only once a detection held for confirm_frames frames
+    # Re-posts of the same encoded image do not count as new frames
+    digest = hashlib.blake2b(image_data, digest_size=16).digest()
+    decision = frame_tracker.observe(camera, fingerprint, result, duplicate, digest)
+    detected_type = result.get('type')
+    detection = {
+        'type': detected_type,
+        'confidence': round(result.get('confidence', 0), 1),
+        'contours': result.get('contours', 0),
+        'is_tomato': result.get('is_tomato', False),
+        'config_version': result.get('config_version'),
+        'duplicate': duplicate,
+        'repeat': decision['repeat'],
+        'gated': result.get('gated', False),
+        'streak': decision['streak'],
+        'confirm_frames': decision['confirm_frames']
+    }
+
+    if decision['commit']:
+        # Move the servo just like the button/manual action
+        if device.ip_address and device.is_online:
+            command = await sync_to_async(sort_detection)(device, detected_type, result.get('confidence'))
+            if command is None:
+                return {
+                    'status': 'error',
+                    'message': f'Detected {detected_type} but the actuation queue is full'
+                }
+            return {
+                'status': 'success',
+                'detection': detection,
+                'confirmed': True,
+                'sorted': True,
+                'actuation': command
+            }
+        else:
+            return {
+                'status': 'error',
+                'message': 'Device is offline or IP not set, cannot move servo.'
+            }
+    # Not a tomato, or not confirmed yet: just return the detection
+    return {
+        'status': 'success',
+        'detection': detection,
+        'confirmed': False,
+        'sorted': False
+    }
+
 @csrf_exempt
-def detect_tomato(request):
+async def detect_tomato(request):
     """
     API endpoint for detecting tomatoes in an image.
-    Expects a base64 encoded image in the request body.
+    Accepts a raw JPEG body, a multipart ``image`` upload or a JSON body
+    with a base64 encoded image. ``?device=<id>`` selects the sorter line.
     """
     if request.method == 'POST':
-        global tomato_detector
-
         # Get device configuration
-        device = ESPDevice.get_default_device()
-
-        # Initialize or update detector with current config
-        config = {
-            'ripe_threshold_min': device.ripe_threshold_min,
-            'ripe_threshold_max': device.ripe_threshold_max,
-            'green_threshold_min': device.green_threshold_min,
-            'green_threshold_max': device.green_threshold_max,
-            'detection_sensitivity': device.detection_sensitivity
-        }
-
-        if tomato_detector is None:
-            tomato_detector = TomatoDetector(config)
-        else:
-            tomato_detector.update_config(config)
+        device = await aget_request_device(request)
+        if device is None:
+            return unknown_device_response()
 
         try:
-            # Get base64 image from request
-            data = json.loads(request.body)
-            base64_image = data.get('image')
+            image_data, base64_image = read_image_payload(request)
 
-            if not base64_image:
+            if not image_data and base64_image:
+                image_data = decode_base64(base64_image)
+
+            if not image_data:
                 return JsonResponse({'status': 'error', 'message': 'No image provided'})
 
-            # Process the image
-            result = tomato_detector.detect_from_base64(base64_image)
+            try:
+                payload = await process_frame(device, image_data, request.GET.get('camera', 'default'))
+            except DetectorBusy:
+                return detector_busy_response()
+            return JsonResponse(payload)
 
-            if 'error' in result:
-                return JsonResponse({'status': 'error', 'message': result['error']})
+        except Exception as e:
+            logger.error(f"Error in detect_tomato: {str(e)}")
+            return JsonResponse({'status': 'error', 'message': str(e)})
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
 
-            detected_type = result.get('type')
-            if detected_type in ['ripe', 'green']:
-                # Move the servo just like the button/manual action
-                if device.ip_address and device.is_online:
-                    try:
-                        # First, move the stopper (release)
-                        control_payload = {'command': 'release'}
-                        try:
-                            requests.post(
-                                f"http://{device.ip_address}/control",
-                                json=control_payload,
-                                timeout=2
-                            )
-                        except Exception as stopper_exc:
-                            logger.warning(f"Could not move stopper (release): {stopper_exc}")
-                        payload = {
-                            'type': detected_type,
-                            'from_camera': True
-                        }
-                        # Send command to ESP32 /sort endpoint
-                        response = requests.post(
-                            f"http://{device.ip_address}/sort",
-                            json=payload,
-                            timeout=2
-                        )
-                        # Try to get updated counts from ESP32
-                        if response.status_code == 200:
-                            # After sorting, wait 2 seconds, then close the stopper by sending 'stop' command
-                            import time
-                            try:
-                                time.sleep(2)
-                                stop_payload = {'command': 'stop'}
-                                requests.post(
-                                    f"http://{device.ip_address}/control",
-                                    json=stop_payload,
-                                    timeout=2
-                                )
-                            except Exception as stopper_close_exc:
-                                logger.warning(f"Could not move stopper (stop): {stopper_close_exc}")
-                            try:
-                                esp_data = response.json()
-                                return JsonResponse({
-                                    'status': 'success',
-                                    'detection': {
-                                        'type': detected_type,
-                                        'confidence': round(result.get('confidence', 0), 1),
-                                        'contours': result.get('contours', 0)
-                                    },
-                                    'sorted': True,
-                                    'ripe_count': esp_data.get('ripe_count', 0),
-                                    'green_count': esp_data.get('green_count', 0),
-                                    'camera_ripe_count': esp_data.get('camera_ripe_count', 0),
-                                    'camera_green_count': esp_data.get('camera_green_count', 0)
-                                })
-                            except Exception:
-                                pass
-                        # If ESP32 does not return JSON
-                        # After sorting, wait 2 seconds, then close the stopper by sending 'stop' command
-                        import time
-                        try:
-                            time.sleep(2)
-                            stop_payload = {'command': 'stop'}
-                            requests.post(
-                                f"http://{device.ip_address}/control",
-                                json=stop_payload,
-                                timeout=2
-                            )
-                        except Exception as stopper_close_exc:
-                            logger.warning(f"Could not move stopper (stop): {stopper_close_exc}")
-                        return JsonResponse({
-                            'status': 'success',
-                            'detection': {
-                                'type': detected_type,
-                                'confidence': round(result.get('confidence', 0), 1),
-                                'contours': result.get('contours', 0)
-                            },
-                            'sorted': True
-                        })
-                    except Exception as e:
-                        logger.error(f"Error sending sort command from camera detection: {str(e)}")
-                        return JsonResponse({
-                            'status': 'error',
-                            'message': f'Detected {detected_type} but failed to move servo: {str(e)}'
-                        })
-                else:
-                    return JsonResponse({
-                        'status': 'error',
-                        'message': 'Device is offline or IP not set, cannot move servo.'
-                    })
-            # If not a tomato, just return detection result
+@csrf_exempt
+async def detect_batch(request):
+    """
+    API endpoint for classifying several frames in one request.
+
+    All frames run through the detector as a single task. The response
+    holds the per-frame results and their majority vote; nothing is sorted
+    or recorded, so this is safe for re-grading stored frames.
+    """
+    if request.method == 'POST':
+        device = await aget_request_device(request)
+        if device is None:
+            return unknown_device_response()
+        sync_detector_config(device)
+
+        try:
+            frames = read_batch_payload(request)
+            if not frames:
+                return JsonResponse({'status': 'error', 'message': 'No frames provided'})
+
+            max_frames = getattr(settings, 'TOMATO_DETECTION_BATCH_MAX_FRAMES', 32)
+            if len(frames) > max_frames:
+                return JsonResponse({
+                    'status': 'error',
+                    'message': f'Too many frames ({len(frames)}), the limit is {max_frames}'
+                })
+
+            try:
+                results = await detection_executor.adetect_batch(frames, device.pk)
+            except DetectorBusy:
+                return detector_busy_response()
+
+            decision = majority_vote(results)
             return JsonResponse({
                 'status': 'success',
-                'detection': {
-                    'type': detected_type,
-                    'confidence': round(result.get('confidence', 0), 1),
-                    'contours': result.get('contours', 0)
-                },
-                'sorted': False
+                'results': [
+                    {'error': result['error']} if 'error' in result else {
+                        'type': result.get('type'),
+                        'confidence': round(result.get('confidence', 0), 1),
+                        'contours': result.get('contours', 0),
+                        'is_tomato': result.get('is_tomato', False)
+                    }
+                    for result in results
+                ],
+                'decision': dict(decision, confidence=round(decision['confidence'], 1)),
+                'config_version': results[0].get('config_version')
             })
 
         except Exception as e:
-            logger.error(f"Error in detect_tomato: {str(e)}")
+            logger.error(f"Error in detect_batch: {str(e)}")
             return JsonResponse({'status': 'error', 'message': str(e)})
-    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
\ No newline at end of file
+    return JsonResponse({'status': 'error', 'message': 'Invalid request method'})
+
+def export_metrics(request):
+    """
+    Prometheus text exposition of the in-process metrics.
+
+    Returns 404 unless TOMATO_METRICS_ENABLED is set, in which case nothing
+    is being recorded either.
+    """
+    if not metrics.enabled:
+        return HttpResponse('Metrics are disabled\n', status=404, content_type='text/plain')
+    return HttpResponse(metrics.render(), content_type=METRICS_CONTENT_TYPE)
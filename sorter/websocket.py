@@ -0,0 +1,108 @@
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+
+from .detection_pool import DetectorBusy
+from .events import publisher
+from .models import ESPDevice
+from .views import build_status, event_for_device, process_frame
+
+logger = logging.getLogger(__name__)
+
+
+async def detect_socket(scope, receive, send):
+    """
+    ASGI handler for the ``/ws/detect/`` streaming channel.
+
+    The client sends each camera frame as a binary message (JPEG/PNG). The
+    server answers with JSON text messages carrying an ``event`` key:
+
+    - ``detection``: the /api/detect/ payload for a frame, plus ``dropped``
+    - ``status``: the /api/status/ payload, sent once on connect
+    - ``session``, ``sort``, ``device``, ``esp_status``: relayed from the
+      shared event publisher as they happen (see /api/events/)
+    - ``busy``: the detection pool had no free slot for the frame
+
+    Only one frame per connection is processed at a time. Frames arriving
+    meanwhile replace each other, so a client sending faster than the
+    detector keeps up gets the newest frame detected rather than a growing
+    backlog; the replaced frames are counted in ``dropped``.
+
+    ``?device=<id>`` selects the sorter line (default: the default device);
+    only that device's events are relayed. ``?camera=<name>`` selects the
+    frame tracker and presence gate state.
+    """
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+
+    query = parse_qs(scope.get('query_string', b'').decode())
+    camera = query.get('camera', ['default'])[0]
+    device_id = query.get('device', [None])[0]
+    try:
+        device = await ESPDevice.aget_device(device_id)
+    except (ESPDevice.DoesNotExist, ValueError):
+        # Unknown device: refuse the handshake
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await send({'type': 'websocket.accept'})
+
+    send_lock = asyncio.Lock()
+    frame_ready = asyncio.Event()
+    state = {'frame': None, 'dropped': 0}
+
+    async def send_json(payload):
+        async with send_lock:
+            await send({'type': 'websocket.send', 'text': json.dumps(payload, cls=DjangoJSONEncoder)})
+
+    async def detect_loop():
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            frame, state['frame'] = state['frame'], None
+            if frame is None:
+                continue
+
+            try:
+                current = await ESPDevice.aget_device(device.pk)
+                payload = await process_frame(current, frame, camera)
+            except DetectorBusy:
+                await send_json({'event': 'busy', 'status': 'busy', 'message': 'Detector busy, retry later'})
+                continue
+            except Exception as e:
+                logger.error(f"Error in detect socket: {str(e)}")
+                payload = {'status': 'error', 'message': str(e)}
+
+            await send_json(dict(payload, event='detection', dropped=state['dropped']))
+
+    async def relay_loop():
+        # Long-lived connection: drop stale DB connections like a request would
+        await sync_to_async(close_old_connections)()
+        await send_json(dict(await build_status(device), event='status'))
+        while True:
+            event, data = await subscription.get()
+            if event_for_device(data, await ESPDevice.aget_device(device.pk)):
+                await send_json(dict(data, event=event))
+
+    subscription = publisher.subscribe()
+    tasks = [asyncio.create_task(detect_loop()), asyncio.create_task(relay_loop())]
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] == 'websocket.receive' and message.get('bytes'):
+                if state['frame'] is not None:
+                    state['dropped'] += 1
+                state['frame'] = message['bytes']
+                frame_ready.set()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        publisher.unsubscribe(subscription)
@@ -2,6 +2,9 @@
 ASGI config for tomato project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django; WebSocket connections to ``/ws/detect/`` go to the
+streaming detection handler in ``sorter.websocket``. Serve it with an ASGI
+server such as uvicorn or daphne (``runserver`` does not speak WebSocket).
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.1/howto/deployment/asgi/
@@ -12,5 +15,28 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tomato.settings')
+# Django advises against persistent database connections under ASGI; set
+# before get_asgi_application() loads the settings
+os.environ.setdefault('TOMATO_CONN_MAX_AGE', '0')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, the handler uses models and views
+from sorter.websocket import detect_socket  # noqa: E402
+
+websocket_routes = {
+    '/ws/detect/': detect_socket,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        handler = websocket_routes.get(scope['path'])
+        if handler is None:
+            # Unknown path: refuse the handshake
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+        return await handler(scope, receive, send)
+
+    return await django_application(scope, receive, send)
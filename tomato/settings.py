@@ -133,3 +133,94 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 TEMPLATES[0]['DIRS'].append(os.path.join(BASE_DIR, 'templates'))
+
+# ESP32 status poller: refresh interval, offline backoff ceiling and how long
+# to keep polling after the last dashboard read (seconds)
+TOMATO_STATUS_POLL_INTERVAL = 2.0
+TOMATO_STATUS_MAX_BACKOFF = 30.0
+TOMATO_STATUS_IDLE_TIMEOUT = 60.0
+
+# Seconds an ESPDevice row is served from the in-process cache before it is
+# re-read; saves through the ORM refresh the cache immediately
+TOMATO_DEVICE_CACHE_TTL = 5.0
+
+# Number of ESP32 devices whose keep-alive connection pools are kept open at
+# once; set it at least to the number of sorter lines so none of them has its
+# pool closed and reopened between requests
+TOMATO_DEVICE_POOL_HOSTS = 32
+
+# Sorted tomatoes are written in batches: a flush happens once this many
+# events are pending or the oldest one is this many milliseconds old.
+# Set TOMATO_EVENT_BUFFER_SIZE = 1 to write every tomato immediately.
+TOMATO_EVENT_BUFFER_SIZE = 50
+TOMATO_EVENT_FLUSH_MS = 500
+# Most events held in memory while flushes keep failing; the oldest are
+# dropped beyond this
+TOMATO_EVENT_BUFFER_MAX_PENDING = 10000
+
+# SQLite tuning (see sorter/db.py): 'production' enables WAL,
+# synchronous=NORMAL, a busy timeout and mmap reads on every connection;
+# 'default' leaves SQLite's own settings. Deployments opt in with
+# TOMATO_SQLITE_PROFILE=production in the environment; WAL mode is stored
+# in the database file, so it is not switched on by merely running a
+# management command against a checkout. TOMATO_SQLITE_PRAGMAS overrides
+# individual PRAGMAs, e.g. {'busy_timeout': 10000}.
+TOMATO_SQLITE_PROFILE = os.environ.get('TOMATO_SQLITE_PROFILE', 'default')
+TOMATO_SQLITE_PRAGMAS = {}
+
+# Reuse database connections across requests instead of reopening the file.
+# This only helps under WSGI: Django advises against persistent connections
+# under ASGI, so tomato/asgi.py makes 0 the default there.
+DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('TOMATO_CONN_MAX_AGE', 60))
+DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+
+# Detection worker processes (0 runs detection on a thread in the web
+# process) and how many frames may be queued before /api/detect/ answers
+# 503 "busy" with Retry-After
+TOMATO_DETECTION_WORKERS = 2
+TOMATO_DETECTION_MAX_PENDING = 4
+
+# Most frames accepted by one /api/detect/batch/ request
+TOMATO_DETECTION_BATCH_MAX_FRAMES = 32
+
+# Temporal filtering of camera frames: frames whose 32x24 grayscale
+# thumbnail has no pixel differing from the last classified frame by the
+# threshold (gray levels) reuse its result for up to TOMATO_FRAME_MAX_AGE
+# seconds, and a sort is committed after TOMATO_CONFIRM_FRAMES consistent
+# frames. Uploads byte-identical to one of the last TOMATO_FRAME_HISTORY
+# frames do not count toward the confirmation.
+TOMATO_FRAME_HISTORY = 8
+TOMATO_CONFIRM_FRAMES = 3
+TOMATO_FRAME_DIFF_THRESHOLD = 8
+TOMATO_FRAME_MAX_AGE = 5.0
+
+# Presence gate: frames where fewer than TOMATO_GATE_MIN_CHANGED of the
+# thumbnail pixels differ from the learned empty background by more than
+# TOMATO_GATE_THRESHOLD gray levels are reported empty without running the
+# detector. The comparison is on brightness only, so the threshold has to stay
+# below the brightness difference between a ripe tomato and the belt (about
+# 20 levels for a red tomato on a mid-gray belt).
+TOMATO_GATE_ENABLED = True
+TOMATO_GATE_THRESHOLD = 10
+TOMATO_GATE_MIN_CHANGED = 0.005
+TOMATO_GATE_LEARNING_RATE = 0.05
+
+# Seconds between keepalive comments on the /api/events/ stream
+TOMATO_SSE_KEEPALIVE = 15.0
+
+# Record detector stage timings, ESP32 round-trips and detection counters
+# and serve them in the Prometheus text format at /metrics. When off,
+# nothing is recorded and /metrics answers 404.
+TOMATO_METRICS_ENABLED = os.environ.get('TOMATO_METRICS_ENABLED', '') == '1'
+
+# Tomato rows fetched per database round-trip by /api/export/ and the
+# export_tomatoes command
+TOMATO_EXPORT_CHUNK_SIZE = 2000
+
+# Retention: the archive_tomatoes command moves the Tomato rows of sessions
+# that ended more than TOMATO_RETENTION_DAYS ago to gzipped NDJSON files in
+# TOMATO_ARCHIVE_DIR, deleting TOMATO_RETENTION_BATCH_SIZE rows per
+# transaction. Session counters and per-minute rollups are kept.
+TOMATO_RETENTION_DAYS = 90
+TOMATO_ARCHIVE_DIR = BASE_DIR / 'archive'
+TOMATO_RETENTION_BATCH_SIZE = 500